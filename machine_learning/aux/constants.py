@@ -67,13 +67,13 @@ def get_processed_data_file_header_segregation(for_training = False):
 	3. Remaining columns
 	"""
 
-	from preprocessor.convert_frames_to_episodes import EpisodeFeatures, EpisodeProperties
+	from preprocessor.convert_frames_to_episodes import EpisodeProperties
+	from preprocessor.episode_features import get_feature_names
 
 	# the for_training label
 	training_label = get_training_label_header()
-	# the feature set
-	features = [item.value for item in EpisodeFeatures]
-	features.sort()
+	# the feature set (all the registered episode features, sorted)
+	features = get_feature_names()
 	# required properties
 	properties = [
 		EpisodeProperties.associated_client__mac.value,
@@ -27,6 +27,8 @@ __DATA_CLUSTER_DIR_NAME = 'cluster'
 __LABELED_DATA_CSV_FILE_NAME = 'labeled_data.csv'
 __UNLABELED_DATA_CSV_FILE_NAME = 'unlabeled_data.csv'
 __STRATIFIED_DATA_CSV_FILE_NAME = 'stratified_data.csv'
+__STRATIFIED_DATA_NPY_FILE_NAME = 'stratified_data.npy'
+__EPISODE_STORE_DIR_NAME = 'episode_store'
 
 __SAVED_MODEL_DIR_NAME = 'saved_models'
 __STAGE_1_SAVED_MODEL_DIR_NAME = 'classifier_stage_1'
@@ -56,9 +58,12 @@ data_cluster = os.path.join(data, __DATA_CLUSTER_DIR_NAME)
 stage_1_unlabeled_data_csv_file = os.path.join(data_stage_1, __UNLABELED_DATA_CSV_FILE_NAME)
 stage_1_labeled_data_csv_file = os.path.join(data_stage_1, __LABELED_DATA_CSV_FILE_NAME)
 stage_1_stratified_data_csv_file = os.path.join(data_stage_1, __STRATIFIED_DATA_CSV_FILE_NAME)
+stage_1_stratified_data_npy_file = os.path.join(data_stage_1, __STRATIFIED_DATA_NPY_FILE_NAME)
 stage_2_unlabeled_data_csv_file = os.path.join(data_stage_2, __UNLABELED_DATA_CSV_FILE_NAME)
 stage_2_merged_dataset_csv_file = os.path.join(data_stage_2, __LABELED_DATA_CSV_FILE_NAME)
 stage_2_training_dataset_csv_file = os.path.join(data_stage_2, __STRATIFIED_DATA_CSV_FILE_NAME)
+stage_2_training_dataset_npy_file = os.path.join(data_stage_2, __STRATIFIED_DATA_NPY_FILE_NAME)
+episode_store = os.path.join(data, __EPISODE_STORE_DIR_NAME)
 
 saved_models = os.path.join(project, __SAVED_MODEL_DIR_NAME)
 stage_1_saved_models = os.path.join(saved_models, __STAGE_1_SAVED_MODEL_DIR_NAME)
@@ -0,0 +1,328 @@
+"""
+Columnar store of the processed episodes, shared by the dataset preparation stages
+(instead of one merged csv file per stage).
+
+Layout of a store directory:
+	manifest.json                           columns (and their types), partitions and side columns
+	<split>/<cause>/<source>/<column>.npy   one array per column of a partition (memory mappable)
+	<split>/<cause>/<source>/side/<name>.npy
+where a partition is one processed episode csv file (`source`) of a cause directory (`cause` = 'unlabeled' for
+the testing files), and `split` is 'training' or 'testing'.
+
+Side columns are added to the episodes without rewriting the columns of the store:
+	- by cause: one value per cause (e.g. the training labels of a stage), stored in the manifest
+	- constant: one value for all the episodes (e.g. a dataset tag), stored in the manifest
+	- per episode: one array per partition (e.g. the predictions of a classifier, a training sample mask), the
+	  partitions without an array have a default value (if any). Replacing a partition drops its arrays.
+
+Usage:
+	store = EpisodeStore(directories.episode_store)
+	store.ingest_processed_files()
+	store.set_side_column(get_training_label_header(), by_cause = {'beacon_loss': 2, ...})
+	columns = store.read_columns(feature_names + [get_training_label_header(), ], split = 'training')
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from machine_learning.aux import constants, directories, helpers
+
+__MANIFEST_FILE_NAME = 'manifest.json'
+__SIDE_COLUMNS_DIR_NAME = 'side'
+__CSV_FILES_EXTENSIONS = ('.csv', '.csv.gz', '.csv.zst')
+
+training_split = 'training'
+testing_split = 'testing'
+unlabeled_cause = 'unlabeled'
+
+
+def _get_manifest_file_name():
+	return __MANIFEST_FILE_NAME
+
+
+def _get_side_columns_dir_name():
+	return __SIDE_COLUMNS_DIR_NAME
+
+
+def _get_csv_file_names(directory: str):
+	"""
+	Names of the (processed episode) csv files of a directory, compressed or not, sorted.
+	"""
+
+	return sorted(name for name in os.listdir(directory) if name.endswith(__CSV_FILES_EXTENSIONS))
+
+
+def _to_array(series: pd.Series):
+	"""
+	Typed (memory mappable) array of a column: numbers as they are, text as fixed width unicode (missing values
+	as empty strings, as in the csv files). The column of a file without episodes has no type (an empty float
+	array).
+	"""
+
+	if len(series) == 0:
+		return np.array([], dtype = np.float64)
+	if series.dtype == object:
+		return series.fillna('').astype(str).values.astype(np.str_)
+	return series.values
+
+
+def _from_array(values: np.ndarray):
+	"""
+	Values of a stored column: text as objects, with the missing values (empty strings) as NaN, as read from the
+	csv files (numbers as they are, memory mapped).
+	"""
+
+	if values.dtype.kind != 'U':
+		return values
+	text_values = values.astype(object)
+	text_values[values == ''] = np.nan
+	return text_values
+
+
+class EpisodeStore:
+	"""
+	Columnar store of the processed episodes, partitioned by cause and source file (see the module).
+	"""
+
+	def __init__(self, directory: str):
+		self.directory = os.path.abspath(directory)
+		if not os.path.exists(self.directory):
+			os.makedirs(self.directory)
+
+		manifest_file = os.path.join(self.directory, _get_manifest_file_name())
+		if os.path.exists(manifest_file):
+			with open(manifest_file, 'r') as file:
+				manifest = json.load(file)
+		else:
+			manifest = {'columns': dict(), 'partitions': list(), 'side_columns': dict(), }
+		# column -> dtype
+		self.columns = manifest['columns']
+		# list of dictionaries: path, split, cause, source, n_rows
+		self.partitions = manifest['partitions']
+		# name -> dictionary: kind ('by_cause', 'constant', 'per_episode') and value
+		# (+ partitions with an array and default value for 'per_episode')
+		self.side_columns = manifest['side_columns']
+
+	def __save_manifest(self):
+		manifest_file = os.path.join(self.directory, _get_manifest_file_name())
+		with open(manifest_file + '.tmp', 'w') as file:
+			json.dump({'columns': self.columns, 'partitions': self.partitions, 'side_columns': self.side_columns},
+			          file, indent = 1)
+		os.replace(manifest_file + '.tmp', manifest_file)
+
+	def get_partition(self, path: str):
+		for partition in self.partitions:
+			if partition['path'] == path:
+				return partition
+		return None
+
+	def add_processed_csv_file(self, filepath: str, split: str, cause: str = None, replace: bool = False):
+		"""
+		Adds a processed episode csv file to the store as a partition. Returns the number of episodes added
+		(0 if the partition exists and `replace` is False).
+
+		:param split: `training_split` or `testing_split`
+		:param cause: cause of the episodes of the file (`ASCause` value), None = unlabeled
+		"""
+
+		source = os.path.basename(filepath)
+		path = os.path.join(split, cause if cause is not None else unlabeled_cause, source)
+		partition = self.get_partition(path)
+		if partition is not None:
+			if not replace:
+				return 0
+			self.__remove_partition(partition)
+
+		dataframe = helpers.read_csv_file(filepath)
+		partition_dir = os.path.join(self.directory, path)
+		os.makedirs(partition_dir, exist_ok = True)
+		for column in dataframe.columns:
+			values = _to_array(dataframe[column])
+			np.save(os.path.join(partition_dir, column + '.npy'), values, allow_pickle = False)
+			if column not in self.columns and len(dataframe) > 0:
+				self.columns[column] = values.dtype.kind
+
+		self.partitions.append({
+			'path': path,
+			'split': split,
+			'cause': cause,
+			'source': source,
+			'n_rows': len(dataframe),
+		})
+		self.__save_manifest()
+		return len(dataframe)
+
+	def __remove_partition(self, partition: dict):
+		"""
+		Removes a partition and its arrays (columns and per episode side columns).
+		"""
+
+		self.partitions.remove(partition)
+		shutil.rmtree(os.path.join(self.directory, partition['path']), ignore_errors = True)
+		for side_column in self.side_columns.values():
+			if side_column['kind'] == 'per_episode' and partition['path'] in side_column['partitions']:
+				side_column['partitions'].remove(partition['path'])
+
+	def ingest_processed_files(self, replace: bool = False):
+		"""
+		Adds the processed episode csv files of the training (cause) directories and of the testing directory.
+		Returns the number of episodes added.
+		"""
+
+		n_rows = 0
+		for cause, directory in constants.get_training_data_directories().items():
+			if not os.path.isdir(directory):
+				continue
+			for filename in _get_csv_file_names(directory):
+				n_rows += self.add_processed_csv_file(os.path.join(directory, filename), training_split,
+				                                      cause = cause.value, replace = replace)
+
+		if os.path.isdir(directories.processed_files_testing):
+			for filename in _get_csv_file_names(directories.processed_files_testing):
+				n_rows += self.add_processed_csv_file(os.path.join(directories.processed_files_testing, filename),
+				                                      testing_split, cause = None, replace = replace)
+		return n_rows
+
+	def select_partitions(self, split: str = None, causes: list = None):
+		"""
+		Partitions of a split (None = all) with the given causes (`ASCause` values, None = all).
+		"""
+
+		return [partition for partition in self.partitions
+		        if (split is None or partition['split'] == split) and
+		        (causes is None or partition['cause'] in causes)]
+
+	def set_side_column(self, name: str, by_cause: dict = None, constant = None, per_episode: dict = None,
+	                    default = None):
+		"""
+		Adds (or replaces) a side column, with one of
+			- `by_cause`: cause (`ASCause` value) -> value
+			- `constant`: value of all the episodes
+			- `per_episode`: partition path -> array (one value per episode of the partition)
+
+		:param default: `per_episode` value of the episodes of the other partitions (None = no value, reading
+		                them raises a KeyError)
+		"""
+
+		if name in self.columns:
+			raise ValueError('"{:s}" is a column of the store'.format(name))
+		if by_cause is None and constant is None and per_episode is None:
+			raise ValueError('No values for the side column "{:s}"'.format(name))
+		for path, values in (per_episode or dict()).items():
+			partition = self.get_partition(path)
+			if partition is None or len(values) != partition['n_rows']:
+				raise ValueError('The values of "{:s}" do not match the partition "{:s}"'.format(name, path))
+
+		# drop the arrays of the previous values
+		previous = self.side_columns.get(name)
+		if previous is not None and previous['kind'] == 'per_episode':
+			for path in previous['partitions']:
+				side_file = os.path.join(self.directory, path, _get_side_columns_dir_name(), name + '.npy')
+				if os.path.exists(side_file):
+					os.remove(side_file)
+
+		if by_cause is not None:
+			self.side_columns[name] = {'kind': 'by_cause', 'value': dict(by_cause), }
+		elif constant is not None:
+			self.side_columns[name] = {'kind': 'constant', 'value': constant, }
+		else:
+			for path, values in per_episode.items():
+				side_dir = os.path.join(self.directory, path, _get_side_columns_dir_name())
+				os.makedirs(side_dir, exist_ok = True)
+				np.save(os.path.join(side_dir, name + '.npy'), np.asarray(values), allow_pickle = False)
+			self.side_columns[name] = {'kind': 'per_episode', 'value': None, 'default': default,
+			                           'partitions': sorted(per_episode.keys()), }
+		self.__save_manifest()
+
+	def read_partition_column(self, partition: dict, column: str, mmap: bool = True):
+		"""
+		Values of a column (or side column) for the episodes of a partition (text columns are not memory mapped,
+		see `_from_array`).
+		"""
+
+		mmap_mode = 'r' if mmap else None
+		if column in self.side_columns:
+			side_column = self.side_columns[column]
+			if side_column['kind'] == 'by_cause':
+				if partition['cause'] not in side_column['value']:
+					raise KeyError('"{:s}" has no value for the cause "{}"'.format(column, partition['cause']))
+				return np.full(partition['n_rows'], side_column['value'][partition['cause']])
+			if side_column['kind'] == 'constant':
+				return np.full(partition['n_rows'], side_column['value'])
+			if partition['path'] not in side_column['partitions']:
+				if side_column['default'] is None:
+					raise KeyError('"{:s}" has no values for the partition "{:s}"'.format(column, partition['path']))
+				return np.full(partition['n_rows'], side_column['default'])
+			values = np.load(os.path.join(self.directory, partition['path'], _get_side_columns_dir_name(),
+			                              column + '.npy'), mmap_mode = mmap_mode)
+			if values.shape[0] != partition['n_rows']:
+				raise ValueError('The values of "{:s}" do not match the partition "{:s}" ({:d} values, {:d} episodes)'
+				                 .format(column, partition['path'], values.shape[0], partition['n_rows']))
+			return values
+		return _from_array(np.load(os.path.join(self.directory, partition['path'], column + '.npy'),
+		                           mmap_mode = mmap_mode))
+
+	def iter_partitions(self, columns: list, split: str = None, causes: list = None, mask_column: str = None):
+		"""
+		Yields (partition, dictionary: column -> values) for the selected partitions, reading only the given
+		columns (memory mapped).
+
+		:param mask_column: boolean (side) column, only the episodes where it is True are returned
+		"""
+
+		for partition in self.select_partitions(split, causes):
+			values = {column: self.read_partition_column(partition, column) for column in columns}
+			if mask_column is not None:
+				mask = np.asarray(self.read_partition_column(partition, mask_column), dtype = bool)
+				values = {column: column_values[mask] for column, column_values in values.items()}
+			yield partition, values
+
+	def read_columns(self, columns: list, split: str = None, causes: list = None, mask_column: str = None):
+		"""
+		Values of the given columns (and side columns) of the selected episodes, in partition order (the
+		partitions without episodes are skipped, their columns have no type).
+		Returns a dictionary: column -> array
+
+		:param mask_column: see `iter_partitions`
+		"""
+
+		parts = {column: list() for column in columns}
+		for partition, values in self.iter_partitions(columns, split, causes, mask_column):
+			if partition['n_rows'] == 0:
+				continue
+			for column in columns:
+				parts[column].append(values[column])
+		return {column: np.concatenate(parts[column]) if len(parts[column]) > 0 else np.array([])
+		        for column in columns}
+
+	def read_dataframe(self, columns: list, split: str = None, causes: list = None, mask_column: str = None):
+		"""
+		Same as `read_columns`, as a dataframe.
+		"""
+
+		return pd.DataFrame(self.read_columns(columns, split, causes, mask_column), columns = columns)
+
+	def read_dataset_as_np_arrays(self, for_training: bool, label_column: str = None, split: str = None,
+	                              causes: list = None, mask_column: str = None):
+		"""
+		Same as `helpers.read_dataset_csv_file_as_np_arrays` for the selected episodes of the store.
+
+		:param label_column: side column of the training labels (if `for_training`)
+		"""
+
+		if for_training:
+			feature_set, _, extra_properties = constants.get_processed_data_file_header_segregation(for_training = True)
+			values = self.read_columns(feature_set + [label_column, ] + extra_properties, split, causes, mask_column)
+		else:
+			feature_set, extra_properties = constants.get_processed_data_file_header_segregation(for_training = False)
+			values = self.read_columns(feature_set + extra_properties, split, causes, mask_column)
+
+		features_x = np.column_stack([values[column] for column in feature_set])
+		extra_z = np.column_stack([values[column] for column in extra_properties])
+		if for_training:
+			return features_x, values[label_column], extra_z
+		return features_x, extra_z
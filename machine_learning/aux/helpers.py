@@ -1,17 +1,21 @@
+import json
+import os
+
 import numpy as np
 import pandas as pd
 
 from machine_learning.aux.constants import get_processed_data_file_header_segregation
 
 
-def read_csv_file(filepath, error_bad_lines: bool = False, warn_bad_lines: bool = True):
+def read_csv_file(filepath, error_bad_lines: bool = False, warn_bad_lines: bool = True, chunksize: int = None):
 	"""
 	Read csv file using `pandas` and convert it to a `dataframe`.
 
-	:param filepath: path to the csv file
+	:param filepath: path to the csv file, compressed if the extension is '.gz' or '.zst' (e.g. `.csv.gz`)
 	:param error_bad_lines: raise an error for malformed csv line (False = drop bad lines)
 	:param warn_bad_lines: raise a warning for malformed csv line (only if `error_bad_lines` is False)
-	:return: dataframe object
+	:param chunksize: read the file in chunks of this number of rows (None = at once)
+	:return: dataframe object (an iterator of dataframes if `chunksize` is given)
 	"""
 
 	csv_dataframe = pd.read_csv(
@@ -23,8 +27,9 @@ def read_csv_file(filepath, error_bad_lines: bool = False, warn_bad_lines: bool
 		na_filter = True,  # detect `not available` values
 		skip_blank_lines = True,  # skip any blank lines in the file
 		float_precision = 'high',
-		error_bad_lines = error_bad_lines,
-		warn_bad_lines = warn_bad_lines
+		compression = 'infer',  # gzip / zstandard (streaming), from the extension of the file
+		on_bad_lines = 'error' if error_bad_lines else ('warn' if warn_bad_lines else 'skip'),
+		chunksize = chunksize
 	)
 	return csv_dataframe
 
@@ -55,3 +60,49 @@ def read_dataset_csv_file_as_np_arrays(filepath, for_training: bool):
 		features_x = np.array(dataframe[feature_set])
 		extra_z = np.array(dataframe[extra_properties])
 		return features_x, extra_z
+
+
+def get_training_dataset_metadata_file(filepath):
+	"""
+	Metadata (column names) file of a binary training dataset file: `<name>.npy` -> `<name>.json`
+	"""
+
+	return os.path.splitext(filepath)[0] + '.json'
+
+
+def write_training_dataset(filepath, features_x, target_y, feature_names: list, label_name: str):
+	"""
+	Writes a training dataset as a binary `.npy` file (the features then the label, as `float64` columns in
+	fortran order so each column is contiguous), with its column names in a `.json` metadata file
+	(`get_training_dataset_metadata_file`).
+	"""
+
+	data = np.asfortranarray(np.column_stack((features_x, target_y)), dtype = np.float64)
+	np.save(filepath, data, allow_pickle = False)
+	with open(get_training_dataset_metadata_file(filepath), 'w') as file:
+		json.dump({'features': list(feature_names), 'label': label_name, 'rows': data.shape[0], }, file, indent = 1)
+
+
+def read_training_dataset(filepath, mmap: bool = True):
+	"""
+	Read a training dataset file: a binary `.npy` file (`write_training_dataset`, memory mapped if `mmap`), or a
+	csv file with the label in the last column.
+
+	:return: features (X), label (y)
+	"""
+
+	if os.path.splitext(filepath)[1] == '.npy':
+		data = np.load(filepath, mmap_mode = 'r' if mmap else None, allow_pickle = False)
+	else:
+		data = np.genfromtxt(filepath, delimiter = ',', skip_header = 1)
+	return data[:, :-1], data[:, -1]
+
+
+def read_training_dataset_metadata(filepath):
+	"""
+	Column names of a binary training dataset file: dictionary with the `features` (list), the `label` and the
+	number of `rows`.
+	"""
+
+	with open(get_training_dataset_metadata_file(filepath), 'r') as file:
+		return json.load(file)
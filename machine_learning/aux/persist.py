@@ -1,7 +1,10 @@
 import os
 import uuid
 
-from sklearn.externals import joblib
+try:
+	import joblib
+except ImportError:  # scikit-learn < 0.23 bundles joblib
+	from sklearn.externals import joblib
 
 from machine_learning.aux import directories
 
@@ -0,0 +1,368 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from machine_learning.aux import constants
+from machine_learning.aux.constants import get_processed_data_file_header_segregation
+from machine_learning.aux.persist import load_model, save_model
+from preprocessor.convert_frames_to_episodes import RBSCauses
+
+rbs_tags_column = 'rbs__cause_tags'
+
+# stages of the predictions (`CascadeModel.predict_stages`)
+rbs_rules_stage = 0
+stage_1 = 1
+stage_2 = 2
+
+# name of the episodes that exit at stage 1 as non periodic scans (gating), their cause is not predicted
+other_causes_name = 'other'
+
+
+def get_rbs_rule_causes():
+	"""
+	Mapping from the tags of the rule based system to the causes they indicate, to choose the gating rules of a
+	cascade from (`CascadeModel.set_gating`)
+	"""
+
+	mapping = dict()
+	mapping[RBSCauses.low_rssi.value] = constants.ASCause.lrssi
+	mapping[RBSCauses.data_frame_loss.value] = constants.ASCause.dfl
+	mapping[RBSCauses.power_state.value] = constants.ASCause.pwr_state
+	mapping[RBSCauses.ap_side_procedure.value] = constants.ASCause.apsp
+	mapping[RBSCauses.beacon_loss.value] = constants.ASCause.bl
+	mapping[RBSCauses.successful_association.value] = constants.ASCause.ce
+	return mapping
+
+
+class CascadeModel:
+	"""
+	The stage 1 and stage 2 classifiers as a single model: the episodes that stage 1 doesn't predict as periodic
+	scans are predicted by stage 2. Holds the feature order and the label mappings of both stages, and predicts
+	`ASCause` names.
+
+	Optional gating (`set_gating`), to skip the models for the episodes that are already settled:
+		- rule based system rules: the episodes with one of the configured tags (`rbs__cause_tags`) get the cause
+		  of the tag, without running the models (first matching rule, in the order of the rules)
+		- stage 1 confidence: the episodes stage 1 predicts as non periodic scans with a probability of at least
+		  the threshold exit at stage 1 as `other_causes_name` (their cause is not predicted), only the ambiguous
+		  ones go on to stage 2
+	The gates only skip work: the periodic scans exit at stage 1 as without gating. `evaluate_gating` reports the
+	hit rate of the gates, the stage 2 load they save and the accuracy delta, to choose the threshold (and the
+	rules) knowingly: the lower the threshold, the less stage 2 load and the more episodes without a cause.
+
+	Usage:
+		model = CascadeModel.from_model_files(stage_1_model_file, stage_2_model_file)
+		model.save(cascade_model_file)
+		...
+		model = load_cascade_model(cascade_model_file)
+		names = model.predict_dataframe(episodes_df)
+	"""
+
+	# gating (disabled)
+	stage_1_threshold = None
+	rbs_rules = None
+
+	def __init__(self, stage_1_model, stage_2_model, stage_1_training_labels: dict, stage_2_training_labels: dict,
+	             feature_names: list = None):
+		"""
+		:param stage_1_training_labels: `ASCause` -> stage 1 label (see `classifier_stage_1.prepare_dataset`)
+		:param stage_2_training_labels: `ASCause` -> stage 2 label (see `classifier_stage_2.prepare_dataset`)
+		:param feature_names: order of the features of the models (None = the registered episode features)
+		"""
+
+		if feature_names is None:
+			feature_names, _ = get_processed_data_file_header_segregation(for_training = False)
+		self.stage_1_model = stage_1_model
+		self.stage_2_model = stage_2_model
+		self.feature_names = list(feature_names)
+
+		# stage 1: the periodic scan labels (the other label is predicted by stage 2)
+		pscan_causes = [constants.ASCause.pscan_unassoc, constants.ASCause.pscan_assoc]
+		self.stage_1_names = {stage_1_training_labels[cause]: cause.name for cause in pscan_causes}
+		self.stage_2_names = {label: cause.name for cause, label in stage_2_training_labels.items()}
+
+	@classmethod
+	def from_model_files(cls, stage_1_model_file, stage_2_model_file, feature_names: list = None):
+		"""
+		Cascade of the saved stage 1 and stage 2 models (`persist.save_model`), with the training labels of the
+		stages.
+		"""
+
+		from machine_learning.preprocessing.classifier_stage_1.prepare_dataset import \
+			get_training_labels as get_stage_1_training_labels
+		from machine_learning.preprocessing.classifier_stage_2.prepare_dataset import \
+			get_training_labels as get_stage_2_training_labels
+
+		return cls(load_model(os.path.abspath(stage_1_model_file)), load_model(os.path.abspath(stage_2_model_file)),
+		           get_stage_1_training_labels(), get_stage_2_training_labels(), feature_names = feature_names)
+
+	def set_gating(self, stage_1_threshold: float = None, rbs_rules: dict = None):
+		"""
+		Configures the gates of the cascade (None = disabled).
+
+		:param stage_1_threshold: minimum stage 1 probability of a non periodic scan prediction for the episode to
+		                          exit at stage 1 as `other_causes_name`, without running stage 2 (the ambiguous
+		                          episodes below it are predicted by stage 2)
+		:param rbs_rules: tag of the rule based system (`RBSCauses` value) -> `ASCause`, for high-precision tags
+		                  only (e.g. a subset of `get_rbs_rule_causes`, checked with `evaluate_gating`)
+		"""
+
+		self.stage_1_threshold = stage_1_threshold
+		self.rbs_rules = None if rbs_rules is None else {tag: cause.name for tag, cause in rbs_rules.items()}
+
+	def has_gating(self):
+		"""
+		Whether a gate of the cascade is configured (`set_gating`)
+		"""
+
+		return self.stage_1_threshold is not None or self.rbs_rules is not None
+
+	def get_rbs_rules_names(self, rbs_tags):
+		"""
+		Cause names given by the rule based system rules to episodes (None = no matching rule)
+		"""
+
+		names = np.full(len(rbs_tags), None, dtype = object)
+		if self.rbs_rules is None:
+			return names
+		rbs_tags = np.array(['' if pd.isna(tags) else tags for tags in rbs_tags], dtype = str)
+		# the first matching rule wins
+		for tag, name in reversed(list(self.rbs_rules.items())):
+			names[np.char.find(rbs_tags, tag) >= 0] = name
+		return names
+
+	def get_cause_names(self):
+		"""
+		Names of the causes predicted by the cascade (the columns of `predict_proba`)
+		"""
+
+		return [self.stage_1_names[label] for label in sorted(self.stage_1_names.keys())] + \
+		       [self.stage_2_names[label] for label in sorted(self.stage_2_names.keys())]
+
+	def get_pscan_mask(self, stage_1_labels):
+		"""
+		Boolean mask of the periodic scans in stage 1 predictions
+		"""
+
+		return np.isin(stage_1_labels, list(self.stage_1_names.keys()))
+
+	def __get_models_mask(self, n_episodes, rbs_tags, gating):
+		"""
+		Cause names given by the rule gate (None = not settled) and mask of the episodes left to the models.
+		"""
+
+		names = np.full(n_episodes, None, dtype = object)
+		if gating and rbs_tags is not None and self.rbs_rules is not None:
+			names = self.get_rbs_rules_names(rbs_tags)
+		return names, np.equal(names, None)
+
+	def __predict_stage_1(self, features_x, gating):
+		"""
+		Stage 1 labels of episodes and mask of the episodes that go on to stage 2 (the non periodic scans, only
+		the ambiguous ones with the stage 1 confidence gate).
+		"""
+
+		if gating and self.stage_1_threshold is not None:
+			stage_1_proba = self.stage_1_model.predict_proba(features_x)
+			stage_1_labels = np.array(self.stage_1_model.classes_)[stage_1_proba.argmax(axis = 1)]
+		else:
+			stage_1_proba = None
+			stage_1_labels = np.array(self.stage_1_model.predict(features_x))
+		return stage_1_labels, self.__get_stage_2_mask(stage_1_labels, stage_1_proba, gating)
+
+	def __get_stage_2_mask(self, stage_1_labels, stage_1_proba, gating):
+		stage_2_mask = ~self.get_pscan_mask(stage_1_labels)
+		if gating and self.stage_1_threshold is not None:
+			stage_2_mask &= stage_1_proba.max(axis = 1) < self.stage_1_threshold
+		return stage_2_mask
+
+	def predict_stages(self, features_x, batch_size: int = None, rbs_tags = None, gating: bool = True):
+		"""
+		Predicts the causes of episodes, by batches of `batch_size` episodes (None = at once).
+		Returns
+			1. the stage of the prediction of each episode (`rbs_rules_stage`, `stage_1` or `stage_2`)
+			2. the label of the prediction in that stage (-1 for the rule based system rules)
+			3. the name of the cause (`ASCause` name)
+
+		:param rbs_tags: tags of the rule based system of the episodes (for the rule gate)
+		:param gating: use the gates of the cascade (`set_gating`)
+		"""
+
+		features_x = np.asarray(features_x)
+		if batch_size is not None and features_x.shape[0] > batch_size:
+			batches = [self.predict_stages(features_x[idx:idx + batch_size], gating = gating,
+			                               rbs_tags = None if rbs_tags is None else rbs_tags[idx:idx + batch_size])
+			           for idx in range(0, features_x.shape[0], batch_size)]
+			return tuple(np.concatenate(arrays) for arrays in zip(*batches))
+
+		n_episodes = features_x.shape[0]
+		stages = np.full(n_episodes, rbs_rules_stage)
+		labels = np.full(n_episodes, -1)
+
+		# 1. the episodes settled by the rule based system rules
+		names, models_mask = self.__get_models_mask(n_episodes, rbs_tags, gating)
+		if not models_mask.any():
+			return stages, labels, names
+
+		# 2. stage 1 (periodic scans, and confident non periodic scans with the confidence gate)
+		features_models = features_x[models_mask]
+		stage_1_labels, stage_2_mask = self.__predict_stage_1(features_models, gating)
+		models_labels = np.array(stage_1_labels, copy = True)
+		models_stages = np.where(stage_2_mask, stage_2, stage_1)
+
+		# 3. stage 2 for the other episodes
+		if stage_2_mask.any():
+			models_labels[stage_2_mask] = self.stage_2_model.predict(features_models[stage_2_mask])
+		models_names = np.array([self.stage_2_names[label] if stage == stage_2 else
+		                         self.stage_1_names.get(label, other_causes_name)
+		                         for stage, label in zip(models_stages, models_labels)], dtype = object)
+
+		if models_mask.all():
+			return models_stages, models_labels, models_names
+		labels = labels.astype(np.result_type(labels, models_labels))
+		stages[models_mask] = models_stages
+		labels[models_mask] = models_labels
+		names[models_mask] = models_names
+		return stages, labels, names
+
+	def predict(self, features_x, batch_size: int = None, rbs_tags = None):
+		"""
+		Predicts the causes (`ASCause` names) of episodes, see `predict_stages`.
+		"""
+
+		return self.predict_stages(features_x, batch_size = batch_size, rbs_tags = rbs_tags)[2]
+
+	def evaluate_gating(self, features_x, rbs_tags = None, true_names = None):
+		"""
+		Compares the predictions with and without the gates of the cascade, see `get_gating_report`.
+		"""
+
+		gated_stages, _, gated_names = self.predict_stages(features_x, rbs_tags = rbs_tags, gating = True)
+		stages, _, names = self.predict_stages(features_x, rbs_tags = rbs_tags, gating = False)
+		return get_gating_report(count_gating(gated_stages, gated_names, stages, names, true_names))
+
+	def predict_proba(self, features_x, batch_size: int = None, rbs_tags = None, gating: bool = True):
+		"""
+		Probabilities of the causes of episodes (columns: `get_cause_names`), by batches of `batch_size` episodes.
+		The probability of the non periodic scan causes is the stage 1 probability of the other label, split by
+		stage 2 for the episodes routed to stage 2, and evenly for the other episodes (predicted as periodic scans,
+		or exiting at stage 1 with the confidence gate).
+		With the gates (`set_gating`), the episodes settled by a rule based system rule have the probability 1
+		for the cause of the rule, and stage 2 only runs for the episodes `predict_stages` routes to it.
+
+		:param rbs_tags: tags of the rule based system of the episodes (for the rule gate)
+		:param gating: use the gates of the cascade
+		"""
+
+		features_x = np.asarray(features_x)
+		if batch_size is not None and features_x.shape[0] > batch_size:
+			return np.concatenate([
+				self.predict_proba(features_x[idx:idx + batch_size], gating = gating,
+				                   rbs_tags = None if rbs_tags is None else rbs_tags[idx:idx + batch_size])
+				for idx in range(0, features_x.shape[0], batch_size)])
+
+		cause_names = self.get_cause_names()
+		proba = np.zeros((features_x.shape[0], len(cause_names)))
+		names, models_mask = self.__get_models_mask(features_x.shape[0], rbs_tags, gating)
+		for position in np.flatnonzero(~models_mask):
+			proba[position, cause_names.index(names[position])] = 1.0
+		if models_mask.any():
+			proba[models_mask] = self.__predict_models_proba(features_x[models_mask], gating)
+		return proba
+
+	def __predict_models_proba(self, features_x, gating):
+		stage_1_proba = self.stage_1_model.predict_proba(features_x)
+		stage_1_classes = list(self.stage_1_model.classes_)
+		pscan_labels = sorted(self.stage_1_names.keys())
+		pscan_columns = [stage_1_classes.index(label) for label in pscan_labels]
+		pscan_proba = stage_1_proba[:, pscan_columns]
+		other_proba = 1.0 - pscan_proba.sum(axis = 1)
+
+		stage_2_labels = sorted(self.stage_2_names.keys())
+		stage_2_proba = np.full((features_x.shape[0], len(stage_2_labels)), 1.0 / len(stage_2_labels))
+		stage_2_mask = self.__get_stage_2_mask(np.array(stage_1_classes)[stage_1_proba.argmax(axis = 1)],
+		                                       stage_1_proba, gating)
+		if stage_2_mask.any():
+			stage_2_classes = list(self.stage_2_model.classes_)
+			stage_2_columns = [stage_2_classes.index(label) for label in stage_2_labels]
+			stage_2_proba[stage_2_mask] = self.stage_2_model.predict_proba(features_x[stage_2_mask])[:, stage_2_columns]
+
+		return np.concatenate((pscan_proba, stage_2_proba * other_proba[:, np.newaxis]), axis = 1)
+
+	def predict_dataframe(self, dataframe: pd.DataFrame, batch_size: int = None):
+		"""
+		Predicts the causes (`ASCause` names) of the episodes of a (processed episode) dataframe, with the rule
+		based system tags of the episodes if the dataframe has them.
+		"""
+
+		rbs_tags = dataframe[rbs_tags_column].values if rbs_tags_column in dataframe.columns else None
+		return self.predict(np.array(dataframe[self.feature_names]), batch_size = batch_size, rbs_tags = rbs_tags)
+
+	def save(self, filepath):
+		save_model(self, filepath)
+
+
+def count_gating(gated_stages, gated_names, stages = None, names = None, true_names = None):
+	"""
+	Counts of the predictions of a cascade with its gates (and, if given, without the gates and the true causes),
+	to sum over batches before `get_gating_report`.
+	"""
+
+	counts = {
+		'episodes': len(gated_names),
+		'rbs_rules_hits': np.count_nonzero(gated_stages == rbs_rules_stage),
+		'stage_1_threshold_hits': np.count_nonzero(np.equal(gated_names, other_causes_name)),
+		'stage_1_exits': np.count_nonzero(gated_stages == stage_1),
+		'stage_2_predictions': np.count_nonzero(gated_stages == stage_2),
+	}
+	if names is not None:
+		counts['stage_2_predictions_without_gating'] = np.count_nonzero(stages == stage_2)
+		counts['agreements'] = np.count_nonzero(gated_names == names)
+	if true_names is not None:
+		true_names = np.asarray(true_names, dtype = object)
+		counts['correct'] = np.count_nonzero(gated_names == true_names)
+		if names is not None:
+			counts['correct_without_gating'] = np.count_nonzero(names == true_names)
+	return counts
+
+
+def get_gating_report(counts: dict):
+	"""
+	Report of the gates of a cascade from the (summed) counts of `count_gating`, a dictionary with
+		- the hit rate of each gate (the fraction of the episodes exiting at the gate: `rbs_rules_hit_rate`,
+		  `stage_1_threshold_hit_rate`), the fraction of the episodes exiting at stage 1 (periodic scans
+		  included) and predicted by stage 2
+	and, if the predictions without the gates were counted,
+		- the fraction of the episodes predicted by stage 2 without the gates and the stage 2 load the gates save
+		- the fraction of the predictions the gates don't change
+	and, if the true causes (`ASCause` names) were counted,
+		- the accuracy (with the gates, and without the gates and the difference if they were counted)
+	"""
+
+	n_episodes = max(counts['episodes'], 1)
+	report = {
+		'episodes': counts['episodes'],
+		'rbs_rules_hit_rate': counts['rbs_rules_hits'] / n_episodes,
+		'stage_1_threshold_hit_rate': counts['stage_1_threshold_hits'] / n_episodes,
+		'stage_1_exit_rate': counts['stage_1_exits'] / n_episodes,
+		'stage_2_rate': counts['stage_2_predictions'] / n_episodes,
+	}
+	if 'agreements' in counts:
+		report['stage_2_rate_without_gating'] = counts['stage_2_predictions_without_gating'] / n_episodes
+		report['stage_2_load_saved'] = report['stage_2_rate_without_gating'] - report['stage_2_rate']
+		report['agreement'] = counts['agreements'] / n_episodes
+	if 'correct' in counts:
+		report['accuracy'] = counts['correct'] / n_episodes
+	if 'correct_without_gating' in counts:
+		report['accuracy_without_gating'] = counts['correct_without_gating'] / n_episodes
+		report['accuracy_delta'] = report['accuracy'] - report['accuracy_without_gating']
+	return report
+
+
+def load_cascade_model(filepath):
+	"""
+	Loads a cascade model saved with `CascadeModel.save`
+	"""
+
+	return load_model(os.path.abspath(filepath))
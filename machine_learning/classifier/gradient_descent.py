@@ -1,19 +1,18 @@
 import os
 
-import numpy as np
 from sklearn.linear_model import SGDClassifier
 from sklearn.model_selection import GridSearchCV, StratifiedKFold, train_test_split
 from sklearn.preprocessing import StandardScaler
 
 from machine_learning.aux import directories
+from machine_learning.aux.helpers import read_training_dataset
 from machine_learning.aux.persist import save_model
 from machine_learning.metrics import model_stats
 
 
-def learn_sgd(stratified_data_csv_file, save_filepath):
-	# read the stratified dataset
-	data = np.genfromtxt(stratified_data_csv_file, delimiter = ',', skip_header = 1)
-	X, y = data[:, :-1], data[:, -1]
+def learn_sgd(stratified_data_file, save_filepath):
+	# read the stratified dataset (binary `.npy` file, memory mapped, or csv file)
+	X, y = read_training_dataset(stratified_data_file)
 
 	# do a 70-30 train-test split.
 	X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = 0.30, random_state = 10)
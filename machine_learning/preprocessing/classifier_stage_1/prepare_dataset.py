@@ -1,10 +1,16 @@
+import hashlib
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
+import pandas as pd
 
 from machine_learning.aux import constants, directories, helpers
 from machine_learning.aux.constants import get_processed_data_file_header_segregation, get_training_label_header
+from machine_learning.aux.episode_store import EpisodeStore, training_split
 from machine_learning.aux.helpers import read_dataset_csv_file_as_np_arrays
+from preprocessor import instrumentation
 
 
 def get_training_labels():
@@ -32,13 +38,13 @@ def get_processed_csv_file_names(directory_path):
 	"""
 	Read all the file names present in the given directory
 	"""
-	__supported_extensions = ['.csv', ]
+	__supported_extensions = ('.csv', '.csv.gz', '.csv.zst', )
 
 	processed_csv_file_names = list()
 
 	listdir = os.listdir(directory_path)
 	for file in listdir:
-		if os.path.splitext(file)[1] in __supported_extensions:
+		if file.endswith(__supported_extensions):
 			processed_csv_file_names.append(file)
 
 	# sort so that we always read in a predefined order
@@ -59,89 +65,218 @@ def get_training_label_proportions():
 	return mapping
 
 
-def merge_and_label_processed_csv_files(outfile, training_labels, for_training: bool = True):
+def get_merge_manifest_file(outfile):
+	"""
+	Manifest of the files merged into a merged dataset file (see `merge_and_label_processed_csv_files`)
+	"""
+
+	return outfile + '.manifest.json'
+
+
+def get_file_hash(filepath):
+	"""
+	SHA-1 of the content of a file
+	"""
+
+	sha1 = hashlib.sha1()
+	with open(filepath, 'rb') as file:
+		for block in iter(lambda: file.read(1024 * 1024), b''):
+			sha1.update(block)
+	return sha1.hexdigest()
+
+
+def merge_and_label_processed_csv_files(outfile, training_labels, for_training: bool = True, max_workers: int = None,
+                                        batch_size: int = 64, incremental: bool = True,
+                                        memory_timeline_file: str = None):
 	"""
 	Merges all the csv files in `processed_files` directory in a single csv file.
 		- If `for_training` == True, then the training sub-directory is used and the data is also labeled
 		  according to the folder the files are in.
 		- Else, the testing subdirectory is used.
-	"""
 
-	def label_and_append_processed_csv_file(_filename, _write_filepath, required_columns,
-	                                        _cause = None):
-		_dataframe = helpers.read_csv_file(_filename)
-		_dataframe = _dataframe[required_columns]
+	The files are read concurrently by a pool of threads, in batches of `batch_size` files, and appended to the
+	output file (opened once) by the calling thread, in the order of the files.
 
-		if not os.path.exists(_write_filepath):
-			_should_add_header = True
-		else:
-			_should_add_header = False
+	The contributing files (path, size, mtime, hash, cause, label) and their byte range in the output file are
+	recorded in a manifest (`get_merge_manifest_file`). With `incremental`, the rows of the files unchanged since
+	the last merge (same content and label) are copied from their byte range in the previous output, wherever they
+	are, and only the files added, changed or relabeled are read again: the output is the same as a full rebuild.
 
-		header = list(required_columns)
-		if _cause is not None:
-			head_training = get_training_label_header()
-			_dataframe[head_training] = training_labels[_cause]
-			header.append(head_training)
+	:param max_workers: number of reading threads (None = `concurrent.futures.ThreadPoolExecutor` default)
+	:param batch_size: number of files read (and kept in memory) at once
+	:param incremental: reuse the output of the last merge (False = full rebuild)
+	:param memory_timeline_file: `.json` or `.csv` file for the memory timeline of the run (None = disabled)
+	"""
 
-		_dataframe.to_csv(_write_filepath, mode = 'a', columns = header, header = _should_add_header,
-		                  index = False)
-		return _dataframe.shape[0]
+	with instrumentation.profile_memory(memory_timeline_file):
+		return _merge_and_label_processed_csv_files(outfile, training_labels, for_training, max_workers, batch_size,
+		                                            incremental)
 
+
+def _merge_and_label_processed_csv_files(outfile, training_labels, for_training: bool = True, max_workers: int = None,
+                                         batch_size: int = 64, incremental: bool = True):
 	# required columns
 	# used to choose only the required columns from the input processed episode csv
 	head_features, head_properties = get_processed_data_file_header_segregation(for_training = False)
 	req_columns = head_features + head_properties
 
-	# count of number of instances
-	instance_count = 0
-
+	header = list(req_columns)
 	if for_training:
-		# delete dataset files if they exist
-		directories.delete_file(outfile)
+		header.append(get_training_label_header())
 
+	def read_processed_csv_file(_entry):
+		# the hash of the file, then its content (after the hash, a changed file is detected by the next merge)
+		_entry['hash'] = get_file_hash(_entry['path'])
+		return helpers.read_csv_file(_entry['path'])[req_columns]
+
+	# (cause, measurement stage, input csv files) in the order of the output
+	sources = list()
+	if for_training:
 		# get label info
 		training_data_directories = constants.get_training_data_directories()
-
-		# assign labels and merge
 		for cause, directory in training_data_directories.items():
 			if cause not in training_labels.keys():
 				continue
-
 			csv_filenames = get_processed_csv_file_names(directory)
-			for filename in csv_filenames:
-				csv_filename = os.path.abspath(os.path.join(directory, filename))
-				instance_count += label_and_append_processed_csv_file(csv_filename, outfile,
-				                                                      required_columns = req_columns, _cause = cause)
-
-			print('• Total instance count for cause "{:s}":'.format(cause.name), instance_count)
-			instance_count = 0
+			sources.append((cause, 'merge.' + cause.name,
+			                [os.path.abspath(os.path.join(directory, filename)) for filename in csv_filenames]))
 	else:
-		# delete dataset files if they exist
-		directories.delete_file(outfile)
-
 		# get label info
 		testing_data_directory = directories.processed_files_testing
-
-		# merge
 		csv_filenames = get_processed_csv_file_names(testing_data_directory)
-		for filename in csv_filenames:
-			csv_filename = os.path.abspath(os.path.join(testing_data_directory, filename))
-			instance_count += label_and_append_processed_csv_file(csv_filename, outfile, required_columns = req_columns,
-			                                                      _cause = None)
+		sources.append((None, 'merge.testing',
+		                [os.path.abspath(os.path.join(testing_data_directory, filename)) for filename in csv_filenames]))
+
+	# manifest entries of the files, in the order of the output
+	entries = list()
+	for cause, _, csv_files in sources:
+		for csv_file in csv_files:
+			stat = os.stat(csv_file)
+			entries.append({
+				'path': csv_file,
+				'size': stat.st_size,
+				'mtime': stat.st_mtime_ns,
+				'cause': None if cause is None else cause.value,
+				'label': None if cause is None else int(training_labels[cause]),
+			})
+
+	# the files of the last merge that are still there (the same content and label): path -> (entry, start offset)
+	manifest_file = get_merge_manifest_file(outfile)
+	manifest = None
+	if incremental and os.path.exists(manifest_file) and os.path.exists(outfile):
+		with open(manifest_file, 'r') as file:
+			manifest = json.load(file)
+		if manifest['header'] != header or manifest['size'] != os.path.getsize(outfile):
+			manifest = None
+	merged_entries = dict()
+	if manifest is not None:
+		start = None
+		for merged_entry in manifest['files']:
+			merged_entries[merged_entry['path']] = (merged_entry, start)
+			start = merged_entry['end']
+	n_reused = 0
+	for entry in entries:
+		if entry['path'] not in merged_entries:
+			continue
+		merged_entry, start = merged_entries[entry['path']]
+		if any(entry[key] != merged_entry[key] for key in ('size', 'cause', 'label')):
+			continue
+		# same size, another mtime: compare the content
+		if entry['mtime'] != merged_entry['mtime'] and get_file_hash(entry['path']) != merged_entry['hash']:
+			continue
+		entry.update(hash = merged_entry['hash'], rows = merged_entry['rows'])
+		entry['start'] = start
+		n_reused += 1
+	print('• Files reused from the last merge: {:d} of {:d}'.format(n_reused, len(entries)))
+
+	# the output is written to a temporary file (the reused rows are copied from the last output), which then
+	# replaces the output file; the manifest is written again once the output file is complete
+	directories.delete_file(manifest_file)
+	temp_outfile = outfile + '.tmp'
+	previous_output = open(outfile, 'rb') if n_reused > 0 else None
+	output = open(temp_outfile, 'wb')
+	# single writer: the header, then the files in order
+	pd.DataFrame(columns = header).to_csv(output, header = True, index = False)
+	header_end = output.tell()
+
+	def copy_previous_rows(_entry):
+		# byte range of the file in the last output: from the end of the previous file (or the header) to its end
+		start_offset = header_end if _entry['start'] is None else _entry['start']
+		previous_output.seek(start_offset)
+		remaining = merged_entries[_entry['path']][0]['end'] - start_offset
+		while remaining > 0:
+			block = previous_output.read(min(remaining, 1024 * 1024))
+			if len(block) == 0:
+				raise ValueError('{:s} is shorter than its manifest'.format(outfile))
+			output.write(block)
+			remaining -= len(block)
+
+	with ThreadPoolExecutor(max_workers = max_workers) as executor, output:
+		idx = 0
+		for cause, stage, csv_files in sources:
+			cause_entries = entries[idx:idx + len(csv_files)]
+			idx += len(csv_files)
+
+			# count of number of instances
+			instance_count = 0
+			with instrumentation.measure(stage) as measurement:
+				for batch_idx in range(0, len(cause_entries), batch_size):
+					batch_entries = cause_entries[batch_idx:batch_idx + batch_size]
+					# the files not reused are read concurrently, the files are written in order
+					dataframes = executor.map(read_processed_csv_file,
+					                          [entry for entry in batch_entries if 'rows' not in entry])
+					for entry in batch_entries:
+						if 'rows' in entry:
+							copy_previous_rows(entry)
+							del entry['start']
+							entry['end'] = output.tell()
+							instance_count += entry['rows']
+							continue
+
+						_dataframe = next(dataframes)
+						if cause is not None:
+							_dataframe[get_training_label_header()] = training_labels[cause]
+
+						_dataframe.to_csv(output, columns = header, header = False, index = False)
+						entry.update(rows = _dataframe.shape[0], end = output.tell())
+						instance_count += _dataframe.shape[0]
+				measurement.rows = instance_count
+
+			if cause is not None:
+				print('• Total instance count for cause "{:s}":'.format(cause.name), instance_count)
+			else:
+				print('• Total instance count:', instance_count)
+		size = output.tell()
+	if previous_output is not None:
+		previous_output.close()
+	os.replace(temp_outfile, outfile)
 
-		print('• Total instance count:', instance_count)
+	with open(manifest_file, 'w') as file:
+		json.dump({'header': header, 'size': size, 'files': entries}, file, indent = 1)
 
 
-def create_training_dataset(infile, outfile, proportions):
+def create_training_dataset(infile, outfile, proportions, memory_timeline_file: str = None):
 	"""
 	Creates training dataset using the complete merged dataset file.
+	The training dataset is a binary file if `outfile` is a `.npy` file (see `helpers.read_training_dataset`), a
+	csv file otherwise.
+
+	:param memory_timeline_file: `.json` or `.csv` file for the memory timeline of the run (None = disabled)
 	"""
 
-	X, y, _ = read_dataset_csv_file_as_np_arrays(infile, for_training = True)
+	with instrumentation.profile_memory(memory_timeline_file):
+		return _create_training_dataset(infile, outfile, proportions)
+
+
+def _create_training_dataset(infile, outfile, proportions):
+	with instrumentation.measure('read') as measurement:
+		X, y, _ = read_dataset_csv_file_as_np_arrays(infile, for_training = True)
+		measurement.rows = X.shape[0]
 	print(np.bincount(y.astype(int)))
 
 	# concatenate features and target
-	X_temp = np.concatenate((X, np.vstack(y)), axis = 1)
+	with instrumentation.measure('concatenate'):
+		X_temp = np.concatenate((X, np.vstack(y)), axis = 1)
 
 	X_final = None
 
@@ -164,24 +299,195 @@ def create_training_dataset(infile, outfile, proportions):
 		X_final = X_temp
 
 	if X_final is not None:
-		# required columns (header)
-		head_features, head_training, _ = get_processed_data_file_header_segregation(for_training = True)
-		header = head_features + head_training
-		header_string = ','.join(header)
+		write_training_dataset(outfile, X_final)
+
+
+def write_training_dataset(outfile, X_final):
+	"""
+	Writes a training dataset (features then label columns): a binary file if `outfile` is a `.npy` file (see
+	`helpers.read_training_dataset`), a csv file otherwise.
+	"""
+
+	# required columns (header)
+	head_features, head_training, _ = get_processed_data_file_header_segregation(for_training = True)
+	header = head_features + head_training
+	header_string = ','.join(header)
+	# integers for the counts and the label, floats for the other columns
+	fmt = ','.join('%d' if column.endswith('__count') or column in head_training else '%.18e' for column in header)
+
+	# save array to outfile
+	with instrumentation.measure('write') as measurement:
+		if os.path.splitext(outfile)[1] == '.npy':
+			helpers.write_training_dataset(outfile, X_final[:, :-1], X_final[:, -1], head_features, head_training[0])
+		else:
+			np.savetxt(outfile, X_final, delimiter = ',', header = header_string, comments = '', fmt = fmt)
+		measurement.rows = X_final.shape[0]
+
+
+def create_training_dataset_streaming(infile, outfile, proportions, seed: int = 0, chunksize: int = 100000,
+                                      memory_timeline_file: str = None):
+	"""
+	Creates training dataset like `create_training_dataset`, in one pass over the merged dataset file read in
+	chunks: the memory is bounded by the sample size (and the chunk size), not by the size of the dataset.
 
-		# save array to outfile
-		np.savetxt(
-			outfile, X_final, delimiter = ',', header = header_string, comments = '',
-			fmt = '%d,%d,%d,%d,%d,%d,%.18e,%.18e,%d,%d,%.18e,%.18e,%d,%d'
-		)
+	Each label keeps a reservoir of its `proportions[label]` rows with the smallest random keys (a uniform sample
+	without replacement of the rows of the label, reproducible with `seed`). The training dataset has the rows of
+	each label in the order of `proportions`, in the order of the merged dataset file.
+
+	:param proportions: label -> sample size (None = all the rows of the dataset, in memory)
+	:param seed: seed of the random keys
+	:param chunksize: number of rows read at once
+	:param memory_timeline_file: `.json` or `.csv` file for the memory timeline of the run (None = disabled)
+	"""
+
+	with instrumentation.profile_memory(memory_timeline_file):
+		return _create_training_dataset_streaming(infile, outfile, proportions, seed, chunksize)
+
+
+def _create_training_dataset_streaming(infile, outfile, proportions, seed: int = 0, chunksize: int = 100000):
+	feature_set, target_set, _ = get_processed_data_file_header_segregation(for_training = True)
+	random_state = np.random.default_rng(seed)
+
+	# label -> (random keys, rows (features then label), positions in the file) of the reservoir
+	reservoirs = dict()
+	label_counts = np.zeros(0, dtype = int)
+	position = 0
+	with instrumentation.measure('sample') as measurement:
+		for chunk in helpers.read_csv_file(infile, chunksize = chunksize):
+			rows = np.concatenate((np.array(chunk[feature_set]), np.array(chunk[target_set])), axis = 1)
+			y = rows[:, -1]
+			keys = random_state.random(rows.shape[0])
+			positions = np.arange(position, position + rows.shape[0])
+			position += rows.shape[0]
+
+			chunk_label_counts = np.bincount(y.astype(int))
+			label_counts = np.pad(label_counts, (0, max(0, chunk_label_counts.shape[0] - label_counts.shape[0])))
+			label_counts[:chunk_label_counts.shape[0]] += chunk_label_counts
+
+			labels = proportions.keys() if proportions is not None else np.unique(y)
+			for label in labels:
+				label_idx = np.flatnonzero(y == label)
+				if label_idx.shape[0] == 0 or proportions is not None and proportions[label] <= 0:
+					continue
+				if label in reservoirs:
+					reservoir_keys, reservoir_rows, reservoir_positions = reservoirs[label]
+					reservoir_keys = np.concatenate((reservoir_keys, keys[label_idx]))
+					reservoir_rows = np.concatenate((reservoir_rows, rows[label_idx]))
+					reservoir_positions = np.concatenate((reservoir_positions, positions[label_idx]))
+				else:
+					reservoir_keys, reservoir_rows, reservoir_positions = \
+						keys[label_idx], rows[label_idx], positions[label_idx]
+
+				# keep the rows with the smallest keys
+				if proportions is not None and reservoir_keys.shape[0] > proportions[label]:
+					keep = np.argpartition(reservoir_keys, proportions[label] - 1)[:proportions[label]]
+					reservoir_keys, reservoir_rows, reservoir_positions = \
+						reservoir_keys[keep], reservoir_rows[keep], reservoir_positions[keep]
+				reservoirs[label] = (reservoir_keys, reservoir_rows, reservoir_positions)
+		measurement.rows = position
+	print(label_counts)
+
+	# the samples of the labels, in file order
+	samples = list()
+	for label in (proportions.keys() if proportions is not None else sorted(reservoirs.keys())):
+		if label not in reservoirs:
+			continue
+		_, reservoir_rows, reservoir_positions = reservoirs[label]
+		samples.append(reservoir_rows[np.argsort(reservoir_positions)])
+
+	if len(samples) > 0:
+		write_training_dataset(outfile, np.concatenate(samples))
 
 
 # dataframe = pd.DataFrame(data = X_final, columns = header)
 # dataframe.to_csv(outfile, sep = ',', columns = header, header = True, index = False, mode = 'w')
 
 
+def get_store_label_column():
+	"""
+	Side column of the stage 1 training labels in the episode store
+	"""
+
+	return 'stage_1_' + get_training_label_header()
+
+
+def get_store_sample_column():
+	"""
+	Side column of the stage 1 training sample (mask) in the episode store
+	"""
+
+	return 'stage_1_sample'
+
+
+def label_episode_store(store: EpisodeStore, training_labels):
+	"""
+	Labels the training episodes of the store according to their cause (a side column, instead of a merged csv
+	file). Returns the causes (`ASCause` values) of the labeled episodes.
+	"""
+
+	labels = {cause.value: label for cause, label in training_labels.items()}
+	store.set_side_column(get_store_label_column(), by_cause = labels)
+	for cause in training_labels.keys():
+		n_episodes = sum(partition['n_rows'] for partition in store.select_partitions(training_split, [cause.value]))
+		print('• Total instance count for cause "{:s}":'.format(cause.name), n_episodes)
+	return list(labels.keys())
+
+
+def create_training_sample(store: EpisodeStore, training_labels, proportions, memory_timeline_file: str = None):
+	"""
+	Same as `create_training_dataset` on the labeled episodes of the store (`label_episode_store`): the training
+	sample is stored as a side (mask) column, read with
+		store.read_dataset_as_np_arrays(True, get_store_label_column(), training_split, causes,
+		                                mask_column = get_store_sample_column())
+
+	:param memory_timeline_file: `.json` or `.csv` file for the memory timeline of the run (None = disabled)
+	"""
+
+	with instrumentation.profile_memory(memory_timeline_file):
+		return _create_training_sample(store, training_labels, proportions)
+
+
+def _create_training_sample(store: EpisodeStore, training_labels, proportions):
+	causes = [cause.value for cause in training_labels.keys()]
+	partitions = store.select_partitions(training_split, causes)
+	label_column = get_store_label_column()
+
+	with instrumentation.measure('read') as measurement:
+		y = store.read_columns([label_column, ], training_split, causes)[label_column]
+		measurement.rows = y.shape[0]
+	print(np.bincount(y.astype(int)))
+
+	# stratify if proportions are given
+	if proportions is not None:
+		mask = np.zeros(y.shape[0], dtype = bool)
+		for label, sample_size in proportions.items():
+			label_idx = np.flatnonzero(y == label)
+			if label_idx.shape[0] == 0:
+				continue
+
+			# choose sample
+			sample_size = min(label_idx.shape[0], sample_size)
+			mask[np.random.choice(label_idx, sample_size, replace = False)] = True
+	else:
+		mask = np.ones(y.shape[0], dtype = bool)
+
+	# one mask per partition (in the order of `read_columns`)
+	with instrumentation.measure('write') as measurement:
+		ends = np.cumsum([partition['n_rows'] for partition in partitions])
+		starts = ends - [partition['n_rows'] for partition in partitions]
+		store.set_side_column(get_store_sample_column(), per_episode = {
+			partition['path']: mask[start:end] for partition, start, end in zip(partitions, starts, ends)},
+		                       default = False)
+		measurement.rows = int(mask.sum())
+
+
 if __name__ == '__main__':
 	# merge_and_label_processed_csv_files(directories.stage_1_labeled_data_csv_file, get_training_labels(), True)
 	# create_training_dataset(directories.stage_1_labeled_data_csv_file, directories.stage_1_stratified_data_csv_file,
 	#                         None)
+	# or, with the episode store (no merged csv files):
+	# store = EpisodeStore(directories.episode_store)
+	# store.ingest_processed_files()
+	# label_episode_store(store, get_training_labels())
+	# create_training_sample(store, get_training_labels(), get_training_label_proportions())
 	pass
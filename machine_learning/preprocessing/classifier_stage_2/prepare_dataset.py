@@ -1,13 +1,16 @@
 import os
 
 import numpy as np
+import pandas as pd
 
 from machine_learning.aux import constants, helpers
-from machine_learning.aux.constants import get_processed_data_file_header_segregation
-from machine_learning.aux.helpers import read_dataset_csv_file_as_np_arrays
+from machine_learning.aux.constants import get_processed_data_file_header_segregation, get_training_label_header
+from machine_learning.aux.episode_store import EpisodeStore
 from machine_learning.aux.persist import load_model
+from machine_learning.cascade_model import CascadeModel, load_cascade_model, rbs_tags_column, stage_2
 from machine_learning.preprocessing.classifier_stage_1.prepare_dataset import get_training_labels as get_stage_1_training_labels, \
 	merge_and_label_processed_csv_files
+from preprocessor import instrumentation
 
 
 def get_training_labels():
@@ -54,12 +57,12 @@ def get_processed_csv_file_names(directory_path):
 	Read all the file names present in the given directory
 	"""
 
-	__supported_extensions = ['.csv', ]
+	__supported_extensions = ('.csv', '.csv.gz', '.csv.zst', )
 
 	processed_csv_file_names = list()
 	listdir = os.listdir(directory_path)
 	for file in listdir:
-		if os.path.splitext(file)[1] in __supported_extensions:
+		if file.endswith(__supported_extensions):
 			processed_csv_file_names.append(file)
 
 	# sort so that we always read in a predefined order
@@ -68,59 +71,208 @@ def get_processed_csv_file_names(directory_path):
 	return processed_csv_file_names
 
 
-def identify_pscans_using_stage_1_classifier(infile, outfile, classifier_filepath, for_training):
+def get_pscan_mask(y_pred):
 	"""
-	Removes periodic scan instances from the training dataset using stage 1 classifier
+	Boolean mask of the periodic scans predicted by the stage 1 classifier (associated or not)
 	"""
 
-	def remove_unassociated_pscans(_dataframe, _pred):
-		pass
+	# stage 1 training labels
+	stage_1_training_labels = get_stage_1_training_labels()
+	pscan_labels = [stage_1_training_labels[constants.ASCause.pscan_unassoc],
+	                stage_1_training_labels[constants.ASCause.pscan_assoc]]
+	return np.isin(y_pred, pscan_labels)
 
-	def remove_pscans(_dataframe, pred):
-		# stage 1 training labels
-		stage_1_training_labels = get_stage_1_training_labels()
 
-		indexes_to_drop = list()
-		for idx, label in enumerate(pred):
-			if label == stage_1_training_labels[constants.ASCause.pscan_unassoc]:
-				indexes_to_drop.append(idx)
+def identify_pscans_using_stage_1_classifier(infile, outfile, classifier_filepath, for_training,
+                                             chunksize: int = 100000, memory_timeline_file: str = None):
+	"""
+	Removes periodic scan instances from the training dataset using stage 1 classifier.
+	The input file is read once, in chunks of `chunksize` rows, and the remaining rows are written in their
+	original order.
+
+	:param memory_timeline_file: `.json` or `.csv` file for the memory timeline of the run (None = disabled)
+	"""
 
-		for idx, label in enumerate(pred):
-			if label == stage_1_training_labels[constants.ASCause.pscan_assoc]:
-				indexes_to_drop.append(idx)
+	with instrumentation.profile_memory(memory_timeline_file):
+		return _identify_pscans_using_stage_1_classifier(infile, outfile, classifier_filepath, for_training, chunksize)
 
-		indexes_to_keep = set(range(_dataframe.shape[0])) - set(indexes_to_drop)
-		return _dataframe.take(list(indexes_to_keep))
 
+def _identify_pscans_using_stage_1_classifier(infile, outfile, classifier_filepath, for_training,
+                                              chunksize: int = 100000):
 	infile = os.path.abspath(infile)
 	outfile = os.path.abspath(outfile)
 	classifier_filepath = os.path.abspath(classifier_filepath)
-	classifier = load_model(classifier_filepath)
-
-	# read the data to predict labels for
-	features_x, _ = read_dataset_csv_file_as_np_arrays(filepath = infile, for_training = False)
-	y_pred = classifier.predict(features_x)
+	with instrumentation.measure('load_model'):
+		classifier = load_model(classifier_filepath)
 
-	# some insight
-	n_pred = y_pred.shape[0]
-	print('• Periodic Scans prediction count: {}'.format(np.bincount(y_pred.astype(int))))
-	print('• Periodic Scans prediction proportion: {}'.format(np.divide(np.bincount(y_pred.astype(int)), n_pred)))
-
-	# read in the datafile
-	dataframe = helpers.read_csv_file(infile)
-	print('• Dataframe shape before dropping identified pscans:', dataframe.shape)
-	# remove per_scans
-	dataframe = remove_pscans(dataframe, y_pred)
-	print('• Dataframe shape after dropping identified pscans:', dataframe.shape)
-
-	# write the file back
+	# header of the output
 	if for_training:
 		head_features, head_training, head_properties = get_processed_data_file_header_segregation(for_training = True)
 		header = head_features + head_properties + head_training
 	else:
 		head_features, head_properties = get_processed_data_file_header_segregation(for_training = False)
 		header = head_features + head_properties
-	dataframe.to_csv(outfile, columns = header, header = True, index = False, mode = 'w')
+
+	n_pred = 0
+	n_kept = 0
+	pred_counts = np.zeros(0, dtype = int)
+	with open(outfile, 'w', newline = '') as output:
+		pd.DataFrame(columns = header).to_csv(output, header = True, index = False)
+
+		for dataframe in helpers.read_csv_file(infile, chunksize = chunksize):
+			# predict the labels of the chunk
+			with instrumentation.measure('predict') as measurement:
+				y_pred = classifier.predict(np.array(dataframe[head_features]))
+				measurement.rows = y_pred.shape[0]
+
+			chunk_pred_counts = np.bincount(y_pred.astype(int))
+			pred_counts = np.pad(pred_counts, (0, max(0, chunk_pred_counts.shape[0] - pred_counts.shape[0])))
+			pred_counts[:chunk_pred_counts.shape[0]] += chunk_pred_counts
+
+			# remove per_scans (in order)
+			with instrumentation.measure('remove_pscans') as measurement:
+				dataframe = dataframe[~get_pscan_mask(y_pred)]
+				measurement.rows = dataframe.shape[0]
+
+			# write the chunk
+			with instrumentation.measure('write'):
+				dataframe.to_csv(output, columns = header, header = False, index = False)
+			n_pred += y_pred.shape[0]
+			n_kept += dataframe.shape[0]
+
+	# some insight
+	print('• Periodic Scans prediction count: {}'.format(pred_counts))
+	print('• Periodic Scans prediction proportion: {}'.format(np.divide(pred_counts, max(n_pred, 1))))
+	print('• Instances before dropping identified pscans:', n_pred)
+	print('• Instances after dropping identified pscans:', n_kept)
+
+
+def predict_causes_using_cascade(infile, outfile, stage_1_classifier_filepath, stage_2_classifier_filepath,
+                                 chunksize: int = 100000, memory_timeline_file: str = None):
+	"""
+	Predicts the causes of the episodes of a processed (or merged) csv file with the stage 1 classifier, then the
+	stage 2 classifier for the episodes that are not periodic scans (`CascadeModel`), in one pass over the file
+	(in chunks of `chunksize` rows, without an intermediate reduced file).
+
+	The output has the features and properties of the episodes (in their original order), the stage of the final
+	prediction (`prediction__stage`), its label in that stage (`prediction__label`) and the name of the cause
+	(`prediction__name`, `ASCause` name). The gates of a saved cascade are used (`CascadeModel.set_gating`), with
+	the rule based system tags of the file if it has them (stage 0 = settled by a rule).
+
+	:param stage_1_classifier_filepath: saved stage 1 model, or a saved `CascadeModel` (then
+	                                    `stage_2_classifier_filepath` is None)
+	:param memory_timeline_file: `.json` or `.csv` file for the memory timeline of the run (None = disabled)
+	"""
+
+	with instrumentation.profile_memory(memory_timeline_file):
+		return _predict_causes_using_cascade(infile, outfile, stage_1_classifier_filepath,
+		                                     stage_2_classifier_filepath, chunksize)
+
+
+def _predict_causes_using_cascade(infile, outfile, stage_1_classifier_filepath, stage_2_classifier_filepath,
+                                  chunksize: int = 100000):
+	infile = os.path.abspath(infile)
+	outfile = os.path.abspath(outfile)
+	with instrumentation.measure('load_model'):
+		if stage_2_classifier_filepath is None:
+			cascade_model = load_cascade_model(stage_1_classifier_filepath)
+		else:
+			cascade_model = CascadeModel.from_model_files(stage_1_classifier_filepath, stage_2_classifier_filepath)
+
+	head_features, head_properties = get_processed_data_file_header_segregation(for_training = False)
+	header = head_features + head_properties + ['prediction__stage', 'prediction__label', 'prediction__name', ]
+
+	n_pred = 0
+	n_stage_2 = 0
+	with open(outfile, 'w', newline = '') as output:
+		pd.DataFrame(columns = header).to_csv(output, header = True, index = False)
+
+		for dataframe in helpers.read_csv_file(infile, chunksize = chunksize):
+			# stage 1, then stage 2 for the episodes that are not periodic scans
+			with instrumentation.measure('predict') as measurement:
+				rbs_tags = dataframe[rbs_tags_column].values if rbs_tags_column in dataframe.columns else None
+				stages, labels, names = cascade_model.predict_stages(np.array(dataframe[cascade_model.feature_names]),
+				                                                     rbs_tags = rbs_tags)
+				measurement.rows = labels.shape[0]
+
+			# write the chunk
+			with instrumentation.measure('write'):
+				dataframe = dataframe[head_features + head_properties]
+				dataframe = dataframe.assign(prediction__stage = stages, prediction__label = labels,
+				                             prediction__name = names)
+				dataframe.to_csv(output, columns = header, header = False, index = False)
+			n_pred += labels.shape[0]
+			n_stage_2 += int((stages == stage_2).sum())
+
+	print('• Episodes predicted: {:d} ({:d} by the stage 2 classifier)'.format(n_pred, n_stage_2))
+
+
+def get_store_label_column():
+	"""
+	Side column of the stage 2 training labels in the episode store
+	"""
+
+	return 'stage_2_' + get_training_label_header()
+
+
+def get_store_candidate_column():
+	"""
+	Side column (mask) of the episodes that are not identified as periodic scans by the stage 1 classifier, in the
+	episode store
+	"""
+
+	return 'stage_2_candidate'
+
+
+def label_episode_store(store: EpisodeStore, training_labels):
+	"""
+	Labels the training episodes of the store according to their cause (a side column, instead of a merged csv
+	file).
+	"""
+
+	store.set_side_column(get_store_label_column(),
+	                      by_cause = {cause.value: label for cause, label in training_labels.items()})
+
+
+def identify_pscans_in_episode_store(store: EpisodeStore, classifier_filepath, split: str = None,
+                                     memory_timeline_file: str = None):
+	"""
+	Same as `identify_pscans_using_stage_1_classifier` on the episodes of a split of the store (None = all): the
+	episodes that are not periodic scans are marked in a side (mask) column instead of written to a new csv file,
+	and read with `mask_column = get_store_candidate_column()`.
+
+	:param memory_timeline_file: `.json` or `.csv` file for the memory timeline of the run (None = disabled)
+	"""
+
+	with instrumentation.profile_memory(memory_timeline_file):
+		return _identify_pscans_in_episode_store(store, classifier_filepath, split)
+
+
+def _identify_pscans_in_episode_store(store: EpisodeStore, classifier_filepath, split: str = None):
+	classifier_filepath = os.path.abspath(classifier_filepath)
+	with instrumentation.measure('load_model'):
+		classifier = load_model(classifier_filepath)
+
+	feature_set, _ = get_processed_data_file_header_segregation(for_training = False)
+	candidates = dict()
+	n_pred = 0
+	n_candidates = 0
+	# predict partition by partition (only the features are read)
+	for partition, values in store.iter_partitions(feature_set, split):
+		if partition['n_rows'] == 0:
+			candidates[partition['path']] = np.zeros(0, dtype = bool)
+			continue
+		with instrumentation.measure('predict') as measurement:
+			y_pred = classifier.predict(np.column_stack([values[column] for column in feature_set]))
+			measurement.rows = y_pred.shape[0]
+		candidates[partition['path']] = ~get_pscan_mask(y_pred)
+		n_pred += y_pred.shape[0]
+		n_candidates += int(candidates[partition['path']].sum())
+
+	with instrumentation.measure('write'):
+		store.set_side_column(get_store_candidate_column(), per_episode = candidates, default = False)
+	print('• Episode count before dropping identified pscans:', n_pred)
+	print('• Episode count after dropping identified pscans:', n_candidates)
 
 
 if __name__ == '__main__':
@@ -2,8 +2,10 @@ import os
 
 from machine_learning.aux import constants, directories
 from machine_learning.aux.constants import get_processed_data_file_header_segregation, get_dataset_label_header
+from machine_learning.aux.episode_store import EpisodeStore
 from machine_learning.aux.helpers import read_csv_file
 from machine_learning.preprocessing.classifier_stage_1.prepare_dataset import merge_and_label_processed_csv_files
+from preprocessor import instrumentation
 
 
 def get_training_labels():
@@ -32,28 +34,51 @@ def get_training_labels():
 	return mapping
 
 
-def add_column_to_csv(infile, outfile, col_name, col_value):
+def add_column_to_csv(infile, outfile, col_name, col_value, memory_timeline_file: str = None):
 	"""
 	Adds a column to given csv with same value over all rows
+
+	:param memory_timeline_file: `.json` or `.csv` file for the memory timeline of the run (None = disabled)
 	"""
 
+	with instrumentation.profile_memory(memory_timeline_file):
+		_add_column_to_csv(infile, outfile, col_name, col_value)
+
+
+def _add_column_to_csv(infile, outfile, col_name, col_value):
 	infile = os.path.abspath(infile)
 	outfile = os.path.abspath(outfile)
 
-	in_dataframe = read_csv_file(infile)
+	with instrumentation.measure('read') as measurement:
+		in_dataframe = read_csv_file(infile)
+		measurement.rows = in_dataframe.shape[0]
 	in_dataframe[col_name] = col_value
 
 	head_features, head_training, head_properties = get_processed_data_file_header_segregation(for_training = True)
 	req_columns = head_features + head_properties + head_training
 	req_columns.append(col_name)
 
-	in_dataframe.to_csv(outfile, mode = 'w', columns = req_columns, header = True, index = False)
+	with instrumentation.measure('write') as measurement:
+		in_dataframe.to_csv(outfile, mode = 'w', columns = req_columns, header = True, index = False)
+		measurement.rows = in_dataframe.shape[0]
+
+
+def add_column_to_episode_store(store: EpisodeStore, col_name, col_value):
+	"""
+	Same as `add_column_to_csv` for the episodes of the store: the column is a constant side column (stored in the
+	manifest of the store, no episode is rewritten)
+	"""
+
+	store.set_side_column(col_name, constant = col_value)
 
 
 if __name__ == '__main__':
 	_f1 = os.path.join(directories.data_cluster, 'rw_temp.csv')
 	_f2 = os.path.join(directories.data_cluster, 'realworld.csv')
 
-	merge_and_label_processed_csv_files(_f1, get_training_labels(), True)
-	add_column_to_csv(_f1, _f2, get_dataset_label_header(), 2)
+	# memory_timeline_file = <`.json` or `.csv` file> to profile the memory of a step
+	merge_and_label_processed_csv_files(_f1, get_training_labels(), True, memory_timeline_file = None)
+	add_column_to_csv(_f1, _f2, get_dataset_label_header(), 2, memory_timeline_file = None)
+	# or, with the episode store (no merged csv files):
+	# add_column_to_episode_store(EpisodeStore(directories.episode_store), get_dataset_label_header(), 2)
 	pass
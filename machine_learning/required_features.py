@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+
+from machine_learning.aux.constants import get_processed_data_file_header_segregation
+from machine_learning.aux.persist import load_model
+from preprocessor.episode_features import write_required_features_file
+
+
+def get_features_used_by_model(model, feature_names: list = None):
+	"""
+	Returns the names of the features a trained model actually uses.
+	  - tree based models (and ensembles of trees): features with a non zero importance
+	  - linear models: features with a non zero coefficient (for any class)
+	  - others: all the features
+
+	:param model: trained model
+	:param feature_names: feature names in the order of the model input (None = the ML feature set)
+	"""
+
+	if feature_names is None:
+		feature_names, _ = get_processed_data_file_header_segregation(for_training = False)
+
+	# unwrap grid searches / pipelines
+	if hasattr(model, 'best_estimator_'):
+		model = model.best_estimator_
+
+	if hasattr(model, 'feature_importances_'):
+		used = np.asarray(model.feature_importances_) > 0
+	elif hasattr(model, 'coef_'):
+		used = np.any(np.atleast_2d(model.coef_) != 0, axis = 0)
+	else:
+		return list(feature_names)
+
+	if len(used) != len(feature_names):
+		print('† The model uses {:d} features but {:d} are registered, using all features'.format(
+			len(used), len(feature_names)))
+		return list(feature_names)
+
+	return [name for name, is_used in zip(feature_names, used) if is_used]
+
+
+def export_required_features(model_files: list, out_file: str):
+	"""
+	Writes the features used by the given models (e.g. the deployed stage 1 and stage 2 classifiers) to
+	`out_file`, to be used by the preprocessor (`convert_frames_to_episodes.main(required_features_file = ...)`).
+	"""
+
+	required_features = set()
+	for model_file in model_files:
+		model = load_model(os.path.abspath(model_file))
+		if model is None:
+			raise FileNotFoundError(model_file)
+
+		model_features = get_features_used_by_model(model)
+		print('• {:s} uses {:d} features:'.format(os.path.basename(model_file), len(model_features)), model_features)
+		required_features.update(model_features)
+
+	required_features = sorted(required_features)
+	write_required_features_file(required_features, os.path.abspath(out_file),
+	                             models = [os.path.basename(model_file) for model_file in model_files])
+	return required_features
+
+
+if __name__ == '__main__':
+	export_required_features(
+		[
+			'/Users/gursimran/Workspace/active-scanning-cause-analysis/codebase__python/machine_learning/saved_models/classifier_stage_1/random_forest.pkl',
+			'/Users/gursimran/Workspace/active-scanning-cause-analysis/codebase__python/machine_learning/saved_models/classifier_stage_2/random_forest.pkl',
+		],
+		'/Users/gursimran/Workspace/active-scanning-cause-analysis/codebase__python/preprocessor/required_features.json'
+	)
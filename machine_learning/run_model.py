@@ -1,78 +1,410 @@
+import collections
+import concurrent.futures
+import multiprocessing
 import os
 
 import numpy as np
 import pandas as pd
 
 from machine_learning.aux.constants import get_processed_data_file_header_segregation
-from machine_learning.aux.helpers import read_dataset_csv_file_as_np_arrays
+from machine_learning.aux.helpers import read_csv_file, read_dataset_csv_file_as_np_arrays
 from machine_learning.aux.persist import load_model
+from machine_learning.cascade_model import CascadeModel, count_gating, get_gating_report, rbs_tags_column
+from preprocessor import instrumentation
 
+# classifier of the batch prediction workers (set before the workers are forked, shared copy-on-write)
+__state = {
+	'classifier': None,
+}
 
-def run(model_file: str, in_file: str, out_file: str, stage: int = None):
+
+def run(model_file: str, in_file: str, out_file: str, stage: int = None, memory_timeline_file: str = None,
+        episode_index_file: str = None, chunksize: int = None, workers: int = None, true_cause_column: str = None):
 	"""
 
 	:param model_file:
 	:param in_file:
 	:param out_file:
-	:param stage:
+	:param stage: stage of the classifier, to add the names of the predicted causes (a `CascadeModel` adds them,
+	              with the stage of each prediction: `prediction__stage`, and uses the rule based system tags of
+	              the input file for its rule gates, see `CascadeModel.set_gating`, and reports the hit rate of
+	              its gates: `cascade_model.get_gating_report`)
+	:param memory_timeline_file: `.json` or `.csv` file for the memory timeline of the run (None = disabled)
+	:param episode_index_file: SQLite index the predictions are added to (None = disabled), the input file must
+	                           have the episode key columns (e.g. a processed episode csv file),
+	                           see `preprocessor.episode_index`
+	:param chunksize: batch mode: read, predict and write the input file in chunks of this number of episodes
+	                  (None = the whole file at once). The output is the same as without chunks.
+	:param workers: batch mode: number of processes predicting the chunks (None = number of cpus, 1 = in this
+	                process). The workers are forked after the model is loaded and share it (copy-on-write).
+	:param true_cause_column: column of the input file with the true causes of the episodes (`ASCause` names), for
+	                          a cascade model with gates: the episodes are also predicted without the gates, to
+	                          report the stage 2 load the gates save and their accuracy delta (None = hit rates only)
 	:return:
 	"""
 
+	with instrumentation.profile_memory(memory_timeline_file):
+		if chunksize is None:
+			_run(model_file, in_file, out_file, stage, episode_index_file, true_cause_column)
+		else:
+			_run_batch(model_file, in_file, out_file, stage, episode_index_file, chunksize, workers, true_cause_column)
+
+
+def _get_reverse_mapping(stage):
+	"""
+	Label -> `ASCause` of the training labels of a classifier stage (None = unknown stage).
+	"""
+
+	mapping = None
+	if stage == 1:
+		from machine_learning.preprocessing.classifier_stage_1.prepare_dataset import get_training_labels
+		mapping = get_training_labels()
+	if stage == 2:
+		from machine_learning.preprocessing.classifier_stage_2.prepare_dataset import get_training_labels
+		mapping = get_training_labels()
+
+	if mapping is None:
+		return None
+	reverse_mapping = dict()
+	for key, value in mapping.items():
+		reverse_mapping[value] = key
+	return reverse_mapping
+
+
+def _predict(classifier, x_test, rbs_tags = None, true_names = None):
+	"""
+	Returns the predicted labels and, for a cascade model, the predicted cause names, the stages of the
+	predictions and (with gates) the counts of the gates (`cascade_model.count_gating`), else None.
+
+	:param rbs_tags: tags of the rule based system of the episodes, for the rule gates of a cascade model
+	:param true_names: true causes of the episodes (`ASCause` names), a cascade model with gates also predicts them
+	                   without the gates
+	"""
+
+	if isinstance(classifier, CascadeModel):
+		y_pred_stages, y_pred, y_pred_names = classifier.predict_stages(x_test, rbs_tags = rbs_tags)
+		gating_counts = None
+		if classifier.has_gating():
+			stages, names = None, None
+			if true_names is not None:
+				stages, _, names = classifier.predict_stages(x_test, rbs_tags = rbs_tags, gating = False)
+			gating_counts = count_gating(y_pred_stages, y_pred_names, stages, names, true_names)
+		return y_pred, y_pred_names, y_pred_stages, gating_counts
+	return classifier.predict(x_test), None, None, None
+
+
+def _predict_chunk(x_test, rbs_tags, true_names):
+	"""
+	Worker: predicts a chunk with the classifier of the process (see `_run_batch`).
+	"""
+
+	return _predict(__state['classifier'], x_test, rbs_tags, true_names)
+
+
+def _set_classifier(classifier):
+	__state['classifier'] = classifier
+
+
+def _get_output_dataframe(x_test, z_extra, y_pred, y_pred_names, y_pred_stages, reverse_mapping):
+	"""
+	Output dataframe: features, extra properties, (if known) stages of the predictions, predicted labels and
+	(if known) predicted cause names.
+	Returns the dataframe and the cause names (None if unknown).
+	"""
+
+	# merge arrays to create output array
+	with instrumentation.measure('concatenate') as measurement:
+		output_array = np.concatenate((x_test, z_extra), axis = 1)
+		if y_pred_stages is not None:
+			output_array = np.concatenate((output_array, np.vstack(y_pred_stages)), axis = 1)
+		output_array = np.concatenate((output_array, np.vstack(y_pred)), axis = 1)
+		measurement.rows = output_array.shape[0]
+
+	# if stage is given add name of labels too
+	if y_pred_names is None and reverse_mapping is not None:
+		y_pred_names = list()
+		for label in y_pred:
+			y_pred_names.append(reverse_mapping[label].name)
+		y_pred_names = np.array(y_pred_names)
+
+	if y_pred_names is not None:
+		with instrumentation.measure('concatenate_names'):
+			output_array = np.concatenate((output_array, np.vstack(y_pred_names)), axis = 1)
+
+	# create a dataframe
+	header = _get_output_header(y_pred_stages is not None, y_pred_names is not None)
+	with instrumentation.measure('to_dataframe'):
+		dataframe = pd.DataFrame(data = output_array, columns = header)
+	return dataframe, y_pred_names
+
+
+def _get_output_header(with_stages: bool, with_names: bool):
+	"""
+	Columns of the output file, see `_get_output_dataframe`.
+	"""
+
+	header = get_processed_data_file_header_segregation(for_training = False)
+	header = header[0] + header[1]
+	if with_stages:
+		header = header + ['prediction__stage', ]
+	header = header + ['prediction__label', ]
+	if with_names:
+		header = header + ['prediction__name', ]
+	return header
+
+
+def _run(model_file: str, in_file: str, out_file: str, stage: int = None, episode_index_file: str = None,
+         true_cause_column: str = None):
 	model_file = os.path.abspath(model_file)
 	in_file = os.path.abspath(in_file)
 	out_file = os.path.abspath(out_file)
+	instrumentation.set_context(frames_file = os.path.basename(in_file))
 
 	# load the classifier
-	classifier = load_model(model_file)
+	with instrumentation.measure('load_model'):
+		classifier = load_model(model_file)
 
 	# read the dataset
-	x_test, z_extra = read_dataset_csv_file_as_np_arrays(in_file, for_training = False)
-	# run the classifier on the dataset
-	y_pred = classifier.predict(x_test)
+	with instrumentation.measure('read') as measurement:
+		x_test, z_extra = read_dataset_csv_file_as_np_arrays(in_file, for_training = False)
+		measurement.rows = x_test.shape[0]
+	rbs_tags = None
+	true_names = None
+	if isinstance(classifier, CascadeModel):
+		with instrumentation.measure('read_rbs_tags'):
+			rbs_tags = _read_text_column(in_file, rbs_tags_column)
+		if true_cause_column is not None:
+			true_names = _read_text_column(in_file, true_cause_column)
+	# run the classifier on the dataset (a cascade model predicts the cause names too)
+	with instrumentation.measure('predict') as measurement:
+		y_pred, y_pred_cascade_names, y_pred_stages, gating_counts = _predict(classifier, x_test, rbs_tags,
+		                                                                      true_names)
+		measurement.rows = y_pred.shape[0]
 
 	# Predictions.
 	# print('Predictions: \n{}'.format(y_pred))
-	# The proportion of each cause
+	# The proportion of each cause (and of each stage, for a cascade model)
 	n_pred = y_pred.shape[0]
-	print('Causes proportion: {}'.format(np.divide(np.bincount(y_pred.astype(int)), n_pred)))
+	if y_pred_stages is None:
+		print('Causes proportion: {}'.format(np.divide(np.bincount(y_pred.astype(int)), n_pred)))
+	else:
+		_print_cascade_proportions(collections.Counter(y_pred_cascade_names.tolist()),
+		                           collections.Counter(y_pred_stages.tolist()), n_pred)
+	if gating_counts is not None:
+		print('Gating: {}'.format(get_gating_report(gating_counts)))
 
-	# merge arrays to create output array
-	# TODO: check
-	output_array = np.concatenate((x_test, z_extra), axis = 1)
-	output_array = np.concatenate((output_array, np.vstack(y_pred)), axis = 1)
+	reverse_mapping = _get_reverse_mapping(stage) if y_pred_cascade_names is None else None
+	dataframe, y_pred_names = _get_output_dataframe(x_test, z_extra, y_pred, y_pred_cascade_names, y_pred_stages,
+	                                                reverse_mapping)
 
-	# create a dataframe
-	header = get_processed_data_file_header_segregation(for_training = False)
-	header = header[0] + header[1] + ['prediction__label', ]
+	# save dataframe to output
+	with instrumentation.measure('write') as measurement:
+		dataframe.to_csv(out_file, sep = ',', columns = dataframe.columns, header = True, index = False, mode = 'w')
+		measurement.rows = dataframe.shape[0]
 
-	# if stage is given add name of labels too
-	if stage is not None:
-		mapping = None
-		if stage == 1:
-			from machine_learning.preprocessing.classifier_stage_1.prepare_dataset import get_training_labels
-			mapping = get_training_labels()
-		if stage == 2:
-			from machine_learning.preprocessing.classifier_stage_2.prepare_dataset import get_training_labels
-			mapping = get_training_labels()
-
-		if mapping is not None:
-			reverse_mapping = dict()
-			for key, value in mapping.items():
-				reverse_mapping[value] = key
-
-			y_pred_names = list()
-			for label in y_pred:
-				y_pred_names.append(reverse_mapping[label].name)
-
-			y_pred_names = np.array(y_pred_names)
-			# TODO: check
-			output_array = np.concatenate((output_array, np.vstack(y_pred_names)), axis = 1)
-			header = header + ['prediction__name', ]
+	# (optional) index the predictions
+	if episode_index_file is not None:
+		_index_predictions(episode_index_file, in_file, model_file, _get_index_stage(stage, y_pred_stages), y_pred,
+		                   y_pred_names)
 
-	dataframe = pd.DataFrame(data = output_array, columns = header)
 
-	# save dataframe to output
-	dataframe.to_csv(out_file, sep = ',', columns = header, header = True, index = False, mode = 'w')
+def _run_batch(model_file: str, in_file: str, out_file: str, stage: int = None, episode_index_file: str = None,
+               chunksize: int = 100000, workers: int = None, true_cause_column: str = None):
+	"""
+	Batch mode of `run`: the input file is streamed in chunks, the chunks are predicted by worker processes
+	(at most 2 chunks per worker in flight) and written to the output file in input order by this process.
+	"""
+
+	model_file = os.path.abspath(model_file)
+	in_file = os.path.abspath(in_file)
+	out_file = os.path.abspath(out_file)
+	instrumentation.set_context(frames_file = os.path.basename(in_file))
+	if workers is None:
+		workers = os.cpu_count()
+
+	# load the classifier (before the workers are forked)
+	with instrumentation.measure('load_model'):
+		classifier = load_model(model_file)
+	_set_classifier(classifier)
+	is_cascade = isinstance(classifier, CascadeModel)
+	reverse_mapping = _get_reverse_mapping(stage) if not is_cascade else None
+
+	pool = None
+	if workers > 1:
+		if 'fork' in multiprocessing.get_all_start_methods():
+			pool = concurrent.futures.ProcessPoolExecutor(max_workers = workers,
+			                                              mp_context = multiprocessing.get_context('fork'))
+		else:
+			# no fork: each worker gets a copy of the classifier
+			pool = concurrent.futures.ProcessPoolExecutor(max_workers = workers, initializer = _set_classifier,
+			                                              initargs = (classifier,))
+
+	# the SQLite connection of the index is opened by this process at the first write, once the workers are forked
+	# (they must not inherit it)
+	index_predictions = episode_index_file is not None
+	episode_index = None
+
+	# the header first: an input file without episodes gives an output file without episodes
+	with instrumentation.measure('write'):
+		pd.DataFrame(columns = _get_output_header(is_cascade, is_cascade or reverse_mapping is not None)).to_csv(
+			out_file, sep = ',', header = True, index = False, mode = 'w')
+
+	feature_set, extra_properties = get_processed_data_file_header_segregation(for_training = False)
+	counts = np.zeros(0, dtype = int)
+	name_counts = collections.Counter()
+	stage_counts = collections.Counter()
+	gating_counts = collections.Counter()
+	n_pred = 0
+	pending = collections.deque()
+
+	def write_chunk(chunk, x_test, z_extra, y_pred, y_pred_cascade_names, y_pred_stages, chunk_gating_counts):
+		nonlocal counts, n_pred, episode_index
+		dataframe, y_pred_names = _get_output_dataframe(x_test, z_extra, y_pred, y_pred_cascade_names, y_pred_stages,
+		                                                reverse_mapping)
+		with instrumentation.measure('write') as measurement:
+			dataframe.to_csv(out_file, sep = ',', columns = dataframe.columns, header = False, index = False,
+			                 mode = 'a')
+			measurement.rows = dataframe.shape[0]
+		if index_predictions:
+			if episode_index is None:
+				from preprocessor.episode_index import EpisodeIndex
+				episode_index = EpisodeIndex(episode_index_file)
+			_index_chunk_predictions(episode_index, chunk, model_file, _get_index_stage(stage, y_pred_stages), y_pred,
+			                         y_pred_names)
+
+		if y_pred_stages is None:
+			chunk_counts = np.bincount(y_pred.astype(int))
+			counts = np.pad(counts, (0, max(0, len(chunk_counts) - len(counts))))
+			counts[:len(chunk_counts)] += chunk_counts
+		else:
+			name_counts.update(y_pred_cascade_names.tolist())
+			stage_counts.update(y_pred_stages.tolist())
+		if chunk_gating_counts is not None:
+			gating_counts.update(chunk_gating_counts)
+		n_pred += y_pred.shape[0]
+
+	def write_first_pending():
+		chunk, x_test, z_extra, future = pending.popleft()
+		with instrumentation.measure('predict') as measurement:
+			predictions = future.result()
+			measurement.rows = predictions[0].shape[0]
+		write_chunk(chunk, x_test, z_extra, *predictions)
+
+	try:
+		chunks = iter(read_csv_file(in_file, chunksize = chunksize))
+		while True:
+			with instrumentation.measure('read') as measurement:
+				chunk = next(chunks, None)
+				if chunk is None:
+					break
+				measurement.rows = chunk.shape[0]
+			if chunk.shape[0] == 0:
+				continue
+			if index_predictions and not _has_episode_key_columns(chunk):
+				print('• Predictions not indexed: {:s} does not have the episode key columns'.format(in_file))
+				index_predictions = False
+
+			x_test = np.array(chunk[feature_set])
+			z_extra = np.array(chunk[extra_properties])
+			rbs_tags = None
+			true_names = None
+			if is_cascade:
+				rbs_tags = _get_text_column(chunk, rbs_tags_column)
+				if true_cause_column is not None:
+					true_names = _get_text_column(chunk, true_cause_column)
+			if pool is None:
+				with instrumentation.measure('predict') as measurement:
+					predictions = _predict(classifier, x_test, rbs_tags, true_names)
+					measurement.rows = predictions[0].shape[0]
+				write_chunk(chunk, x_test, z_extra, *predictions)
+				continue
+
+			pending.append((chunk, x_test, z_extra, pool.submit(_predict_chunk, x_test, rbs_tags, true_names)))
+			if len(pending) >= 2 * workers:
+				write_first_pending()
+		while len(pending) > 0:
+			write_first_pending()
+	finally:
+		if pool is not None:
+			pool.shutdown(cancel_futures = True)
+		if episode_index is not None:
+			episode_index.close()
+		_set_classifier(None)
+
+	if n_pred > 0:
+		if len(stage_counts) == 0:
+			print('Causes proportion: {}'.format(np.divide(counts, n_pred)))
+		else:
+			_print_cascade_proportions(name_counts, stage_counts, n_pred)
+		if len(gating_counts) > 0:
+			print('Gating: {}'.format(get_gating_report(gating_counts)))
+
+
+def _print_cascade_proportions(name_counts: collections.Counter, stage_counts: collections.Counter, n_pred: int):
+	"""
+	Proportions of the predictions of a cascade model, by cause name and by stage (the labels are the labels of
+	different stages, -1 for the rule based system rules).
+	"""
+
+	print('Causes proportion: {}'.format({name: count / n_pred for name, count in sorted(name_counts.items())}))
+	print('Stages proportion: {}'.format({stage: count / n_pred for stage, count in sorted(stage_counts.items())}))
+
+
+def _read_text_column(in_file: str, column: str):
+	"""
+	Values of a text column (e.g. the tags of the rule based system) of the episodes of a file (None if the file
+	does not have the column).
+	"""
+
+	column_df = pd.read_csv(in_file, usecols = lambda name: name == column, dtype = {column: str, })
+	return _get_text_column(column_df, column)
+
+
+def _get_text_column(dataframe: pd.DataFrame, column: str):
+	if column not in dataframe.columns:
+		return None
+	return dataframe[column].values
+
+
+def _get_index_stage(stage, y_pred_stages):
+	"""
+	Stage of the indexed predictions: the stage of each prediction for a cascade model, else the stage of the
+	classifier (0 if unknown).
+	"""
+
+	if y_pred_stages is not None:
+		return y_pred_stages
+	return 0 if stage is None else stage
+
+
+def _has_episode_key_columns(chunk: pd.DataFrame):
+	from preprocessor.episode_index import get_episode_key_columns
+
+	return all(column in chunk.columns for column in get_episode_key_columns())
+
+
+def _index_chunk_predictions(episode_index, chunk: pd.DataFrame, model_file: str, stage, y_pred, y_pred_names):
+	from preprocessor.episode_index import get_episode_key_columns
+
+	with instrumentation.measure('index') as measurement:
+		measurement.rows = episode_index.add_predictions(chunk[get_episode_key_columns()], y_pred, stage = stage,
+		                                                 names = y_pred_names, model_file = model_file)
+
+
+def _index_predictions(episode_index_file: str, in_file: str, model_file: str, stage, y_pred, y_pred_names):
+	from preprocessor.episode_index import EpisodeIndex, get_episode_key_columns
+
+	key_columns = get_episode_key_columns()
+	with instrumentation.measure('read_keys'):
+		keys_df = pd.read_csv(in_file, usecols = lambda column: column in key_columns)
+	if len(keys_df.columns) != len(key_columns) or len(keys_df) != len(y_pred):
+		print('• Predictions not indexed: {:s} does not have the episode key columns'.format(in_file), key_columns)
+		return
+
+	with instrumentation.measure('index') as measurement:
+		with EpisodeIndex(episode_index_file) as episode_index:
+			measurement.rows = episode_index.add_predictions(keys_df, y_pred, stage = stage, names = y_pred_names,
+			                                                 model_file = model_file)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,145 @@
+"""
+Index of the access point (BSSID) each client is associated with over time, built once per frames file.
+
+The serving access point of a client changes with
+	- successful (re)association responses sent to the client (status code = 0)
+	- data frames exchanged between the client and an access point
+and the client is unassociated after a deauthentication or disassociation frame (and before the first event).
+
+Used to keep only the beacons of the serving access point in the frames of each client
+(`convert_frames_to_episodes.filter_client_frames`); while a client is unassociated all the beacons are kept.
+
+NOTE: the access point of a data frame is its transmitter / receiver address, which is the BSSID for single
+BSS access points (`wlan.bssid` is not extracted from the captures).
+"""
+
+import numpy as np
+import pandas as pd
+
+data_frames_list = list(range(32, 48))
+
+
+def __is_unicast(addresses: np.ndarray):
+	"""
+	True for the (available) unicast mac addresses (group bit of the first octet not set).
+	"""
+
+	result = np.zeros(len(addresses), dtype = bool)
+	available = pd.notna(addresses)
+	first_octets = pd.Series(addresses[available]).astype(str).str[:2]
+	result[available] = (first_octets.apply(lambda octet: int(octet, 16) if len(octet) == 2 else 1) & 1).values == 0
+	return result
+
+
+def find_association_events(dataframe: pd.DataFrame, clients: list):
+	"""
+	Returns the association events of the clients as a dataframe (sorted by epoch) with the columns
+	`frame.time_epoch`, `client` and `access_point` (None = the client is unassociated after the event).
+	"""
+
+	epochs = dataframe['frame.time_epoch'].values
+	subtypes = dataframe['wlan.fc.type_subtype'].values
+	receivers = dataframe['wlan.ra'].values
+	transmitters = dataframe['wlan.ta'].values
+	status_codes = dataframe['wlan_mgt.fixed.status_code'].values
+	receiver_is_client = dataframe['wlan.ra'].isin(clients).values
+	transmitter_is_client = dataframe['wlan.ta'].isin(clients).values
+
+	parts = list()
+
+	def __add_events(selection, client_addresses, access_point_addresses):
+		if selection.any():
+			parts.append(pd.DataFrame({
+				'frame.time_epoch': epochs[selection],
+				'client': client_addresses[selection],
+				'access_point': access_point_addresses[selection],
+			}))
+
+	# successful (re)association responses sent to the client
+	assoc_response = np.isin(subtypes, [1, 3, ]) & (status_codes == 0)
+	__add_events(assoc_response & receiver_is_client, receivers, transmitters)
+
+	# data frames exchanged with an access point (unicast)
+	data_frame = np.isin(subtypes, data_frames_list)
+	uplink = data_frame & transmitter_is_client & ~receiver_is_client
+	uplink[uplink] = __is_unicast(receivers[uplink])
+	__add_events(uplink, transmitters, receivers)
+	downlink = data_frame & receiver_is_client & ~transmitter_is_client
+	downlink[downlink] = __is_unicast(transmitters[downlink])
+	__add_events(downlink, receivers, transmitters)
+
+	# deauthentication / disassociation (sent by or to the client)
+	no_access_point = np.full(len(dataframe), None, dtype = object)
+	disconnection = np.isin(subtypes, [10, 12, ])
+	__add_events(disconnection & receiver_is_client, receivers, no_access_point)
+	__add_events(disconnection & transmitter_is_client, transmitters, no_access_point)
+
+	if len(parts) == 0:
+		return pd.DataFrame(columns = ['frame.time_epoch', 'client', 'access_point', ])
+	events_df = pd.concat(parts, ignore_index = True)
+	events_df.sort_values(by = 'frame.time_epoch', inplace = True, kind = 'mergesort', ignore_index = True)
+	return events_df
+
+
+class AssociationIndex:
+	"""
+	Serving access point of each client over time and the beacons of each access point, for a frames dataframe.
+	"""
+
+	def __init__(self, dataframe: pd.DataFrame, clients: list):
+		self.n_frames = len(dataframe)
+
+		# client -> (interval start epochs, access point of each interval (None = unassociated))
+		self.__intervals = dict()
+		events_df = find_association_events(dataframe, clients)
+		for the_client, client_events_df in events_df.groupby('client', sort = False):
+			epochs = client_events_df['frame.time_epoch'].values
+			access_points = client_events_df['access_point'].values
+			# keep only the changes of access point
+			changes = np.r_[True, access_points[1:] != access_points[:-1]]
+			self.__intervals[the_client] = (epochs[changes], access_points[changes])
+
+		# beacons: positions (rows of the dataframe) and epochs, in total and per access point
+		beacon = dataframe['wlan.fc.type_subtype'].values == 8
+		self.__beacon_positions = np.flatnonzero(beacon)
+		self.__beacon_epochs = dataframe['frame.time_epoch'].values[beacon]
+		beacon_access_points = dataframe['wlan.ta'].where(dataframe['wlan.ta'].notna(), dataframe['wlan.sa'])
+		beacon_access_points = beacon_access_points.values[beacon]
+		self.__access_point_beacons = dict()
+		for access_point in pd.unique(beacon_access_points):
+			selection = beacon_access_points == access_point
+			self.__access_point_beacons[access_point] = (self.__beacon_positions[selection],
+			                                             self.__beacon_epochs[selection])
+
+	def get_serving_access_points(self, the_client: str):
+		"""
+		Returns the association intervals of a client as (start epochs, access points), None = unassociated.
+		"""
+
+		return self.__intervals.get(the_client, (np.array([]), np.array([], dtype = object)))
+
+	def get_client_beacon_mask(self, the_client: str):
+		"""
+		Boolean array over the rows of the indexed dataframe: beacons of the serving access point of the
+		client at the time of the beacon (all the beacons while the client is unassociated).
+		"""
+
+		mask = np.zeros(self.n_frames, dtype = bool)
+		start_epochs, access_points = self.get_serving_access_points(the_client)
+
+		# unassociated before the first event
+		interval_starts = np.r_[-np.inf, start_epochs]
+		interval_ends = np.r_[start_epochs, np.inf]
+		interval_access_points = np.r_[np.array([None], dtype = object), access_points]
+
+		for start, end, access_point in zip(interval_starts, interval_ends, interval_access_points):
+			if access_point is None:
+				positions, epochs = self.__beacon_positions, self.__beacon_epochs
+			elif access_point in self.__access_point_beacons:
+				positions, epochs = self.__access_point_beacons[access_point]
+			else:
+				# the access point of the client is not captured
+				continue
+			first, last = np.searchsorted(epochs, [start, end], side = 'left')
+			mask[positions[first:last]] = True
+		return mask
@@ -0,0 +1,287 @@
+"""
+Benchmarks the episode engine of `convert_frames_to_episodes` on synthetic frames csv files of increasing size.
+
+Timed functions:
+	- define_episodes_from_frames
+	- compute_episode_characteristics (per episode)
+	- compute_client_episodes_characteristics (all the episodes of a client at once)
+	- assign_rule_based_system_tags_to_episodes
+	- process_frame_csv_file (end to end, including reads and writes)
+
+For each size and function the best wall time over `repeat` runs is reported, along with frames/s and episodes/s.
+Results can be saved as a baseline and later runs compared against it to catch performance regressions.
+
+A baseline of the tiny and small sizes is committed (`directories.episode_engine_baseline_file`), measured with
+`--repeat 10` on a single cpu with python 3.11 and pandas 1.5. Wall times depend on the machine: regenerate the
+baseline (`--save-baseline`, on the commit to compare with) before comparing on another machine.
+
+Usage:
+	python -m preprocessor.benchmark_episode_engine --sizes small medium --save-baseline
+	python -m preprocessor.benchmark_episode_engine --sizes small medium --compare
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from preprocessor import directories
+from preprocessor.convert_frames_to_episodes import assign_rule_based_system_tags_to_episodes, \
+	compute_client_episodes_characteristics, compute_episode_characteristics, convert_ep_characteristics_to_dataframe, define_episodes_from_frames, \
+	filter_client_frames, filter_out_irrelevant_frames, find_all_client_mac_addresses, process_frame_csv_file, \
+	read_frames_csv_file, EpisodeProperties
+from preprocessor.synthetic_frames import write_frames_csv_file
+
+# size label -> arguments for `synthetic_frames.generate_frames_dataframe`
+size_ladder = {
+	'tiny': dict(n_clients = 2, duration = 120.0),
+	'small': dict(n_clients = 5, duration = 600.0),
+	'medium': dict(n_clients = 10, duration = 1800.0),
+	'large': dict(n_clients = 20, duration = 3600.0),
+}
+
+
+def __best_time(function, repeat, setup = None):
+	"""
+	Returns the minimum wall time of `function` over `repeat` runs.
+	`setup` (if given) is called before each run (not timed) and its return value is passed to `function`.
+	"""
+
+	best = None
+	for _ in range(repeat):
+		argument = setup() if setup is not None else None
+
+		start = time.perf_counter()
+		with contextlib.redirect_stdout(io.StringIO()):
+			if setup is not None:
+				function(argument)
+			else:
+				function()
+		elapsed = time.perf_counter() - start
+
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+
+def __result(seconds, n_frames, n_episodes):
+	return {
+		'seconds': seconds,
+		'frames': n_frames,
+		'episodes': n_episodes,
+		'frames_per_second': n_frames / seconds if seconds > 0 else 0.0,
+		'episodes_per_second': n_episodes / seconds if seconds > 0 else 0.0,
+	}
+
+
+def benchmark_size(size_label: str, generator_kwargs: dict, repeat: int, scratch_dir: str):
+	"""
+	Runs all the benchmarks for one size of the ladder.
+	Returns a dictionary: function name -> result
+	"""
+
+	frames_dir = os.path.join(scratch_dir, 'frames_csv_files')
+	os.makedirs(frames_dir, exist_ok = True)
+	frames_csv_name = size_label + '.csv'
+	n_file_frames = write_frames_csv_file(os.path.join(frames_dir, frames_csv_name), **generator_kwargs)
+
+	# inputs for the individual functions (not timed)
+	with contextlib.redirect_stdout(io.StringIO()):
+		main_dataframe = read_frames_csv_file(os.path.join(frames_dir, frames_csv_name))
+		clients = find_all_client_mac_addresses(main_dataframe)
+		main_dataframe = filter_out_irrelevant_frames(main_dataframe, clients)
+
+		client_dataframes = list()
+		for the_client in clients:
+			dataframe = filter_client_frames(main_dataframe.copy(deep = True), the_client)
+			if dataframe is not None:
+				client_dataframes.append((the_client, dataframe))
+
+		episodes = list()
+		client_episodes = list()
+		for the_client, dataframe in client_dataframes:
+			result = define_episodes_from_frames(dataframe.copy(deep = True))
+			if result is None:
+				continue
+			dataframe, _, ep_indexes = result
+			client_episodes.append((the_client, dataframe))
+			for episode_idx in ep_indexes:
+				_episode_df = dataframe[(dataframe[EpisodeProperties.episode__id.value] == episode_idx)]
+				episodes.append((the_client, episode_idx, _episode_df.sort_values(by = 'frame.time_epoch')))
+
+	n_client_frames = sum(len(dataframe) for _, dataframe in client_dataframes)
+	n_episode_frames = sum(len(_episode_df) for _, _, _episode_df in episodes)
+	n_episodes = len(episodes)
+
+	results = dict()
+
+	# 1. define_episodes_from_frames
+	def __define_episodes(copies):
+		for dataframe in copies:
+			define_episodes_from_frames(dataframe)
+
+	seconds = __best_time(__define_episodes, repeat,
+	                      setup = lambda: [dataframe.copy(deep = True) for _, dataframe in client_dataframes])
+	results['define_episodes_from_frames'] = __result(seconds, n_client_frames, n_episodes)
+
+	# 2. compute_episode_characteristics
+	ep_characteristics_list = list()
+
+	def __compute_characteristics():
+		del ep_characteristics_list[:]
+		for the_client, episode_idx, _episode_df in episodes:
+			ep_characteristics_list.append(
+				compute_episode_characteristics(_episode_df, the_client, episode_idx, frames_csv_name))
+
+	seconds = __best_time(__compute_characteristics, repeat)
+	results['compute_episode_characteristics'] = __result(seconds, n_episode_frames, n_episodes)
+
+	def __compute_client_characteristics():
+		for the_client, dataframe in client_episodes:
+			compute_client_episodes_characteristics(dataframe, the_client, frames_csv_name)
+
+	seconds = __best_time(__compute_client_characteristics, repeat)
+	results['compute_client_episodes_characteristics'] = __result(seconds, n_episode_frames, n_episodes)
+
+	# 3. assign_rule_based_system_tags_to_episodes
+	episodes_df = convert_ep_characteristics_to_dataframe(ep_characteristics_list).dropna(axis = 0)
+	seconds = __best_time(assign_rule_based_system_tags_to_episodes, repeat,
+	                      setup = lambda: episodes_df.copy(deep = True))
+	results['assign_rule_based_system_tags_to_episodes'] = __result(seconds, n_episode_frames, len(episodes_df))
+
+	# 4. process_frame_csv_file (outputs are written to fresh directories for every run)
+	def __output_directories():
+		output_dir = tempfile.mkdtemp(dir = scratch_dir)
+		for name in ['semi_processed', 'processed', ]:
+			os.mkdir(os.path.join(output_dir, name))
+		return output_dir
+
+	def __process_file(output_dir):
+		process_frame_csv_file(frames_csv_name, access_points = None, clients = None, assign_rbs_tags = True,
+		                       separate_client_files = False,
+		                       mapping_file = os.path.join(output_dir, 'conversion_mapping.csv'),
+		                       frames_csv_dir = frames_dir,
+		                       semi_processed_dir = os.path.join(output_dir, 'semi_processed'),
+		                       processed_dir = os.path.join(output_dir, 'processed'))
+
+	seconds = __best_time(__process_file, repeat, setup = __output_directories)
+	results['process_frame_csv_file'] = __result(seconds, n_file_frames, n_episodes)
+
+	return results
+
+
+def run_benchmarks(size_labels: list, repeat: int = 3):
+	"""
+	Runs the benchmarks for the given sizes of the ladder.
+	Returns a dictionary: size label -> function name -> result
+	"""
+
+	# disable warnings (same as running the preprocessor)
+	pd.options.mode.chained_assignment = None
+
+	scratch_dir = tempfile.mkdtemp(prefix = 'episode_engine_benchmark_')
+	try:
+		all_results = dict()
+		for size_label in size_labels:
+			print('Benchmarking size "{:s}": {}'.format(size_label, size_ladder[size_label]))
+			all_results[size_label] = benchmark_size(size_label, size_ladder[size_label], repeat,
+			                                         os.path.join(scratch_dir, size_label))
+			print_results({size_label: all_results[size_label]})
+	finally:
+		shutil.rmtree(scratch_dir, ignore_errors = True)
+
+	return all_results
+
+
+def print_results(all_results: dict):
+	row_format = '{:<8s} {:<44s} {:>10s} {:>10s} {:>9s} {:>14s} {:>12s}'
+	print(row_format.format('size', 'function', 'seconds', 'frames', 'episodes', 'frames/s', 'episodes/s'))
+	for size_label, results in all_results.items():
+		for function_name, result in results.items():
+			print(row_format.format(
+				size_label, function_name, '{:.3f}'.format(result['seconds']), str(result['frames']),
+				str(result['episodes']), '{:.1f}'.format(result['frames_per_second']),
+				'{:.1f}'.format(result['episodes_per_second'])
+			))
+
+
+def save_baseline(all_results: dict, baseline_file):
+	"""
+	Saves the results as a baseline. Existing entries for other sizes are kept.
+	"""
+
+	baseline = load_baseline(baseline_file) if os.path.exists(baseline_file) else dict()
+	baseline.update(all_results)
+
+	os.makedirs(os.path.dirname(os.path.abspath(baseline_file)), exist_ok = True)
+	with open(baseline_file, 'w') as file:
+		json.dump(baseline, file, indent = 2, sort_keys = True)
+	print('• Baseline saved at {:s}'.format(baseline_file))
+
+
+def load_baseline(baseline_file):
+	with open(baseline_file, 'r') as file:
+		return json.load(file)
+
+
+def compare_with_baseline(all_results: dict, baseline: dict, tolerance: float = 0.2):
+	"""
+	Compares the results with a baseline.
+	A function is reported as a regression if it is slower than the baseline by more than `tolerance` (fraction).
+	Returns a list of (size label, function name, slowdown) for the regressions.
+	"""
+
+	regressions = list()
+	row_format = '{:<8s} {:<44s} {:>14s} {:>14s} {:>9s}'
+	print(row_format.format('size', 'function', 'baseline (s)', 'current (s)', 'ratio'))
+	for size_label, results in all_results.items():
+		for function_name, result in results.items():
+			if function_name not in baseline.get(size_label, dict()):
+				continue
+
+			baseline_seconds = baseline[size_label][function_name]['seconds']
+			ratio = result['seconds'] / baseline_seconds if baseline_seconds > 0 else 1.0
+			flag = ' †' if ratio > 1.0 + tolerance else ''
+			print(row_format.format(size_label, function_name, '{:.3f}'.format(baseline_seconds),
+			                        '{:.3f}'.format(result['seconds']), '{:.2f}'.format(ratio)) + flag)
+			if flag:
+				regressions.append((size_label, function_name, ratio))
+
+	if len(regressions) > 0:
+		print('† {:d} regression(s) beyond {:.0%} of the baseline'.format(len(regressions), tolerance))
+	return regressions
+
+
+def define_command_line_parser():
+	arg_parser = argparse.ArgumentParser(description = 'Benchmark the episode engine on synthetic frames.')
+	arg_parser.add_argument('--sizes', action = 'store', dest = 'sizes', nargs = '+', default = ['tiny', 'small', ],
+	                        choices = list(size_ladder.keys()), help = 'sizes of the ladder to run')
+	arg_parser.add_argument('--repeat', action = 'store', dest = 'repeat', type = int, default = 3)
+	arg_parser.add_argument('--save-baseline', action = 'store', dest = 'save_baseline', nargs = '?',
+	                        const = directories.episode_engine_baseline_file, default = None,
+	                        help = 'save the results as the baseline')
+	arg_parser.add_argument('--compare', action = 'store', dest = 'compare', nargs = '?',
+	                        const = directories.episode_engine_baseline_file, default = None,
+	                        help = 'compare the results with the baseline')
+	arg_parser.add_argument('--tolerance', action = 'store', dest = 'tolerance', type = float, default = 0.2)
+	arg_parser.add_argument('--output', action = 'store', dest = 'output', default = None,
+	                        help = 'save the results as json')
+	return arg_parser
+
+
+if __name__ == '__main__':
+	_args = define_command_line_parser().parse_args()
+	_results = run_benchmarks(_args.sizes, repeat = _args.repeat)
+
+	if _args.output is not None:
+		with open(_args.output, 'w') as _file:
+			json.dump(_results, _file, indent = 2, sort_keys = True)
+	if _args.compare is not None:
+		compare_with_baseline(_results, load_baseline(_args.compare), tolerance = _args.tolerance)
+	if _args.save_baseline is not None:
+		save_baseline(_results, _args.save_baseline)
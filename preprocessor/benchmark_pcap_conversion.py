@@ -0,0 +1,162 @@
+"""
+Benchmarks the conversion of capture files to frames csv files (`convert_pcaps_to_frames_csv`).
+
+Synthetic monitor mode captures (see `synthetic_captures`) are generated in a scratch directory and converted
+with different numbers of parallel workers. For each worker count the throughput is reported in MB/s
+(capture bytes) and frames/s. Everything runs offline; only `tshark` needs to be installed.
+
+Usage:
+	python -m preprocessor.benchmark_pcap_conversion --size small --files 4 --workers 1 2 4
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from preprocessor.convert_pcaps_to_frames_csv import generate_output_csv_files, \
+	prepare_and_get_command_format_string, prepare_and_get_csv_header
+from preprocessor.synthetic_captures import write_capture_file
+
+# size label -> arguments for `synthetic_captures.write_capture_file` (per capture file)
+size_ladder = {
+	'tiny': dict(n_clients = 2, duration = 120.0),
+	'small': dict(n_clients = 5, duration = 600.0),
+	'medium': dict(n_clients = 10, duration = 1800.0),
+	'large': dict(n_clients = 20, duration = 3600.0),
+}
+
+
+def is_tshark_available():
+	return shutil.which('tshark') is not None
+
+
+def count_csv_rows(filepath):
+	"""
+	Number of lines in a csv file, excluding the header.
+	"""
+
+	with open(filepath, 'rb') as file:
+		return max(0, sum(1 for _ in file) - 1)
+
+
+def generate_capture_files(capture_files_dir: str, n_files: int, capture_format: str, n_chains: int,
+                           generator_kwargs: dict):
+	"""
+	Writes `n_files` synthetic capture files (different seeds).
+	Returns the list of file names and the total number of frames.
+	"""
+
+	capture_file_names = list()
+	n_frames = 0
+	for file_idx in range(n_files):
+		capture_name = 'synthetic_{:02d}.{:s}'.format(file_idx, capture_format)
+		n_frames += write_capture_file(os.path.join(capture_files_dir, capture_name), n_chains = n_chains,
+		                               seed = file_idx, **generator_kwargs)
+		capture_file_names.append(capture_name)
+	return capture_file_names, n_frames
+
+
+def benchmark_conversion(size_label: str, n_files: int = 4, worker_counts: list = None, capture_format: str = 'pcap',
+                         n_chains: int = 2, repeat: int = 1):
+	"""
+	Converts the synthetic capture files with each worker count and returns the throughput per worker count.
+	"""
+
+	if worker_counts is None:
+		worker_counts = [1, 2, 4, ]
+
+	command_format_string = prepare_and_get_command_format_string()
+	csv_file_header = prepare_and_get_csv_header(command_format_string)
+
+	scratch_dir = tempfile.mkdtemp(prefix = 'pcap_conversion_benchmark_')
+	try:
+		capture_files_dir = os.path.join(scratch_dir, 'capture_files')
+		os.mkdir(capture_files_dir)
+
+		print('Generating {:d} capture files of size "{:s}": {}'.format(n_files, size_label, size_ladder[size_label]))
+		capture_file_names, n_frames = generate_capture_files(capture_files_dir, n_files, capture_format, n_chains,
+		                                                      size_ladder[size_label])
+		n_bytes = sum(os.path.getsize(os.path.join(capture_files_dir, name)) for name in capture_file_names)
+		print('• {:d} frames, {:.1f} MB'.format(n_frames, n_bytes / 1e6))
+
+		results = dict()
+		for n_workers in worker_counts:
+			best = None
+			n_rows = 0
+			for _ in range(repeat):
+				frames_csv_files_dir = tempfile.mkdtemp(dir = scratch_dir)
+
+				start = time.perf_counter()
+				with contextlib.redirect_stdout(io.StringIO()):
+					generate_output_csv_files(capture_file_names, command_format_string, csv_file_header,
+					                          use_subprocesses = n_workers > 1, max_subprocesses = n_workers,
+					                          capture_files_dir = capture_files_dir,
+					                          frames_csv_files_dir = frames_csv_files_dir)
+				elapsed = time.perf_counter() - start
+
+				best = elapsed if best is None else min(best, elapsed)
+				n_rows = sum(count_csv_rows(os.path.join(frames_csv_files_dir, name))
+				             for name in os.listdir(frames_csv_files_dir))
+				shutil.rmtree(frames_csv_files_dir, ignore_errors = True)
+
+			results[n_workers] = {
+				'seconds': best,
+				'bytes': n_bytes,
+				'frames': n_frames,
+				'csv_rows': n_rows,
+				'mb_per_second': n_bytes / 1e6 / best if best > 0 else 0.0,
+				'frames_per_second': n_frames / best if best > 0 else 0.0,
+			}
+			if n_rows != n_frames:
+				print('† {:d} workers: {:d} csv rows written for {:d} frames'.format(n_workers, n_rows, n_frames))
+	finally:
+		shutil.rmtree(scratch_dir, ignore_errors = True)
+
+	return results
+
+
+def print_results(results: dict):
+	row_format = '{:>8s} {:>10s} {:>10s} {:>14s}'
+	print(row_format.format('workers', 'seconds', 'MB/s', 'frames/s'))
+	for n_workers, result in results.items():
+		print(row_format.format(str(n_workers), '{:.3f}'.format(result['seconds']),
+		                        '{:.2f}'.format(result['mb_per_second']),
+		                        '{:.1f}'.format(result['frames_per_second'])))
+
+
+def define_command_line_parser():
+	arg_parser = argparse.ArgumentParser(description = 'Benchmark the conversion of captures to frames csv files.')
+	arg_parser.add_argument('--size', action = 'store', dest = 'size', default = 'small',
+	                        choices = list(size_ladder.keys()), help = 'size of each capture file')
+	arg_parser.add_argument('--files', action = 'store', dest = 'n_files', type = int, default = 4)
+	arg_parser.add_argument('--workers', action = 'store', dest = 'worker_counts', type = int, nargs = '+',
+	                        default = [1, 2, 4, ])
+	arg_parser.add_argument('--format', action = 'store', dest = 'capture_format', default = 'pcap',
+	                        choices = ['pcap', 'pcapng', ])
+	arg_parser.add_argument('--chains', action = 'store', dest = 'n_chains', type = int, default = 2)
+	arg_parser.add_argument('--repeat', action = 'store', dest = 'repeat', type = int, default = 1)
+	arg_parser.add_argument('--output', action = 'store', dest = 'output', default = None,
+	                        help = 'save the results as json')
+	return arg_parser
+
+
+if __name__ == '__main__':
+	_args = define_command_line_parser().parse_args()
+
+	if not is_tshark_available():
+		print('`tshark` is not installed! Please install it (version 2.2.13 for consistency) and try again!')
+		exit(0)
+
+	_results = benchmark_conversion(_args.size, n_files = _args.n_files, worker_counts = _args.worker_counts,
+	                                capture_format = _args.capture_format, n_chains = _args.n_chains,
+	                                repeat = _args.repeat)
+	print_results(_results)
+
+	if _args.output is not None:
+		with open(_args.output, 'w') as _file:
+			json.dump(_results, _file, indent = 2, sort_keys = True)
@@ -0,0 +1,102 @@
+"""
+Streaming compression of the intermediate csv files (frames, semi processed frames and processed episodes),
+chosen by the extension of the file:
+	- `.csv`: not compressed
+	- `.csv.gz`: gzip (standard library; `pigz` is used for the tshark output if it is installed)
+	- `.csv.zst`: zstandard (optional `zstandard` package, see requirements-optional.txt, multi-threaded; `zstd`
+	  for the tshark output)
+
+The outputs of the preprocessor have the extension of the frames csv file they are made from, so compressed
+frames csv files give compressed outputs. `pandas.read_csv` reads the compressed files (inferred from the
+extension); appended parts (e.g. `mode = 'a'`) are written as new gzip members / zstandard frames, which are read
+as a single stream.
+"""
+
+import gzip
+import os
+import shutil
+
+from preprocessor import directories
+
+compressions = {
+	'.gz': 'gzip',
+	'.zst': 'zstd',
+}
+
+# compression levels, and threads of the zstandard compressor (-1 = number of cpus)
+gzip_level = 6
+zstd_level = 3
+zstd_threads = -1
+
+
+def split_extension(filename: str):
+	"""
+	Splits a file name into its stem and its extension, including the compression extension:
+	'capture.csv.gz' -> ('capture', '.csv.gz')
+	"""
+
+	stem, extension = os.path.splitext(filename)
+	if extension in compressions:
+		stem, inner_extension = os.path.splitext(stem)
+		extension = inner_extension + extension
+	return stem, extension
+
+
+def is_csv_file(filename: str):
+	"""
+	True for csv files, compressed or not (`directories.csv_files_extensions`).
+	"""
+
+	return split_extension(filename)[1] in directories.csv_files_extensions
+
+
+def get_compression(filepath: str):
+	"""
+	Compression of a file from its extension: 'gzip', 'zstd' or None.
+	"""
+
+	return compressions.get(os.path.splitext(filepath)[1])
+
+
+def get_to_csv_compression(filepath: str):
+	"""
+	`compression` argument of `DataFrame.to_csv` for a file, from its extension (can be used for a temporary file
+	with another extension).
+	"""
+
+	compression = get_compression(filepath)
+	if compression == 'gzip':
+		return {'method': 'gzip', 'compresslevel': gzip_level, }
+	if compression == 'zstd':
+		return {'method': 'zstd', 'level': zstd_level, 'threads': zstd_threads, }
+	return None
+
+
+def open_output_stream(filepath: str, compression: str = None, mode: str = 'wb'):
+	"""
+	Opens a binary output stream, compressed with `compression` ('gzip', 'zstd' or None).
+	"""
+
+	if compression == 'gzip':
+		return gzip.open(filepath, mode, compresslevel = gzip_level)
+	if compression == 'zstd':
+		import zstandard
+		return zstandard.open(filepath, mode, cctx = zstandard.ZstdCompressor(level = zstd_level,
+		                                                                       threads = zstd_threads))
+	return open(filepath, mode)
+
+
+def get_compression_command(filepath: str):
+	"""
+	Shell command compressing its standard input to its standard output for a file, from its extension
+	(None = not compressed).
+	"""
+
+	compression = get_compression(filepath)
+	if compression == 'gzip':
+		if shutil.which('pigz') is not None:
+			return 'pigz -c -{:d}'.format(gzip_level)
+		return 'gzip -c -{:d}'.format(gzip_level)
+	if compression == 'zstd':
+		return 'zstd -q -c -T{:d} -{:d}'.format(max(zstd_threads, 0), zstd_level)
+	return None
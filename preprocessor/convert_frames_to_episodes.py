@@ -1,12 +1,17 @@
 import datetime
 import enum
+import functools
 import os
+import shutil
 from uuid import uuid4
 
+import numpy as np
 import pandas as pd
-from numpy import NaN
 
-from preprocessor import directories
+from preprocessor import compression, directories, episode_features, instrumentation, parallel_csv
+from preprocessor.association_index import AssociationIndex
+from preprocessor.pipelining import AsyncWriter, append_to_csv_file, get_process_pool, prefetch, shutdown_process_pool
+from preprocessor.run_journal import RunJournal, atomic_output_file, remove_temporary_files
 
 
 class RBSCauses(enum.Enum):
@@ -22,6 +27,7 @@ class RBSCauses(enum.Enum):
 	class_3_frames = 'b'
 
 
+# built-in episode features (registered in `episode_features`, used by the rule based system)
 class EpisodeFeatures(enum.Enum):
 	rssi__mean = 'rssi__mean'
 	rssi__sd = 'rssi__sd'
@@ -56,12 +62,12 @@ class MappingParameters(enum.Enum):
 
 def get_skeleton_features_dictionary(default_to_list = False):
 	"""
-	Returns a dictionary with all the episode features as keys
+	Returns a dictionary with all the (registered) episode feature names as keys
 	All the values are set by default to 0
 	"""
 
 	skeleton_features = dict()
-	for _feature in EpisodeFeatures:
+	for _feature in episode_features.get_feature_names():
 		if default_to_list:
 			skeleton_features[_feature] = list()
 		else:
@@ -99,8 +105,7 @@ def get_skeleton_rbs_causes_dictionary():
 
 
 def get_output_column_order():
-	features = [item.value for item in EpisodeFeatures]
-	features.sort()
+	features = episode_features.get_feature_names()
 
 	properties = [item.value for item in EpisodeProperties]
 	properties.sort()
@@ -210,9 +215,12 @@ def filter_out_irrelevant_frames(dataframe: pd.DataFrame, clients: list, access_
 	return _df
 
 
-def filter_client_frames(dataframe: pd.DataFrame, client_mac: str):
+def filter_client_frames(dataframe: pd.DataFrame, client_mac: str, association_index: AssociationIndex = None):
 	"""
 	Filter out the rows (frames) that do not associate with the given client.
+
+	:param association_index: index of the dataframe (same rows), to keep only the beacons of the access point
+	                          the client is associated with (None = keep all the beacons)
 	"""
 
 	# Filter
@@ -224,13 +232,20 @@ def filter_client_frames(dataframe: pd.DataFrame, client_mac: str):
 	#   OR
 	#   - receiver address == `client_mac`
 	#   OR
-	#   - packet type is `beacon`
+	#   - packet type is `beacon` (AND the beacon is from the serving access point, if the index is given)
+	if association_index is not None:
+		if association_index.n_frames != len(dataframe):
+			raise ValueError('The association index does not belong to the dataframe')
+		_beacon = association_index.get_client_beacon_mask(client_mac)
+	else:
+		_beacon = dataframe['wlan.fc.type_subtype'] == 8
+
 	_df = dataframe[
 		((dataframe['wlan.sa'] == client_mac) |
 		 (dataframe['wlan.da'] == client_mac) |
 		 (dataframe['wlan.ra'] == client_mac) |
 		 (dataframe['wlan.ta'] == client_mac) |
-		 (dataframe['wlan.fc.type_subtype'] == 8))
+		 _beacon)
 	]
 
 	if len(_df) == 0:
@@ -261,284 +276,76 @@ def find_all_client_mac_addresses(dataframe):
 	return client_mac_addresses
 
 
-def compute_episode_characteristics(ep_dataframe: pd.DataFrame, the_client: str, episode__id, frames_file__uuid):
+def __compute_characteristics(frames: episode_features.EpisodeFrames, features: list):
 	"""
-	Computes all the features required by the machine learning model for an episode dataframe
-	Computes all the episode properties required for processing the output of ML model
+	Evaluates the given features (and the episode properties) for all the episodes of `frames`.
+	The frame masks required by the features are computed once and shared.
+	Returns a dictionary: column name -> array (one value per episode)
 	"""
 
-	out_features = get_skeleton_features_dictionary()
-	out_properties = get_skeleton_properties_dictionary()
-
-	# Filter
-	#   - either `source addr` or `transmitter addr` belongs to the client
-	client_origin_df = ep_dataframe[
-		((ep_dataframe['wlan.sa'] == the_client) |
-		 (ep_dataframe['wlan.ta'] == the_client))
-	]
-
-	def __f1():
-		"""
-		1. EpisodeFeatures.rssi__mean
-		2. EpisodeFeatures.rssi__sd
-		"""
-
-		# make sure every available value is a float
-		try:
-			client_origin_df['radiotap.dbm_antsignal'] = client_origin_df['radiotap.dbm_antsignal'].astype(float,
-			                                                                                               errors = 'raise')
-		except:
-			from uuid import uuid4
-			file_id = uuid4()
-			file_name = str(file_id) + '.csv'
-			file_path = os.path.join(directories.temporary, file_name)
-
-			client_origin_df.to_csv(file_path, index = False, header = True)
-			print('† Exception raised while converting `radiotap.dbm_antsignal` to float for episode. '
-			      'The episode is saved to {:s}'.format(file_name))
-			return NaN, NaN
-
-		_rssi_mean = client_origin_df['radiotap.dbm_antsignal'].mean()
-		_rssi_stddev = client_origin_df['radiotap.dbm_antsignal'].std()
-		return _rssi_mean, _rssi_stddev
-
-	def __f2():
-		"""
-		1. EpisodeFeatures.frame__loss_rate
-		"""
-
-		_df_retry_true = client_origin_df[
-			(client_origin_df['wlan.fc.retry'] == 1)
-		]
-		_df_retry_false = client_origin_df[
-			(client_origin_df['wlan.fc.retry'] == 0)
-		]
-
-		_num_true = len(_df_retry_true)
-		_num_false = len(_df_retry_false)
-
-		if _num_true + _num_false > 0:
-			_loss_rate = float(_num_true) / float(_num_true + _num_false)
-		else:
-			_loss_rate = -1  # could not calculate
-
-		return _loss_rate
-
-	def __f3():
-		"""
-		1. EpisodeFeatures.frame__frequency
-		"""
-
-		# no frames in client source dataframe
-		if len(client_origin_df) == 0:
-			return 0
-
-		_, _, _ep_duration = __p1()
-		_num_frames = len(client_origin_df)
+	with instrumentation.measure('masks', memory = False):
+		for mask_name in episode_features.get_required_frame_masks(features):
+			frames.mask(mask_name)
 
-		_frequency = -1
-		if _num_frames >= 0 and _ep_duration > 0:
-			_frequency = float(_num_frames) / float(_ep_duration)
+	output = dict()
+	for feature in features:
+		with instrumentation.measure('feature.' + feature.name, memory = False):
+			output[feature.name] = feature.aggregate(frames)
 
-		return _frequency
-
-	def __f4():
-		"""
-		1. EpisodeFeatures.ap_deauth__count
-		"""
-
-		# Filter:
-		#   - packet type = `12` (deauth)
-		#   - destination should be `the client`
-		_deauth_ap_df = ep_dataframe[
-			((ep_dataframe['wlan.fc.type_subtype'] == 12) &
-			 (ep_dataframe['wlan.da'] == the_client))
-		]
-
-		_ap_deauth_count = len(_deauth_ap_df)
-		return _ap_deauth_count
-
-	def __f5():
-		"""
-		1. EpisodeFeatures.client_deauth__count
-		"""
-
-		# filter:
-		#   - packet type = `12` (deauth)
-		#   - source should be `the client`
-		_deauth_client_df = ep_dataframe[
-			((ep_dataframe['wlan.fc.type_subtype'] == 12) &
-			 (ep_dataframe['wlan.sa'] == the_client))
-		]
-
-		_client_deauth_count = len(_deauth_client_df)
-		return _client_deauth_count
-
-	def __f6():
-		"""
-		1. EpisodeFeatures.beacon__count
-		2. EpisodeFeatures.max_consecutive_beacons__count
-		3. EpisodeFeatures.ack__count
-		4. EpisodeFeatures.null_dataframe__count
-		"""
-
-		# filter:
-		#   - packet type = `8` (beacon)
-		_beacon_df = ep_dataframe[
-			(ep_dataframe['wlan.fc.type_subtype'] == 8)
-		]
-
-		# beacon count
-		_beacon_count = len(_beacon_df)
-
-		# max consecutive beacon count (earlier `beacon interval count`)
-		#   - defines maximum number of consecutive beacons in the episodes
-		#   - consecutive == interval between packets < 105 milliseconds
-		_max_consecutive_beacon_count = 0
-		_beacon_interval_count = 0
-		if _beacon_count > 1:
-			_previous_epoch = float(_beacon_df.head(1)['frame.time_epoch'])
-			_beacon_df = _beacon_df.iloc[1:]
-
-			for index, frame in _beacon_df.iterrows():
-				_current_epoch = float(frame['frame.time_epoch'])
-				_delta_time = _previous_epoch - _current_epoch
-
-				if _delta_time > 0.105:
-					_beacon_interval_count += 1
-				else:
-					_beacon_interval_count = 0
-
-				_max_consecutive_beacon_count = max(_max_consecutive_beacon_count, _beacon_interval_count)
-				_previous_epoch = _current_epoch
-
-		# filter:
-		#   - packet type = `29` (ack)
-		#   - receiver should be `the client`
-		_ack_df = ep_dataframe[
-			((ep_dataframe['wlan.fc.type_subtype'] == 29) &
-			 (ep_dataframe['wlan.ra'] == the_client))
-		]
-		_ack_count = len(_ack_df)
-
-		# filter:
-		#   - packet type = `36` or `44` (null, qos null)
-		#   - source should be in clients
-		#   - power management bit = 0
-		_null_df = ep_dataframe[
-			(((ep_dataframe['wlan.fc.type_subtype'] == 36) | (ep_dataframe['wlan.fc.type_subtype'] == 44)) &
-			 (ep_dataframe['wlan.sa'] == the_client) &
-			 (ep_dataframe['wlan.fc.pwrmgt'] == 0))
-		]
-		_null_dataframe_count = len(_null_df)
-		return _beacon_count, _max_consecutive_beacon_count, _ack_count, _null_dataframe_count
-
-	def __f7():
-		"""
-		1. EpisodeFeatures.failure_assoc__count
-		"""
+	with instrumentation.measure('properties', memory = False):
+		_ep_start_epochs, _ep_end_epochs = frames.start_and_end_epochs()
+		output[EpisodeProperties.start__time_epoch.value] = _ep_start_epochs
+		output[EpisodeProperties.end__time_epoch.value] = _ep_end_epochs
+		output[EpisodeProperties.episode_duration.value] = _ep_end_epochs - _ep_start_epochs
+	return output
 
-		# filter:
-		#   - packet type = `1` or `3` (association response, re-association response)
-		#   - `status code` != 0
-		#   - destination should be `the client`
-		_assoc_reassoc_failure_response_df = ep_dataframe[
-			(((ep_dataframe['wlan.fc.type_subtype'] == 1) | (ep_dataframe['wlan.fc.type_subtype'] == 3)) &
-			 (ep_dataframe['wlan_mgt.fixed.status_code'] != 0) &
-			 (ep_dataframe['wlan.da'] == the_client))
-		]
-		_failure_assoc_reassoc_count = len(_assoc_reassoc_failure_response_df)
-		return _failure_assoc_reassoc_count
 
-	def __f8():
-		"""
-		1. EpisodeFeatures.success_assoc__count
-		"""
+def compute_client_episodes_characteristics(dataframe: pd.DataFrame, the_client: str, frames_file__uuid,
+                                            feature_names: list = None):
+	"""
+	Computes the features required by the machine learning model and the episode properties for all the
+	episodes of a client at once (frames with the `episode__id` field, sorted by `frame.time_epoch`).
+	Returns a dataframe with one row per episode (in episode order).
 
-		# filter:
-		#   - packet type = `1` or `3` (association response, re-association response)
-		#   - `status code` = 0
-		#   - destination should be `the client`
-		_assoc_reassoc_success_response_df = ep_dataframe[
-			(((ep_dataframe['wlan.fc.type_subtype'] == 1) | (ep_dataframe['wlan.fc.type_subtype'] == 3)) &
-			 (ep_dataframe['wlan_mgt.fixed.status_code'] == 0) &
-			 (ep_dataframe['wlan.da'] == the_client))
-		]
-		_success_assoc_reassoc_count = len(_assoc_reassoc_success_response_df)
-		return _success_assoc_reassoc_count
+	:param feature_names: features to compute (None = all registered features, see `get_features_to_compute`).
+	                      The other features are set to `episode_features.feature_placeholder`.
+	"""
 
-	def __f9():
-		"""
-		1. EpisodeFeatures.class_3_frames__count
-		"""
+	features = episode_features.get_features(feature_names)
+	frames = episode_features.EpisodeFrames(dataframe, the_client,
+	                                        dataframe[EpisodeProperties.episode__id.value].values)
 
-		class_3_frames_list = [
-			32,  # type 2 (data), data
-			33,  # type 2 (data), data + cf_ack
-			34,  # type 2 (data), data + cf_poll
-			35,  # type 2 (data), data + cf_ack + cf_poll
-			36,  # type 2 (data), null
-			37,  # type 2 (data), cf_ack
-			38,  # type 2 (data), cf_poll
-			39,  # type 2 (data), cf_ack + cf_poll
-			40,  # type 2 (data), QoS data
-			41,  # type 2 (data), QoS data + cf_ack
-			42,  # type 2 (data), QoS data + cf_poll
-			43,  # type 2 (data), QoS data + cf_ack + cf_poll
-			44,  # type 2 (data), QoS null
-			46,  # type 2 (data), QoS + cf_poll (no data)
-			47,  # type 2 (data), Qos + cf_ack (no data)
-			26,  # type 1 (control), ps_poll
-			24,  # type 1 (control), block ack request
-			25,  # type 1 (control), block ack
-			13,  # type 0 (management), action
-			14  # type 0 (management), reserved
-		]
+	output = __compute_characteristics(frames, features)
+	for _feature in episode_features.get_feature_names():
+		if _feature not in output:
+			output[_feature] = episode_features.feature_placeholder
+	output[EpisodeProperties.episode__id.value] = frames.episode_ids.astype(int)
+	output[EpisodeProperties.associated_client__mac.value] = the_client
+	output[EpisodeProperties.frames_file__uuid.value] = frames_file__uuid
+	return pd.DataFrame(output)
 
-		# filter:
-		#   - packet subtype in `class_3_frames_list`
-		_class_3_df = ep_dataframe[
-			(ep_dataframe['wlan.fc.type_subtype'].isin(class_3_frames_list))
-		]
-		_class_3_frames_count = len(_class_3_df)
 
-		return _class_3_frames_count
+def compute_episode_characteristics(ep_dataframe: pd.DataFrame, the_client: str, episode__id, frames_file__uuid):
+	"""
+	Computes all the features required by the machine learning model for an episode dataframe
+	Computes all the episode properties required for processing the output of ML model
+	(see `compute_client_episodes_characteristics` for all the episodes of a client at once)
+	"""
 
-	def __p1():
-		"""
-		1. EpisodeProperties.start__time_epoch
-		2. EpisodeProperties.end__time_epoch
-		3. EpisodeProperties.episode_duration
-		"""
+	out_features = get_skeleton_features_dictionary()
+	out_properties = get_skeleton_properties_dictionary()
 
-		_ep_start_epoch = float(ep_dataframe.head(1)['frame.time_epoch'])
-		_ep_end_epoch = float((ep_dataframe.tail(1))['frame.time_epoch'])
-		_ep_duration = float(_ep_end_epoch - _ep_start_epoch)
-		return _ep_start_epoch, _ep_end_epoch, _ep_duration
+	frames = episode_features.EpisodeFrames(ep_dataframe, the_client, np.zeros(len(ep_dataframe), dtype = int))
+	output = __compute_characteristics(frames, episode_features.get_features())
 
-	def __p2():
-		"""
-		1. EpisodeProperties.associated_client__mac
-		2. EpisodeProperties.episode__id
-		3. EpisodeProperties.frames_file__uuid
-		"""
-		return the_client, episode__id, frames_file__uuid
-
-	out_features[EpisodeFeatures.rssi__mean], out_features[EpisodeFeatures.rssi__sd] = __f1()
-	out_features[EpisodeFeatures.frame__loss_rate] = __f2()
-	out_features[EpisodeFeatures.frame__frequency] = __f3()
-	out_features[EpisodeFeatures.ap_deauth__count] = __f4()
-	out_features[EpisodeFeatures.client_deauth__count] = __f5()
-	out_features[EpisodeFeatures.beacon__count], out_features[EpisodeFeatures.max_consecutive_beacons__count], \
-	out_features[EpisodeFeatures.ack__count], out_features[EpisodeFeatures.null_dataframe__count] = __f6()
-	out_features[EpisodeFeatures.failure_assoc__count] = __f7()
-	out_features[EpisodeFeatures.success_assoc__count] = __f8()
-	out_features[EpisodeFeatures.class_3_frames__count] = __f9()
-
-	out_properties[EpisodeProperties.start__time_epoch], out_properties[EpisodeProperties.end__time_epoch], \
-	out_properties[EpisodeProperties.episode_duration] = __p1()
-	out_properties[EpisodeProperties.associated_client__mac], out_properties[EpisodeProperties.episode__id], \
-	out_properties[EpisodeProperties.frames_file__uuid] = __p2()
+	for _feature in out_features:
+		out_features[_feature] = output[_feature][0]
+	for _property in [EpisodeProperties.start__time_epoch, EpisodeProperties.end__time_epoch,
+	                  EpisodeProperties.episode_duration, ]:
+		out_properties[_property] = float(output[_property.value][0])
+	out_properties[EpisodeProperties.associated_client__mac] = the_client
+	out_properties[EpisodeProperties.episode__id] = episode__id
+	out_properties[EpisodeProperties.frames_file__uuid] = frames_file__uuid
 
 	return out_features, out_properties
 
@@ -683,6 +490,49 @@ def assign_rule_based_system_tags_to_episodes(episodes_df: pd.DataFrame):
 	return episodes_df
 
 
+def get_rule_based_system_features():
+	"""
+	Returns the names of the features used by `assign_rule_based_system_tags_to_episodes`.
+	"""
+
+	return [
+		EpisodeFeatures.rssi__mean.value,
+		EpisodeFeatures.rssi__sd.value,
+		EpisodeFeatures.frame__loss_rate.value,
+		EpisodeFeatures.frame__frequency.value,
+		EpisodeFeatures.ap_deauth__count.value,
+		EpisodeFeatures.client_deauth__count.value,
+		EpisodeFeatures.beacon__count.value,
+		EpisodeFeatures.max_consecutive_beacons__count.value,
+		EpisodeFeatures.ack__count.value,
+		EpisodeFeatures.null_dataframe__count.value,
+		EpisodeFeatures.failure_assoc__count.value,
+		EpisodeFeatures.success_assoc__count.value,
+		EpisodeFeatures.class_3_frames__count.value,
+	]
+
+
+def get_features_to_compute(required_features: list, assign_rbs_tags: bool):
+	"""
+	Returns the names of the features to compute: the required features plus the features used by the
+	rule based system (if the tags are assigned) and the features that can be null (the episodes with null
+	features are dropped, as when all the features are computed). `None` = all features.
+	"""
+
+	if required_features is None:
+		return None
+
+	feature_names = list(required_features)
+	extra_features = episode_features.get_nullable_feature_names()
+	if assign_rbs_tags:
+		extra_features = extra_features + get_rule_based_system_features()
+	for _feature in extra_features:
+		if _feature not in feature_names:
+			feature_names.append(_feature)
+	feature_names.sort()
+	return feature_names
+
+
 def convert_ep_characteristics_to_dataframe(episode_characteristics: list):
 	"""
 	Creates a dataframe from a list of 2-tuples containing ep_features and ep_properties
@@ -690,14 +540,14 @@ def convert_ep_characteristics_to_dataframe(episode_characteristics: list):
 
 	# merge all dictionaries into one big dictionary
 	output_dictionary = dict()
-	for _feature in EpisodeFeatures:
-		output_dictionary[_feature.value] = list()
+	for _feature in episode_features.get_feature_names():
+		output_dictionary[_feature] = list()
 	for _property in EpisodeProperties:
 		output_dictionary[_property.value] = list()
 
 	for _features_dict, _properties_dict in episode_characteristics:
-		for _feature in EpisodeFeatures:
-			output_dictionary[_feature.value].append(_features_dict[_feature])
+		for _feature in episode_features.get_feature_names():
+			output_dictionary[_feature].append(_features_dict[_feature])
 		for _property in EpisodeProperties:
 			output_dictionary[_property.value].append(_properties_dict[_property])
 
@@ -708,7 +558,11 @@ def convert_ep_characteristics_to_dataframe(episode_characteristics: list):
 
 # #############################################################################
 
-def prepare_environment():
+def prepare_environment(resume = False):
+	"""
+	:param resume: the outputs of an interrupted run are in the output directories (see `run_journal`)
+	"""
+
 	# create directories if they don't exist
 	if not os.path.exists(directories.frames_csv_files) or not os.path.isdir(directories.frames_csv_files):
 		os.mkdir(directories.frames_csv_files)
@@ -726,6 +580,15 @@ def prepare_environment():
 		print('"{:s}" is empty! Please create `frames csv file` and try again!'.format(
 			directories.frames_csv_files))
 		exit(0)
+
+	if resume:
+		# the outputs of the interrupted run are kept, only its incomplete outputs are removed
+		for directory in [directories.semi_processed_frames_csv_files, directories.processed_episode_csv_files, ]:
+			n_removed = remove_temporary_files(directory)
+			if n_removed > 0:
+				print('• Removed {:d} incomplete output files from "{:s}"'.format(n_removed, directory))
+		return
+
 	# make sure directories.semi_processed_frames_csv_files is empty
 	if len(os.listdir(directories.semi_processed_frames_csv_files)) != 0:
 		print('"{:s}" is not empty! Please empty the directory and try again!'.format(
@@ -745,7 +608,7 @@ def get_frames_csv_file_names():
 
 	frames_csv_file_names = list()
 	for file in os.listdir(directories.frames_csv_files):
-		if os.path.splitext(file)[1] in directories.csv_files_extensions:
+		if compression.is_csv_file(file):
 			frames_csv_file_names.append(file)
 
 	# sort so that we always read in a predefined order
@@ -754,7 +617,54 @@ def get_frames_csv_file_names():
 	return frames_csv_file_names
 
 
-def read_frames_csv_file(filepath, error_bad_lines: bool = False, warn_bad_lines: bool = True):
+def coerce_rssi_values(dataframe: pd.DataFrame):
+	"""
+	Converts `radiotap.dbm_antsignal` to float for the complete dataframe in a single vectorized pass.
+	Returns:
+		1. the coerced rssi series (values that could not be parsed are set to NaN)
+		2. dataframe of the frames whose rssi value could not be parsed, along with the reason
+	"""
+
+	_raw_rssi = dataframe['radiotap.dbm_antsignal']
+	_rssi = pd.to_numeric(_raw_rssi, errors = 'coerce')
+
+	# reasons for quarantine
+	#   - value is available but is not a number
+	#   - value is a number but is not finite (inf, -inf)
+	_not_a_number = _raw_rssi.notna() & _rssi.isna()
+	_not_finite = _rssi.isin([np.inf, -np.inf])
+	_quarantine = _not_a_number | _not_finite
+
+	# `frame__position` is the position of the frame (row) in the frames csv file
+	quarantined_df = pd.DataFrame({
+		'frame__position': dataframe.index[_quarantine],
+		'frame.time_epoch': dataframe['frame.time_epoch'][_quarantine].values,
+		'radiotap.dbm_antsignal': _raw_rssi[_quarantine].values,
+		'quarantine__reason': np.where(_not_a_number[_quarantine], 'not a number', 'not finite'),
+	})
+
+	_rssi[_not_finite] = np.nan
+	return _rssi, quarantined_df
+
+
+def write_quarantined_frames(quarantined_df: pd.DataFrame, frames_csv_name: str, quarantine_file):
+	"""
+	Appends the quarantined frames of a frames csv file to the (per-run) quarantine file.
+	"""
+
+	if len(quarantined_df) == 0:
+		return
+
+	quarantined_df['frames_file__name'] = frames_csv_name
+	quarantine_columns = ['frames_file__name', 'frame__position', 'frame.time_epoch', 'radiotap.dbm_antsignal',
+	                      'quarantine__reason', ]
+	quarantine_headers = not os.path.exists(quarantine_file)
+	quarantined_df.to_csv(quarantine_file, mode = 'a', index = False, header = quarantine_headers,
+	                      columns = quarantine_columns)
+
+
+def read_frames_csv_file(filepath, error_bad_lines: bool = False, warn_bad_lines: bool = True,
+                         quarantine_file = None, read_workers: int = None):
 	"""
 	Read csv file using `pandas` and convert it to a `dataframe`.
 	Applies filters and other optimizations while reading to sanitize the data as much as possible.
@@ -762,11 +672,13 @@ def read_frames_csv_file(filepath, error_bad_lines: bool = False, warn_bad_lines
 	:param filepath: path to the csv file
 	:param error_bad_lines: raise an error for malformed csv line (False = drop bad lines)
 	:param warn_bad_lines: raise a warning for malformed csv line (only if `error_bad_lines` is False)
+	:param quarantine_file: csv file to which frames with unparseable rssi values are appended (None = don't save)
+	:param read_workers: parse the file in parallel byte ranges with this number of processes, for large files
+	                     (None = single process), see `parallel_csv`
 	:return: dataframe object
 	"""
 
-	csv_dataframe = pd.read_csv(
-		filepath_or_buffer = filepath,
+	read_csv_kwargs = dict(
 		sep = ',',  # comma separated values (default)
 		header = 0,  # use first row as column_names
 		index_col = None,  # do not use any column to index
@@ -775,38 +687,239 @@ def read_frames_csv_file(filepath, error_bad_lines: bool = False, warn_bad_lines
 		na_filter = True,  # detect `not available` values
 		skip_blank_lines = True,  # skip any blank lines in the file
 		float_precision = 'high',
-		error_bad_lines = error_bad_lines,
-		warn_bad_lines = warn_bad_lines
+		on_bad_lines = 'error' if error_bad_lines else ('warn' if warn_bad_lines else 'skip')
 	)
 
+	with instrumentation.measure('read') as measurement:
+		if read_workers is not None and read_workers > 1:
+			csv_dataframe = parallel_csv.read_csv_parallel(filepath, n_workers = read_workers, **read_csv_kwargs)
+		else:
+			csv_dataframe = pd.read_csv(filepath_or_buffer = filepath, **read_csv_kwargs)
+		measurement.rows = len(csv_dataframe)
+
 	# drop unnecessary columns
 	csv_dataframe.drop(columns = ['radiotap.dbm_antsignal_2', 'radiotap.dbm_antsignal_3', 'radiotap.dbm_antsignal_4',
 	                              'radiotap.dbm_antsignal_5', ], inplace = True)
 
 	print('• Dataframe shape (on read):', csv_dataframe.shape)
 
+	# make sure every available rssi value is a float
+	#   - unparseable values are set to NaN (and dropped below) and the frames are quarantined
+	with instrumentation.measure('rssi_coercion') as measurement:
+		csv_dataframe['radiotap.dbm_antsignal'], quarantined_df = coerce_rssi_values(csv_dataframe)
+		if len(quarantined_df) > 0:
+			print('† {:d} frames have unparseable `radiotap.dbm_antsignal` values'.format(len(quarantined_df)))
+			if quarantine_file is not None:
+				write_quarantined_frames(quarantined_df, os.path.basename(filepath), quarantine_file)
+		measurement.rows = len(quarantined_df)
+
 	# sanitize data
 	#   - drop not available values
-	csv_dataframe.dropna(axis = 0, subset = ['frame.time_epoch', 'radiotap.dbm_antsignal', ], inplace = True)
+	with instrumentation.measure('drop_null') as measurement:
+		csv_dataframe.dropna(axis = 0, subset = ['frame.time_epoch', 'radiotap.dbm_antsignal', ], inplace = True)
+		measurement.rows = len(csv_dataframe)
 	print('• Dataframe shape (after dropping null values):', csv_dataframe.shape)
 
 	# sort the dataframe by `frame.time_epoch`
-	csv_dataframe.sort_values(
-		by = 'frame.time_epoch',
-		axis = 0,
-		ascending = True,
-		inplace = True,
-		na_position = 'last'
-	)
+	with instrumentation.measure('sort') as measurement:
+		csv_dataframe.sort_values(
+			by = 'frame.time_epoch',
+			axis = 0,
+			ascending = True,
+			inplace = True,
+			na_position = 'last'
+		)
+		measurement.rows = len(csv_dataframe)
 
 	return csv_dataframe
 
 
+def get_semi_processed_output_column_order(frames_columns: list):
+	"""
+	Column order of the semi processed frames csv files, for the columns of a frames csv file.
+	"""
+
+	column_order = sorted(frames_columns)
+	column_order.append(EpisodeProperties.episode__id.value)
+	column_order.append(EpisodeProperties.associated_client__mac.value)
+	column_order.append(EpisodeProperties.frames_file__uuid.value)
+	return column_order
+
+
+def get_processed_output_column_order(assign_rbs_tags: bool):
+	"""
+	Column order of the processed episode csv files.
+	"""
+
+	column_order = get_output_column_order()
+	if assign_rbs_tags:
+		column_order.append('rbs__cause_tags')
+	return column_order
+
+
+def get_mapping_dataframe(timestamp: datetime.datetime, frames_csv_name: str, frames_file__uuid: str):
+	"""
+	Returns the mapping file entry of a frames csv file as a dataframe, and its column order.
+	"""
+
+	mapping = {
+		MappingParameters.timestamp__date.value: [timestamp.strftime('%d-%m-%Y'), ],
+		MappingParameters.timestamp__time.value: [timestamp.strftime('%H-%M-%S'), ],
+		MappingParameters.frames_file__name.value: [frames_csv_name, ],
+		MappingParameters.frames_file__uuid.value: [frames_file__uuid, ],
+	}
+	mapping_df = pd.DataFrame.from_dict(mapping)
+	mapping_columns = mapping_df.columns.values.tolist()
+	mapping_columns.sort()
+	return mapping_df, mapping_columns
+
+
+def process_client_frames(main_dataframe: pd.DataFrame, the_client: str, frames_file__uuid: str,
+                          association_index: AssociationIndex = None, feature_names: list = None,
+                          shard_duration: float = None, shard_workers: int = None):
+	"""
+	Processes the frames of a client: filters the frames of the client, defines the episodes and computes their
+	characteristics.
+	Returns
+		1. the semi processed frames of the client (frames with the episode, client and frames file uuid fields)
+		2. the episode characteristics of the client (one row per episode)
+	or (None, None) if the client has no episodes.
+
+	:param main_dataframe: the frames csv file (after `filter_out_irrelevant_frames`), not modified
+	:param association_index: see `filter_client_frames`
+	:param feature_names: see `compute_client_episodes_characteristics`
+	:param shard_duration: define the episodes and compute their characteristics in time windows of this duration
+	                       (seconds) processed in parallel, see `episode_shards` (None = in one piece)
+	:param shard_workers: number of processes for the shards (None = number of cpus)
+	"""
+
+	# a. copy the main_dataframe
+	with instrumentation.measure('client_copy') as measurement:
+		dataframe = main_dataframe.copy(deep = True)
+		measurement.rows = len(dataframe)
+
+	# b. filter frames belonging to the client
+	with instrumentation.measure('client_filter') as measurement:
+		dataframe = filter_client_frames(dataframe, the_client, association_index = association_index)
+		measurement.rows = 0 if dataframe is None else len(dataframe)
+	if dataframe is None:
+		print('• No relevant frames found for client {:s}'.format(the_client))
+		return None, None
+
+	# c. (optional) define episodes and compute their characteristics in time-window shards
+	if shard_duration is not None:
+		from preprocessor import episode_shards
+		dataframe, ep_characteristics_df = episode_shards.define_episodes_and_characteristics(
+			dataframe, the_client, frames_file__uuid, feature_names = feature_names, shard_duration = shard_duration,
+			max_workers = shard_workers)
+		print('• Episodes generated for client {:s} -'.format(the_client),
+		      0 if ep_characteristics_df is None else len(ep_characteristics_df))
+		if dataframe is None:
+			return None, None
+		dataframe[EpisodeProperties.associated_client__mac.value] = the_client
+		dataframe[EpisodeProperties.frames_file__uuid.value] = frames_file__uuid
+		return dataframe, ep_characteristics_df
+
+	# c. define episodes on frames
+	with instrumentation.measure('segmentation') as measurement:
+		result = define_episodes_from_frames(dataframe)
+		measurement.rows = 0 if result is None else len(result[0])
+	if result is not None:
+		dataframe, ep_count, ep_indexes = result
+		print('• Episodes generated for client {:s} -'.format(the_client), ep_count)
+
+		if ep_count == 0:
+			return None, None
+	else:
+		print('• Episodes generated for client {:s} -'.format(the_client), 0)
+		return None, None
+
+	# c.1 semi processed frames (can be used to link predictions for episodes back to frames)
+	#   - add client
+	#   - add frames file uid
+	dataframe[EpisodeProperties.associated_client__mac.value] = the_client
+	dataframe[EpisodeProperties.frames_file__uuid.value] = frames_file__uuid
+
+	# d. compute the characteristics of all the episodes of the client (the added columns are not used)
+	with instrumentation.measure('characteristics') as measurement:
+		ep_characteristics_df = compute_client_episodes_characteristics(dataframe, the_client, frames_file__uuid,
+		                                                                feature_names = feature_names)
+		measurement.rows = len(dataframe)
+
+	return dataframe, ep_characteristics_df
+
+
+def finalize_episodes_dataframe(ep_characteristics_list: list, assign_rbs_tags: bool):
+	"""
+	Makes the episodes dataframe of a frames csv file from the episode characteristics of its clients:
+	drops the episodes with null values and (optionally) assigns the tags of the rule based system.
+	"""
+
+	# make a dataframe from episode characteristics
+	with instrumentation.measure('to_dataframe') as measurement:
+		if len(ep_characteristics_list) > 0:
+			ep_characteristics_df = pd.concat(ep_characteristics_list, ignore_index = True)
+		else:
+			ep_characteristics_df = pd.DataFrame(columns = get_output_column_order())
+		measurement.rows = len(ep_characteristics_df)
+	print('• Total episodes generated: {:d}'.format(len(ep_characteristics_df)))
+	# drop null values, since ML model can't make any sense of this
+	ep_characteristics_df.dropna(axis = 0, inplace = True)
+	print('• Total episodes generated (after dropping null values): {:d}'.format(len(ep_characteristics_df)))
+
+	# (optional) assign tags for causes according to old rule-based-system
+	if assign_rbs_tags:
+		with instrumentation.measure('tagging') as measurement:
+			ep_characteristics_df = assign_rule_based_system_tags_to_episodes(ep_characteristics_df)
+			measurement.rows = len(ep_characteristics_df)
+
+	return ep_characteristics_df
+
+
+def get_processed_outputs(ep_characteristics_df: pd.DataFrame, frames_csv_name: str, clients: list,
+                          separate_client_files: bool):
+	"""
+	Returns the processed episode csv files of a frames csv file as a list of (csv file name, dataframe).
+	"""
+
+	if not separate_client_files:
+		return [(os.path.basename(frames_csv_name), ep_characteristics_df), ]
+
+	outputs = list()
+	for the_client in clients:
+		_df = ep_characteristics_df[
+			(ep_characteristics_df[EpisodeProperties.associated_client__mac.value] == the_client)
+		]
+		name, extension = compression.split_extension(os.path.basename(frames_csv_name))
+		outputs.append((str.format('{:s}_{:s}{:s}', name, the_client, extension), _df))
+	return outputs
+
+
 def process_frame_csv_file(frames_csv_name: str, access_points, clients, assign_rbs_tags, separate_client_files,
-                           mapping_file):
+                           mapping_file, quarantine_file = None, frames_csv_dir = directories.frames_csv_files,
+                           semi_processed_dir = directories.semi_processed_frames_csv_files,
+                           processed_dir = directories.processed_episode_csv_files, required_features = None,
+                           serving_ap_beacons_only = False, main_dataframe = None, writer: AsyncWriter = None,
+                           shard_duration = None, shard_workers = None, read_workers = None, episode_index = None):
 	"""
 	Processes a given frame csv file to generate episode characteristics.
-
+	(see `process_frame_csv_file_resumable` for crash-safe outputs)
+
+	:param shard_duration: process the frames of each client in time windows of this duration (seconds) in
+	                       parallel (None = in one piece), see `episode_shards`
+	:param shard_workers: number of processes for the shards (None = number of cpus)
+	:param read_workers: see `read_frames_csv_file`
+	:param episode_index: `episode_index.EpisodeIndex` to add the episodes to (None = not indexed)
+	:param main_dataframe: the frames csv file, if it was already read (`read_frames_csv_file`)
+	:param writer: writer to queue the outputs to (None = write synchronously)
+	:param serving_ap_beacons_only: keep only the beacons of the access point each client is associated with
+	                                (all beacons while unassociated), see `association_index`
+	:param required_features: names of the features to compute, the others are set to a placeholder
+	                          (None = all features)
+	:param processed_dir: directory for the output episode csv files
+	:param semi_processed_dir: directory for the output semi processed frames csv files
+	:param frames_csv_dir: directory of the input frames csv file
+	:param quarantine_file:
 	:param mapping_file:
 	:param frames_csv_name:
 	:param access_points:
@@ -820,9 +933,12 @@ def process_frame_csv_file(frames_csv_name: str, access_points, clients, assign_
 	timestamp = datetime.datetime.now()
 
 	# frames csv file
-	frames_csv_file = os.path.join(directories.frames_csv_files, frames_csv_name)
+	frames_csv_file = os.path.join(frames_csv_dir, frames_csv_name)
+	instrumentation.set_context(frames_file = frames_csv_name)
 	# read the frames csv file
-	main_dataframe = read_frames_csv_file(frames_csv_file)
+	if main_dataframe is None:
+		main_dataframe = read_frames_csv_file(frames_csv_file, quarantine_file = quarantine_file,
+		                                      read_workers = read_workers)
 	frames_file__uuid = str(uuid4())
 	frames_file__uuid = timestamp.strftime('%d%m%Y%H%M%S') + '.' + frames_file__uuid
 	print('• UUID generated for the file {:s}: {:s}'.format(frames_csv_name, frames_file__uuid))
@@ -830,133 +946,264 @@ def process_frame_csv_file(frames_csv_name: str, access_points, clients, assign_
 	if clients is None:
 		clients = find_all_client_mac_addresses(main_dataframe)
 
-	# output column orders
-	semi_processed_output_column_order = main_dataframe.columns.values.tolist()
-	semi_processed_output_column_order.sort()
-	semi_processed_output_column_order.append(EpisodeProperties.episode__id.value)
-	semi_processed_output_column_order.append(EpisodeProperties.associated_client__mac.value)
-	semi_processed_output_column_order.append(EpisodeProperties.frames_file__uuid.value)
+	def __write(stage, function, rows):
+		# write now, or queue the write to the asynchronous writer
+		if writer is None:
+			with instrumentation.measure(stage) as measurement:
+				function()
+				measurement.rows = rows
+		else:
+			writer.submit(stage, function, rows = rows)
 
-	processed_output_column_order = get_output_column_order()
-	if assign_rbs_tags:
-		processed_output_column_order.append('rbs__cause_tags')
+	# output column orders
+	semi_processed_output_column_order = get_semi_processed_output_column_order(main_dataframe.columns.values.tolist())
+	processed_output_column_order = get_processed_output_column_order(assign_rbs_tags)
 
 	# update mapping file
-	mapping = {
-		MappingParameters.timestamp__date.value: [timestamp.strftime('%d-%m-%Y'), ],
-		MappingParameters.timestamp__time.value: [timestamp.strftime('%H-%M-%S'), ],
-		MappingParameters.frames_file__name.value: [frames_csv_name, ],
-		MappingParameters.frames_file__uuid.value: [frames_file__uuid, ],
-	}
-	mapping_df = pd.DataFrame.from_dict(mapping)
-	mapping_columns = mapping_df.columns.values.tolist()
-	mapping_columns.sort()
-	mapping_headers = not os.path.exists(mapping_file)
-	mapping_df.to_csv(mapping_file, mode = 'a', index = False, header = mapping_headers,
-	                  columns = mapping_columns)
+	mapping_df, mapping_columns = get_mapping_dataframe(timestamp, frames_csv_name, frames_file__uuid)
+	__write('mapping_write', functools.partial(append_to_csv_file, mapping_df, mapping_file, mapping_columns),
+	        rows = len(mapping_df))
 
-	# all episodes characteristics as list of 2-tuples
-	#   - 1. features
-	#   - 2. properties
+	# episodes characteristics (features and properties) as a dataframe per client
 	ep_characteristics_list = list()
+	feature_names = get_features_to_compute(required_features, assign_rbs_tags)
+	if feature_names is not None:
+		print('• Computing {:d} of {:d} features:'.format(len(feature_names), len(episode_features.get_feature_names())),
+		      feature_names)
 
 	# ### Processing ###
 	# 1. keep only relevant frames in memory
-	main_dataframe = filter_out_irrelevant_frames(main_dataframe, clients, access_points)
+	with instrumentation.measure('relevance_filter') as measurement:
+		main_dataframe = filter_out_irrelevant_frames(main_dataframe, clients, access_points)
+		measurement.rows = len(main_dataframe)
 	print('• Dataframe shape (relevance filter):', main_dataframe.shape)
 
-	# 2. for each client...
-	for the_client in clients:
-		# 2.a. copy the main_dataframe
-		dataframe = main_dataframe.copy(deep = True)
+	# 1.a. (optional) index of the access point each client is associated with, once for the file
+	association_index = None
+	if serving_ap_beacons_only:
+		with instrumentation.measure('association_index') as measurement:
+			association_index = AssociationIndex(main_dataframe, clients)
+			measurement.rows = len(main_dataframe)
 
-		# 2.b. filter frames belonging to the client
-		dataframe = filter_client_frames(dataframe, the_client)
+	# 2. for each client, define the episodes and compute their characteristics
+	for the_client in clients:
+		instrumentation.set_context(frames_file = frames_csv_name, client = the_client)
+		dataframe, client_ep_characteristics_df = process_client_frames(main_dataframe, the_client, frames_file__uuid,
+		                                                                association_index = association_index,
+		                                                                feature_names = feature_names,
+		                                                                shard_duration = shard_duration,
+		                                                                shard_workers = shard_workers)
 		if dataframe is None:
-			print('• No relevant frames found for client {:s}'.format(the_client))
 			continue
 
-		# 2.c. define episodes on frames
-		result = define_episodes_from_frames(dataframe)
-		if result is not None:
-			dataframe, ep_count, ep_indexes = result
-			print('• Episodes generated for client {:s} -'.format(the_client), ep_count)
+		# 2.a. save semi_processed csv file for later (can be used to link predictions for episodes back to frames)
+		output_csvname = frames_file__uuid + compression.split_extension(frames_csv_name)[1]
+		output_csvfile = os.path.join(semi_processed_dir, output_csvname)
+		__write('semi_processed_write',
+		        functools.partial(dataframe.to_csv, output_csvfile, sep = ',', mode = 'a', index = False,
+		                          header = True, columns = semi_processed_output_column_order,
+		                          compression = compression.get_to_csv_compression(output_csvfile)),
+		        rows = len(dataframe))
+		ep_characteristics_list.append(client_ep_characteristics_df)
+
+	instrumentation.set_context(frames_file = frames_csv_name)
+
+	# 3. make a dataframe from episode characteristics, drop null values, (optional) assign rbs tags
+	ep_characteristics_df = finalize_episodes_dataframe(ep_characteristics_list, assign_rbs_tags)
+
+	# 3.a. (optional) index the episodes
+	if episode_index is not None:
+		with instrumentation.measure('episodes_index') as measurement:
+			measurement.rows = episode_index.add_episodes(ep_characteristics_df, source = frames_csv_name)
+
+	# 4. generate a csv file as an output
+	for output_csvname, _df in get_processed_outputs(ep_characteristics_df, frames_csv_name, clients,
+	                                                 separate_client_files):
+		output_csvfile = os.path.join(processed_dir, output_csvname)
+		__write('episodes_write',
+		        functools.partial(_df.to_csv, output_csvfile, sep = ',', index = False, header = True,
+		                          columns = processed_output_column_order,
+		                          compression = compression.get_to_csv_compression(output_csvfile)),
+		        rows = len(_df))
+
+
+def process_frame_csv_file_resumable(frames_csv_name: str, access_points, clients, assign_rbs_tags,
+                                     separate_client_files, mapping_file, journal: RunJournal, quarantine_file = None,
+                                     frames_csv_dir = directories.frames_csv_files,
+                                     semi_processed_dir = directories.semi_processed_frames_csv_files,
+                                     processed_dir = directories.processed_episode_csv_files,
+                                     required_features = None, serving_ap_beacons_only = False,
+                                     main_dataframe = None, shard_duration = None, shard_workers = None,
+                                     read_workers = None, episode_index = None):
+	"""
+	Processes a given frame csv file like `process_frame_csv_file`, with crash-safe outputs:
+		- the outputs of each client are staged in `directories.temporary` and the client is recorded as
+		  completed in the journal, the clients completed by an interrupted run are skipped
+		- the output files (and the mapping file) are written to temporary files and moved in place once
+		  all the clients are completed
+	The file keeps the uuid (and timestamp) it was given by the interrupted run.
+
+	NOTE: like with `process_frame_csv_file`, the semi processed frames csv file has a header before the frames of
+	each client.
+
+	:param journal: journal of the run
+	(see `process_frame_csv_file` for the other parameters)
+	"""
 
-			if ep_count == 0:
-				continue
-		else:
-			print('• Episodes generated for client {:s} -'.format(the_client), 0)
-			continue
+	# frames csv file
+	frames_csv_file = os.path.join(frames_csv_dir, frames_csv_name)
+	instrumentation.set_context(frames_file = frames_csv_name)
+	# read the frames csv file (the frames of a resumed file are already quarantined)
+	if main_dataframe is None:
+		if frames_csv_name in journal.get_started_files():
+			quarantine_file = None
+		main_dataframe = read_frames_csv_file(frames_csv_file, quarantine_file = quarantine_file,
+		                                      read_workers = read_workers)
+
+	# uuid of the file, the journaled one if the file was started by an interrupted run
+	timestamp = datetime.datetime.now()
+	frames_file__uuid = timestamp.strftime('%d%m%Y%H%M%S') + '.' + str(uuid4())
+	frames_file__uuid, timestamp = journal.start_file(frames_csv_name, frames_file__uuid, timestamp.isoformat())
+	timestamp = datetime.datetime.fromisoformat(timestamp)
+	print('• UUID of the file {:s}: {:s}'.format(frames_csv_name, frames_file__uuid))
 
-		# 2.c.1 save semi_processed csv file for later (can be used to link predictions for episodes back to frames)
-		#   - add client to semi processed csv
-		#   - add frames file uid to semi processed csv
-		dataframe[EpisodeProperties.associated_client__mac.value] = the_client
-		dataframe[EpisodeProperties.frames_file__uuid.value] = frames_file__uuid
-		# write to file
-		output_csvname = frames_file__uuid + '.csv'
-		output_csvfile = os.path.join(directories.semi_processed_frames_csv_files, output_csvname)
-		dataframe.to_csv(output_csvfile, sep = ',', mode = 'a', index = False, header = True,
-		                 columns = semi_processed_output_column_order)
-		# drop unnecessary columns
-		dataframe.drop(columns = [EpisodeProperties.associated_client__mac.value,
-		                          EpisodeProperties.frames_file__uuid.value], inplace = True)
-
-		# 2.d. for each episode...
-		for episode_idx in ep_indexes:
-			# 2.d.1. get all frames belonging to the episode
-			_episode_df = dataframe[
-				(dataframe[EpisodeProperties.episode__id.value] == episode_idx)
-			]
-			# 2.d.2. sort the dataframe by `frame.time_epoch`
-			_episode_df.sort_values(
-				by = 'frame.time_epoch',
-				axis = 0,
-				ascending = True,
-				inplace = True,
-				na_position = 'last'
-			)
-
-			# 2.d.3. compute episode characteristics
-			ep_features, ep_properties = compute_episode_characteristics(_episode_df, the_client, episode_idx,
-			                                                             frames_file__uuid)
-
-			# 2.d.4. append to output
-			ep_characteristics_list.append((ep_features, ep_properties))
-
-	# 3. make a dataframe from episode characteristics
-	ep_characteristics_df = convert_ep_characteristics_to_dataframe(ep_characteristics_list)
-	print('• Total episodes generated: {:d}'.format(len(ep_characteristics_df)))
-	# 3.a. drop null values, since ML model can't make any sense of this
-	ep_characteristics_df.dropna(axis = 0, inplace = True)
-	print('• Total episodes generated (after dropping null values): {:d}'.format(len(ep_characteristics_df)))
+	if clients is None:
+		clients = find_all_client_mac_addresses(main_dataframe)
 
-	# 4. (optional) assign tags for causes according to old rule-based-system
-	if assign_rbs_tags:
-		ep_characteristics_df = assign_rule_based_system_tags_to_episodes(ep_characteristics_df)
-
-	# 5. generate a csv file as an output
-	if separate_client_files:
-		for the_client in clients:
-			_df = ep_characteristics_df[
-				(ep_characteristics_df[EpisodeProperties.associated_client__mac.value] == the_client)
-			]
-			name, extension = os.path.splitext(os.path.basename(frames_csv_file))
-			output_csvname = str.format('{:s}_{:s}{:s}', name, the_client, extension)
-			output_csvfile = os.path.join(directories.processed_episode_csv_files, output_csvname)
-			_df.to_csv(output_csvfile, sep = ',', index = False, header = True, columns = processed_output_column_order)
-	else:
-		output_csvname = os.path.basename(frames_csv_file)
-		output_csvfile = os.path.join(directories.processed_episode_csv_files, output_csvname)
-		ep_characteristics_df.to_csv(output_csvfile, sep = ',', index = False, header = True,
-		                             columns = processed_output_column_order)
+	completed_units = journal.get_completed_units(frames_csv_name)
+	if len(completed_units) > 0:
+		print('• Resuming the file {:s}: {:d} of {:d} clients already processed'.format(
+			frames_csv_name, len([c for c in clients if c in completed_units]), len(clients)))
+
+	# staged outputs of the clients
+	staging_dir = os.path.join(directories.temporary, 'staging', frames_file__uuid)
+	os.makedirs(staging_dir, exist_ok = True)
+
+	def __staged_files(the_client):
+		name = the_client.replace(':', '')
+		return os.path.join(staging_dir, name + '.semi.csv'), os.path.join(staging_dir, name + '.episodes.pkl')
+
+	# output column orders
+	semi_processed_output_column_order = get_semi_processed_output_column_order(main_dataframe.columns.values.tolist())
+	processed_output_column_order = get_processed_output_column_order(assign_rbs_tags)
+
+	feature_names = get_features_to_compute(required_features, assign_rbs_tags)
+	if feature_names is not None:
+		print('• Computing {:d} of {:d} features:'.format(len(feature_names), len(episode_features.get_feature_names())),
+		      feature_names)
+
+	# ### Processing ###
+	pending_clients = [the_client for the_client in clients if the_client not in completed_units]
+	if len(pending_clients) > 0:
+		# 1. keep only relevant frames in memory (for all the clients, the frames of a client must not change)
+		with instrumentation.measure('relevance_filter') as measurement:
+			main_dataframe = filter_out_irrelevant_frames(main_dataframe, clients, access_points)
+			measurement.rows = len(main_dataframe)
+		print('• Dataframe shape (relevance filter):', main_dataframe.shape)
+
+		# 1.a. (optional) index of the access point each client is associated with, once for the file
+		association_index = None
+		if serving_ap_beacons_only:
+			with instrumentation.measure('association_index') as measurement:
+				association_index = AssociationIndex(main_dataframe, clients)
+				measurement.rows = len(main_dataframe)
+
+		# 2. for each unfinished client, stage the outputs then record the client as completed
+		for the_client in pending_clients:
+			instrumentation.set_context(frames_file = frames_csv_name, client = the_client)
+			dataframe, client_ep_characteristics_df = process_client_frames(
+				main_dataframe, the_client, frames_file__uuid, association_index = association_index,
+				feature_names = feature_names, shard_duration = shard_duration, shard_workers = shard_workers)
+
+			n_episodes = 0
+			if dataframe is not None:
+				semi_processed_file, episodes_file = __staged_files(the_client)
+				with instrumentation.measure('staging_write') as measurement:
+					with atomic_output_file(semi_processed_file) as temporary_file:
+						dataframe.to_csv(temporary_file, sep = ',', index = False, header = True,
+						                 columns = semi_processed_output_column_order)
+					with atomic_output_file(episodes_file) as temporary_file:
+						client_ep_characteristics_df.to_pickle(temporary_file)
+					measurement.rows = len(dataframe)
+				n_episodes = len(client_ep_characteristics_df)
+			journal.complete_unit(frames_csv_name, the_client, n_episodes)
+			completed_units[the_client] = n_episodes
+
+	instrumentation.set_context(frames_file = frames_csv_name)
+	clients_with_episodes = [the_client for the_client in clients if completed_units[the_client] > 0]
+
+	# 3. make a dataframe from the staged episode characteristics
+	ep_characteristics_list = [pd.read_pickle(__staged_files(the_client)[1]) for the_client in clients_with_episodes]
+	ep_characteristics_df = finalize_episodes_dataframe(ep_characteristics_list, assign_rbs_tags)
+
+	# 3.a. (optional) index the episodes (indexing them again is harmless)
+	if episode_index is not None:
+		with instrumentation.measure('episodes_index') as measurement:
+			measurement.rows = episode_index.add_episodes(ep_characteristics_df, source = frames_csv_name)
+
+	# 4. move the outputs in place
+	for output_csvname, _df in get_processed_outputs(ep_characteristics_df, frames_csv_name, clients,
+	                                                 separate_client_files):
+		output_csvfile = os.path.join(processed_dir, output_csvname)
+		with instrumentation.measure('episodes_write') as measurement:
+			with atomic_output_file(output_csvfile) as temporary_file:
+				_df.to_csv(temporary_file, sep = ',', index = False, header = True,
+				           columns = processed_output_column_order,
+				           compression = compression.get_to_csv_compression(output_csvfile))
+			measurement.rows = len(_df)
+
+	if len(clients_with_episodes) > 0:
+		with instrumentation.measure('semi_processed_write'):
+			output_csvname = frames_file__uuid + compression.split_extension(frames_csv_name)[1]
+			output_csvfile = os.path.join(semi_processed_dir, output_csvname)
+			with atomic_output_file(output_csvfile) as temporary_file:
+				with compression.open_output_stream(temporary_file, compression.get_compression(output_csvfile)) as output:
+					# the staged frames of each client start with the header
+					for the_client in clients_with_episodes:
+						with open(__staged_files(the_client)[0], 'rb') as part:
+							shutil.copyfileobj(part, output)
+
+	# 5. update mapping file (once per file: a resumed file may already be in the mapping file)
+	mapping_df, mapping_columns = get_mapping_dataframe(timestamp, frames_csv_name, frames_file__uuid)
+	mapped = os.path.exists(mapping_file) and frames_file__uuid in pd.read_csv(
+		mapping_file, usecols = [MappingParameters.frames_file__uuid.value, ],
+		dtype = str)[MappingParameters.frames_file__uuid.value].values
+	if not mapped:
+		with instrumentation.measure('mapping_write') as measurement:
+			with atomic_output_file(mapping_file) as temporary_file:
+				if os.path.exists(mapping_file):
+					shutil.copyfile(mapping_file, temporary_file)
+				append_to_csv_file(mapping_df, temporary_file, mapping_columns,
+				                   header = not os.path.exists(mapping_file))
+			measurement.rows = len(mapping_df)
+
+	journal.complete_file(frames_csv_name)
+	shutil.rmtree(staging_dir, ignore_errors = True)
 
 
 def process_frame_csv_files(frames_csv_file_names: list, access_points, clients, assign_rbs_tags,
-                            separate_client_files, mapping_file):
+                            separate_client_files, mapping_file, quarantine_file = None, required_features = None,
+                            serving_ap_beacons_only = False, pipelined = False, max_pending_writes = 8,
+                            journal: RunJournal = None, shard_duration = None, shard_workers = None,
+                            read_workers = None, episode_index = None):
 	"""
 	Run `process_frame_csv_file` for multiple files sequentially.
 
+	:param journal: journal of the run, to process the files with `process_frame_csv_file_resumable` (the files
+	                completed in the journal are skipped); when pipelined, only the reads are in the background
+	:param shard_duration: process the frames of each client in time windows of this duration (seconds) in
+	                       parallel (None = in one piece), see `episode_shards`
+	:param shard_workers: number of processes for the shards (None = number of cpus)
+	:param read_workers: parse each frames csv file in parallel byte ranges with this number of processes
+	                     (None = single process), see `parallel_csv`
+	:param episode_index: `episode_index.EpisodeIndex` to add the episodes to (None = not indexed)
+	:param pipelined: overlap i/o and computation: the next frames csv file is read in a background thread
+	                  while the current one is processed, and the outputs are written by a background writer
+	:param max_pending_writes: maximum number of queued outputs when pipelined (the processing waits for the
+	                           writer beyond that)
+	:param serving_ap_beacons_only: keep only the beacons of the access point each client is associated with
+	:param required_features: names of the features to compute (None = all features)
+	:param quarantine_file: csv file shared by all the files of the run for frames with unparseable values
 	:param mapping_file:
 	:param frames_csv_file_names:
 	:param access_points:
@@ -966,22 +1213,159 @@ def process_frame_csv_files(frames_csv_file_names: list, access_points, clients,
 	:return:
 	"""
 
-	for idx, frames_csv_name in enumerate(frames_csv_file_names):
-		print('Started processing file: {:s}'.format(frames_csv_name))
-		process_frame_csv_file(frames_csv_name, access_points = access_points, clients = clients,
-		                       assign_rbs_tags = assign_rbs_tags, separate_client_files = separate_client_files,
-		                       mapping_file = mapping_file)
-		print('-' * 40)
-		print()
+	if journal is not None:
+		for frames_csv_name in frames_csv_file_names:
+			if journal.is_file_completed(frames_csv_name):
+				print('Skipping completed file: {:s}'.format(frames_csv_name))
+		frames_csv_file_names = [frames_csv_name for frames_csv_name in frames_csv_file_names
+		                         if not journal.is_file_completed(frames_csv_name)]
+
+	# the frames of the files started by an interrupted run are already quarantined
+	started_files = set() if journal is None else journal.get_started_files()
+
+	def __read_frames_csv_files():
+		for frames_csv_name in frames_csv_file_names:
+			instrumentation.set_context(frames_file = frames_csv_name)
+			yield frames_csv_name, read_frames_csv_file(
+				os.path.join(directories.frames_csv_files, frames_csv_name),
+				quarantine_file = None if frames_csv_name in started_files else quarantine_file,
+				read_workers = read_workers)
+
+	if journal is not None:
+		if pipelined:
+			frames_csv_files = prefetch(__read_frames_csv_files(), depth = 1)
+		else:
+			frames_csv_files = ((frames_csv_name, None) for frames_csv_name in frames_csv_file_names)
+		for frames_csv_name, main_dataframe in frames_csv_files:
+			print('Started processing file: {:s}'.format(frames_csv_name))
+			process_frame_csv_file_resumable(frames_csv_name, access_points = access_points, clients = clients,
+			                                 assign_rbs_tags = assign_rbs_tags,
+			                                 separate_client_files = separate_client_files,
+			                                 mapping_file = mapping_file, journal = journal,
+			                                 quarantine_file = quarantine_file, required_features = required_features,
+			                                 serving_ap_beacons_only = serving_ap_beacons_only,
+			                                 main_dataframe = main_dataframe, shard_duration = shard_duration,
+			                                 shard_workers = shard_workers, read_workers = read_workers,
+			                                 episode_index = episode_index)
+			print('-' * 40)
+			print()
+		return
+
+	if not pipelined:
+		for idx, frames_csv_name in enumerate(frames_csv_file_names):
+			print('Started processing file: {:s}'.format(frames_csv_name))
+			process_frame_csv_file(frames_csv_name, access_points = access_points, clients = clients,
+			                       assign_rbs_tags = assign_rbs_tags, separate_client_files = separate_client_files,
+			                       mapping_file = mapping_file, quarantine_file = quarantine_file,
+			                       required_features = required_features,
+			                       serving_ap_beacons_only = serving_ap_beacons_only,
+			                       shard_duration = shard_duration, shard_workers = shard_workers,
+			                       read_workers = read_workers, episode_index = episode_index)
+			print('-' * 40)
+			print()
+		return
+
+	with AsyncWriter(max_pending = max_pending_writes) as writer:
+		for frames_csv_name, main_dataframe in prefetch(__read_frames_csv_files(), depth = 1):
+			print('Started processing file: {:s}'.format(frames_csv_name))
+			process_frame_csv_file(frames_csv_name, access_points = access_points, clients = clients,
+			                       assign_rbs_tags = assign_rbs_tags, separate_client_files = separate_client_files,
+			                       mapping_file = mapping_file, quarantine_file = quarantine_file,
+			                       required_features = required_features,
+			                       serving_ap_beacons_only = serving_ap_beacons_only, main_dataframe = main_dataframe,
+			                       writer = writer, shard_duration = shard_duration, shard_workers = shard_workers,
+			                       episode_index = episode_index)
+			print('-' * 40)
+			print()
 
 
 def main(access_points = None, clients = None, assign_rbs_tags = True, separate_client_files = False,
-         mapping_file = directories.conversion_mapping_file):
-	prepare_environment()
+         mapping_file = directories.conversion_mapping_file, quarantine_file = None,
+         instrumentation_report_file = None, memory_timeline_file = None, required_features_file = None,
+         serving_ap_beacons_only = False, pipelined = False, journal_file = None, shard_duration = None,
+         shard_workers = None, read_workers = None, episode_index_file = None):
+	"""
+	:param episode_index_file: SQLite index the episodes are added to, to look them up by client, time range and
+	                           cause (None = disabled), see `episode_index`
+	:param read_workers: parse each frames csv file in parallel byte ranges with this number of processes, for
+	                     multi-GB files (None = single process), see `parallel_csv`
+	:param shard_duration: process the frames of each client in time windows of this duration (seconds, e.g. 3600
+	                       for multi-day captures) in parallel (None = in one piece), see `episode_shards`
+	:param shard_workers: number of processes for the shards (None = number of cpus)
+	:param journal_file: SQLite journal of the run (None = disabled): the outputs are written atomically and an
+	                     interrupted run is resumed by running again with the same journal file and parameters,
+	                     see `run_journal`
+	:param instrumentation_report_file: `.json` or `.csv` file for the stage timings of the run (None = disabled)
+	:param memory_timeline_file: `.json` or `.csv` file for the memory timeline of the run (None = disabled)
+	:param required_features_file: file with the names of the features used by the deployed models, only these
+	                               are computed (None = all features), see `episode_features.read_required_features_file`
+	:param serving_ap_beacons_only: keep only the beacons of the access point each client is associated with
+	                                (changes the beacon features, the models should be trained the same way)
+	:param pipelined: read the next frames csv file and write the outputs in background threads
+	"""
+
+	journal = None
+	if journal_file is not None:
+		os.makedirs(os.path.dirname(os.path.abspath(journal_file)), exist_ok = True)
+		journal = RunJournal(journal_file)
+		# a resumed run must have the same parameters
+		journal.check_settings({
+			'access_points': access_points,
+			'clients': clients,
+			'assign_rbs_tags': assign_rbs_tags,
+			'separate_client_files': separate_client_files,
+			'mapping_file': mapping_file,
+			'required_features_file': required_features_file,
+			'serving_ap_beacons_only': serving_ap_beacons_only,
+		})
+
+	prepare_environment(resume = journal is not None and not journal.is_empty())
+
+	if instrumentation_report_file is not None or memory_timeline_file is not None:
+		instrumentation.reset()
+		instrumentation.enable(memory_profiling = memory_timeline_file is not None)
+
+	# one quarantine file per run
+	if quarantine_file is None:
+		quarantine_csvname = 'quarantine_' + datetime.datetime.now().strftime('%d%m%Y%H%M%S') + '.csv'
+		quarantine_file = os.path.join(directories.temporary, quarantine_csvname)
+	if journal is not None:
+		# the quarantine file of the interrupted run
+		quarantine_file = journal.get_setting('quarantine_file', quarantine_file)
+
+	required_features = None
+	if required_features_file is not None:
+		required_features = episode_features.read_required_features_file(required_features_file)
+
+	# the process pool of the shards and the parallel reads, started before the threads of the pipelined run
+	if shard_duration is not None:
+		get_process_pool(shard_workers)
+	elif read_workers is not None and read_workers > 1:
+		get_process_pool(read_workers)
+
+	episode_index = None
+	if episode_index_file is not None:
+		from preprocessor.episode_index import EpisodeIndex
+		episode_index = EpisodeIndex(episode_index_file)
+
 	frames_csv_file_names = get_frames_csv_file_names()
 	process_frame_csv_files(frames_csv_file_names, access_points = access_points, clients = clients,
 	                        assign_rbs_tags = assign_rbs_tags, separate_client_files = separate_client_files,
-	                        mapping_file = mapping_file)
+	                        mapping_file = mapping_file, quarantine_file = quarantine_file,
+	                        required_features = required_features, serving_ap_beacons_only = serving_ap_beacons_only,
+	                        pipelined = pipelined, journal = journal, shard_duration = shard_duration,
+	                        shard_workers = shard_workers, read_workers = read_workers, episode_index = episode_index)
+	if journal is not None:
+		journal.close()
+	if episode_index is not None:
+		episode_index.close()
+	shutdown_process_pool()
+
+	if memory_timeline_file is not None:
+		instrumentation.write_memory_timeline(memory_timeline_file)
+	if instrumentation_report_file is not None:
+		instrumentation.write_report(instrumentation_report_file)
+	instrumentation.disable()
 
 
 if __name__ == '__main__':
@@ -998,7 +1382,21 @@ if __name__ == '__main__':
 
 	]
 
+	# features used by the deployed models (see `machine_learning/required_features.py`)
+	_required_features_file = None
+
+	# journal to resume the run if it is interrupted, e.g. os.path.join(directories.temporary, 'run_journal.sqlite')
+	# (the frames csv files completed in the journal are skipped: remove it to start a new run)
+	_journal_file = None
+
+	# index of the episodes, e.g. directories.episode_index_file (see `episode_index`)
+	_episode_index_file = None
+
 	#   - clients = None, to process all clients
 	#   - access points = None, to use all beacon frames
+	#   - required features file = None, to compute all features
+	#   - journal file = None, to process all the frames csv files (not resumable)
+	#   - episode index file = None, to not index the episodes
 	main(clients = _clients, access_points = _access_points, assign_rbs_tags = False, separate_client_files = False,
-	     mapping_file = directories.conversion_mapping_file)
+	     mapping_file = directories.conversion_mapping_file, required_features_file = _required_features_file,
+	     journal_file = _journal_file, episode_index_file = _episode_index_file)
@@ -1,7 +1,7 @@
 import os
 import subprocess
 
-from preprocessor import directories
+from preprocessor import compression, directories
 
 
 def prepare_environment():
@@ -106,34 +106,54 @@ def get_capture_file_names():
 
 
 def generate_output_csv_files(capture_file_names: list, command_format_string: str, csv_file_header: str,
-                              use_subprocesses: bool = False):
+                              use_subprocesses: bool = False, max_subprocesses: int = None,
+                              capture_files_dir = directories.capture_files,
+                              frames_csv_files_dir = directories.frames_csv_files, frames_csv_extension = '.csv'):
 	"""
 	Run the command for each file name present in `capture_file_names` list
+
+	:param frames_csv_extension: extension of the frames csv files, '.csv.gz' or '.csv.zst' to compress them
+	                             (the output of tshark is compressed as it is written, see `compression`)
+	:param use_subprocesses: run the commands in parallel
+	:param max_subprocesses: maximum number of commands running at the same time (None = no limit)
 	"""
 
 	subprocesses = list()
+	exit_codes = list()
 	for idx, capture_name in enumerate(capture_file_names):
 		# base_name = capture_name without extension
 		base_name = os.path.splitext(capture_name)[0]
-		# csv_name = base_name + '.csv'
-		csv_name = base_name + '.csv'
+		# csv_name = base_name + '.csv' (or a compressed csv extension)
+		csv_name = base_name + frames_csv_extension
 
 		# capture file
-		capture_file = os.path.join(directories.capture_files, capture_name)
+		capture_file = os.path.join(capture_files_dir, capture_name)
 		# csv file
-		csv_file = os.path.join(directories.frames_csv_files, csv_name)
+		csv_file = os.path.join(frames_csv_files_dir, csv_name)
 
 		# print progress
 		print('starting sub-process for file: {:s}...'.format(capture_name))
 
-		# create csv file and add header as the first line
-		with open(csv_file, 'w') as file:
-			file.write(csv_file_header)
-			file.close()
+		# create csv file and add header as the first line (compressed by the same command as the data)
+		compression_command = compression.get_compression_command(csv_file)
+		with open(csv_file, 'wb') as file:
+			if compression_command is None:
+				file.write(csv_file_header.encode())
+			else:
+				subprocess.run(compression_command, shell = True, input = csv_file_header.encode(), stdout = file,
+				               check = True)
+
+		# wait for the oldest sub-process if too many are running
+		if use_subprocesses and max_subprocesses is not None and len(subprocesses) >= max_subprocesses:
+			exit_codes.append(subprocesses.pop(0).wait())
 
 		# run command to append data to the csv file
 		#   - this can be run in parallel
 		command = command_format_string.format(str(capture_file), str(csv_file))
+		#   - compress the output of tshark, appended after the header as a new gzip member / zstandard frame
+		if compression_command is not None:
+			tshark_command, redirection = command.rsplit('>>', 1)
+			command = '{:s}| {:s} >>{:s}'.format(tshark_command, compression_command, redirection)
 		p = subprocess.Popen(command, shell = True)
 
 		if use_subprocesses:
@@ -143,16 +163,21 @@ def generate_output_csv_files(capture_file_names: list, command_format_string: s
 			print('Process pid {:d}, exit-code: {:d}:'.format(pid, exit_code))
 
 	if use_subprocesses:
-		exit_codes = [q.wait() for q in subprocesses]
+		exit_codes.extend([q.wait() for q in subprocesses])
 		print('Exit codes for sub-processes: ', exit_codes)
 
 
-def main():
+def main(frames_csv_extension = '.csv'):
+	"""
+	:param frames_csv_extension: '.csv', or '.csv.gz' / '.csv.zst' for compressed frames csv files
+	"""
+
 	prepare_environment()
 	command_format_string = prepare_and_get_command_format_string()
 	csv_file_header = prepare_and_get_csv_header(command_format_string)
 	capture_file_names = get_capture_file_names()
-	generate_output_csv_files(capture_file_names, command_format_string, csv_file_header)
+	generate_output_csv_files(capture_file_names, command_format_string, csv_file_header,
+	                          frames_csv_extension = frames_csv_extension)
 
 
 if __name__ == '__main__':
@@ -14,6 +14,7 @@ __FRAMES_CSV_FILES_DIRNAME = 'frames_csv_files'
 __SEMI_PROCESSED_FRAMES_CSV_FILES_DIRNAME = 'semi_processed_frames_csv_files'
 __PROCESSED_EPISODE_CSV_FILES_DIRNAME = 'processed_episode_csv_files'
 __TEMPORARY_FILES_DIRNAME = 'temporary'
+__BENCHMARKS_DIRNAME = 'benchmarks'
 
 # references to the directories
 project = os.path.abspath(__PROJECT_DIR)
@@ -23,8 +24,11 @@ frames_csv_files = os.path.join(__PROJECT_DIR, __FRAMES_CSV_FILES_DIRNAME)
 semi_processed_frames_csv_files = os.path.join(__PROJECT_DIR, __SEMI_PROCESSED_FRAMES_CSV_FILES_DIRNAME)
 processed_episode_csv_files = os.path.join(__PROJECT_DIR, __PROCESSED_EPISODE_CSV_FILES_DIRNAME)
 temporary = os.path.join(__PROJECT_DIR, __TEMPORARY_FILES_DIRNAME)
+benchmarks = os.path.join(__PROJECT_DIR, __BENCHMARKS_DIRNAME)
 
 # misc
 capture_files_extensions = ['.cap', '.pcap', '.pcapng', ]
-csv_files_extensions = ['.csv', ]
+csv_files_extensions = ['.csv', '.csv.gz', '.csv.zst', ]
 conversion_mapping_file = os.path.join(__PROJECT_DIR, 'conversion_mapping.csv')
+episode_index_file = os.path.join(__PROJECT_DIR, 'episode_index.sqlite')
+episode_engine_baseline_file = os.path.join(benchmarks, 'episode_engine_baseline.json')
@@ -0,0 +1,404 @@
+"""
+Registry of the episode features computed by `convert_frames_to_episodes`.
+
+Each feature declares the per-frame masks (frame classes, direction relative to the client, flags) and the
+columns it needs, and gives its aggregation over the frames of each episode. The episode engine evaluates
+all the registered features together on the frames of a client: every mask is computed once per client
+(`EpisodeFrames`) and shared by all the features that declare it.
+
+Adding a feature:
+	register_frame_mask('probe_response', lambda frames: frames.column('wlan.fc.type_subtype') == 5)
+	register_feature('probe_response__count', lambda frames: frames.count('probe_response'),
+	                 masks = ['probe_response', ])
+
+The output column order of the processed episode csv files and the header helpers of the machine learning
+scripts are derived from the registry (`get_feature_names`).
+
+Only a subset of the features can be computed (e.g. the features used by the deployed models, see
+`read_required_features_file`); only the masks declared by those features are computed and the other
+features are set to `feature_placeholder`. The features that can be null (`nullable`, e.g. the rssi of an episode
+without frames from the client) are always computed: the episodes with null features are dropped, so the same
+episodes are kept whatever the required features.
+"""
+
+import collections
+import json
+import os
+
+import numpy as np
+
+# name -> function(frames: EpisodeFrames) -> boolean array (one value per frame)
+__frame_masks = dict()
+# name -> EpisodeFeature
+__features = dict()
+
+EpisodeFeature = collections.namedtuple('EpisodeFeature', ['name', 'aggregate', 'masks', 'columns', 'nullable', ])
+
+# value of the features that are not computed (not required)
+feature_placeholder = -1
+
+# 802.11 frame subtypes (`wlan.fc.type_subtype`) that are only allowed in state 3 (authenticated and associated)
+class_3_frames_list = [
+	32,  # type 2 (data), data
+	33,  # type 2 (data), data + cf_ack
+	34,  # type 2 (data), data + cf_poll
+	35,  # type 2 (data), data + cf_ack + cf_poll
+	36,  # type 2 (data), null
+	37,  # type 2 (data), cf_ack
+	38,  # type 2 (data), cf_poll
+	39,  # type 2 (data), cf_ack + cf_poll
+	40,  # type 2 (data), QoS data
+	41,  # type 2 (data), QoS data + cf_ack
+	42,  # type 2 (data), QoS data + cf_poll
+	43,  # type 2 (data), QoS data + cf_ack + cf_poll
+	44,  # type 2 (data), QoS null
+	46,  # type 2 (data), QoS + cf_poll (no data)
+	47,  # type 2 (data), Qos + cf_ack (no data)
+	26,  # type 1 (control), ps_poll
+	24,  # type 1 (control), block ack request
+	25,  # type 1 (control), block ack
+	13,  # type 0 (management), action
+	14  # type 0 (management), reserved
+]
+
+
+class EpisodeFrames:
+	"""
+	Frames of a client grouped by episode (frames sorted by `frame.time_epoch`).
+	Columns and frame masks are computed on first use and cached, so they are shared by all the features.
+	"""
+
+	def __init__(self, dataframe, the_client: str, episode_ids):
+		self.dataframe = dataframe
+		self.the_client = the_client
+		# `codes` maps every frame to the position of its episode in `episode_ids`
+		self.episode_ids, self.codes = np.unique(np.asarray(episode_ids), return_inverse = True)
+		self.n_episodes = len(self.episode_ids)
+		self.__columns = dict()
+		self.__masks = dict()
+		self.__epochs = None
+
+	def column(self, name: str):
+		"""
+		Values of a column of the frames as a numpy array.
+		"""
+
+		if name not in self.__columns:
+			self.__columns[name] = self.dataframe[name].values
+		return self.__columns[name]
+
+	def mask(self, name: str):
+		"""
+		Boolean array of a registered frame mask.
+		"""
+
+		if name not in self.__masks:
+			self.__masks[name] = np.asarray(get_frame_mask_function(name)(self), dtype = bool)
+		return self.__masks[name]
+
+	def count(self, *mask_names):
+		"""
+		Number of frames of each episode matching all the given masks.
+		"""
+
+		selection = self.__combine(mask_names)
+		return np.bincount(self.codes[selection], minlength = self.n_episodes)
+
+	def sum(self, column: str, *mask_names):
+		"""
+		Sum of a column over the frames of each episode matching all the given masks.
+		"""
+
+		selection = self.__combine(mask_names)
+		return np.bincount(self.codes[selection], weights = self.column(column)[selection].astype(float),
+		                   minlength = self.n_episodes)
+
+	def mean_and_std(self, column: str, *mask_names):
+		"""
+		Mean and (sample) standard deviation of a column over the frames of each episode matching all the masks.
+		NaN where not enough frames are available (same as pandas).
+		"""
+
+		selection = self.__combine(mask_names)
+		codes = self.codes[selection]
+		values = self.column(column)[selection].astype(float)
+
+		count = np.bincount(codes, minlength = self.n_episodes)
+		with np.errstate(invalid = 'ignore', divide = 'ignore'):
+			mean = np.bincount(codes, weights = values, minlength = self.n_episodes) / count
+			deviations = values - mean[codes]
+			variance = np.bincount(codes, weights = deviations * deviations, minlength = self.n_episodes) / (count - 1)
+		mean[count == 0] = np.nan
+		variance[count < 2] = np.nan
+		return mean, np.sqrt(variance)
+
+	def start_and_end_epochs(self):
+		"""
+		Epochs of the first and the last frame of each episode.
+		"""
+
+		if self.__epochs is None:
+			epochs = self.column('frame.time_epoch').astype(float)
+			start = np.full(self.n_episodes, np.inf)
+			end = np.full(self.n_episodes, -np.inf)
+			np.minimum.at(start, self.codes, epochs)
+			np.maximum.at(end, self.codes, epochs)
+			self.__epochs = start, end
+		return self.__epochs
+
+	def duration(self):
+		start, end = self.start_and_end_epochs()
+		return end - start
+
+	def __combine(self, mask_names):
+		selection = np.ones(len(self.codes), dtype = bool)
+		for name in mask_names:
+			selection &= self.mask(name)
+		return selection
+
+
+def register_frame_mask(name: str, function, replace: bool = False):
+	"""
+	Registers a per-frame mask.
+
+	:param name: name of the mask
+	:param function: function(frames: EpisodeFrames) -> boolean array (one value per frame)
+	:param replace: replace the mask if a mask with the same name is already registered
+	"""
+
+	if name in __frame_masks and not replace:
+		raise ValueError('Frame mask "{:s}" is already registered'.format(name))
+	__frame_masks[name] = function
+
+
+def get_frame_mask_function(name: str):
+	if name not in __frame_masks:
+		raise KeyError('Frame mask "{:s}" is not registered'.format(name))
+	return __frame_masks[name]
+
+
+def register_feature(name: str, aggregate, masks: list = (), columns: list = (), nullable: bool = False,
+                     replace: bool = False):
+	"""
+	Registers an episode feature.
+
+	:param name: name of the feature (column name in the processed episode csv files)
+	:param aggregate: function(frames: EpisodeFrames) -> array with one value per episode
+	:param masks: frame masks used by the feature (computed once per client, shared between features)
+	:param columns: frame columns used by the feature
+	:param nullable: the feature can be null (NaN) for some episodes, which are then dropped
+	:param replace: replace the feature if a feature with the same name is already registered
+	"""
+
+	if name in __features and not replace:
+		raise ValueError('Feature "{:s}" is already registered'.format(name))
+	for mask_name in masks:
+		get_frame_mask_function(mask_name)
+	__features[name] = EpisodeFeature(name, aggregate, tuple(masks), tuple(columns), nullable)
+
+
+def get_feature_names():
+	"""
+	Returns the names of all the registered features (sorted, same as the output column order).
+	"""
+
+	names = list(__features.keys())
+	names.sort()
+	return names
+
+
+def get_features(names: list = None):
+	"""
+	Returns the registered features (sorted by name). `None` = all features.
+	"""
+
+	if names is None:
+		names = get_feature_names()
+	for name in names:
+		if name not in __features:
+			raise KeyError('Feature "{:s}" is not registered'.format(name))
+	return [__features[name] for name in sorted(names)]
+
+
+def get_nullable_feature_names():
+	"""
+	Returns the names of the features that can be null (sorted), see `register_feature`.
+	"""
+
+	return [name for name in get_feature_names() if __features[name].nullable]
+
+
+def read_required_features_file(filepath):
+	"""
+	Reads the names of the required features from a file.
+	Either a `.json` file (a list of names or a dictionary with a `features` list) or a text file with one
+	name per line (`#` for comments).
+	"""
+
+	if os.path.splitext(filepath)[1] == '.json':
+		with open(filepath, 'r') as file:
+			content = json.load(file)
+		names = content['features'] if isinstance(content, dict) else content
+	else:
+		with open(filepath, 'r') as file:
+			names = [line.split('#')[0].strip() for line in file]
+		names = [name for name in names if len(name) > 0]
+
+	# make sure all the features are registered
+	return [feature.name for feature in get_features(names)]
+
+
+def write_required_features_file(names: list, filepath, **extra):
+	"""
+	Writes the names of the required features to a `.json` file (`extra` values are stored along).
+	"""
+
+	content = dict(extra)
+	content['features'] = [feature.name for feature in get_features(names)]
+	with open(filepath, 'w') as file:
+		json.dump(content, file, indent = 2)
+	print('• Required features saved at {:s}'.format(filepath))
+
+
+def get_required_frame_masks(features: list):
+	"""
+	Returns the names of the frame masks declared by the given features (without duplicates, in order).
+	"""
+
+	mask_names = list()
+	for feature in features:
+		for mask_name in feature.masks:
+			if mask_name not in mask_names:
+				mask_names.append(mask_name)
+	return mask_names
+
+
+def get_required_columns(features: list):
+	columns = list()
+	for feature in features:
+		for column in feature.columns:
+			if column not in columns:
+				columns.append(column)
+	return columns
+
+
+# #############################################################################
+# frame masks
+
+# frame classes
+register_frame_mask('beacon', lambda frames: frames.column('wlan.fc.type_subtype') == 8)
+register_frame_mask('deauth', lambda frames: frames.column('wlan.fc.type_subtype') == 12)
+register_frame_mask('ack', lambda frames: frames.column('wlan.fc.type_subtype') == 29)
+register_frame_mask('null', lambda frames: np.isin(frames.column('wlan.fc.type_subtype'), [36, 44, ]))
+register_frame_mask('assoc_response', lambda frames: np.isin(frames.column('wlan.fc.type_subtype'), [1, 3, ]))
+register_frame_mask('class_3', lambda frames: np.isin(frames.column('wlan.fc.type_subtype'), class_3_frames_list))
+
+# direction relative to the client
+register_frame_mask('from_client', lambda frames: frames.column('wlan.sa') == frames.the_client)
+register_frame_mask('to_client', lambda frames: frames.column('wlan.da') == frames.the_client)
+register_frame_mask('client_receiver', lambda frames: frames.column('wlan.ra') == frames.the_client)
+# either `source addr` or `transmitter addr` belongs to the client
+register_frame_mask('client_origin', lambda frames: frames.mask('from_client') |
+                                                    (frames.column('wlan.ta') == frames.the_client))
+
+# flags
+register_frame_mask('retry', lambda frames: frames.column('wlan.fc.retry') == 1)
+register_frame_mask('no_retry', lambda frames: frames.column('wlan.fc.retry') == 0)
+register_frame_mask('pwrmgt_off', lambda frames: frames.column('wlan.fc.pwrmgt') == 0)
+register_frame_mask('status_success', lambda frames: frames.column('wlan_mgt.fixed.status_code') == 0)
+# a missing status code counts as a failure
+register_frame_mask('status_failure', lambda frames: frames.column('wlan_mgt.fixed.status_code') != 0)
+
+
+# #############################################################################
+# features
+
+def __rssi_mean(frames: EpisodeFrames):
+	return frames.mean_and_std('radiotap.dbm_antsignal', 'client_origin')[0]
+
+
+def __rssi_sd(frames: EpisodeFrames):
+	return frames.mean_and_std('radiotap.dbm_antsignal', 'client_origin')[1]
+
+
+def __frame_loss_rate(frames: EpisodeFrames):
+	"""
+	#(fc.retry == 1) / #(fc.retry == 1 || fc.retry == 0) over the frames sent by the client, -1 if no frames
+	"""
+
+	_num_true = frames.count('client_origin', 'retry')
+	_num_false = frames.count('client_origin', 'no_retry')
+	_num_total = _num_true + _num_false
+
+	_loss_rate = np.full(frames.n_episodes, -1.0)
+	np.divide(_num_true, _num_total, out = _loss_rate, where = _num_total > 0)
+	return _loss_rate
+
+
+def __frame_frequency(frames: EpisodeFrames):
+	"""
+	Frames sent by the client per second of the episode.
+	0 if the client sent no frames, -1 if the episode has no duration.
+	"""
+
+	_num_frames = frames.count('client_origin')
+	_ep_duration = frames.duration()
+
+	_frequency = np.full(frames.n_episodes, -1.0)
+	np.divide(_num_frames, _ep_duration, out = _frequency, where = _ep_duration > 0)
+	_frequency[_num_frames == 0] = 0
+	return _frequency
+
+
+def __max_consecutive_beacons(frames: EpisodeFrames):
+	"""
+	Maximum number of consecutive beacon intervals > 105 milliseconds in the episode.
+	"""
+
+	beacon = frames.mask('beacon')
+	_epochs = frames.column('frame.time_epoch')[beacon].astype(float)
+	_codes = frames.codes[beacon]
+
+	# NOTE: the interval is `previous - current` (as in the original implementation), which is never
+	# positive for sorted frames, so the count is always 0 (kept for compatibility with the trained models)
+	_long_intervals = (_codes[1:] == _codes[:-1]) & ((_epochs[:-1] - _epochs[1:]) > 0.105)
+
+	_max_count = np.zeros(frames.n_episodes, dtype = int)
+	_positions = np.flatnonzero(_long_intervals)
+	if len(_positions) > 0:
+		# runs of consecutive long intervals
+		_run_starts = np.r_[True, np.diff(_positions) > 1]
+		_run_ids = np.cumsum(_run_starts) - 1
+		_run_lengths = np.bincount(_run_ids)
+		np.maximum.at(_max_count, _codes[_positions[_run_starts] + 1], _run_lengths)
+	return _max_count
+
+
+register_feature('rssi__mean', __rssi_mean, masks = ['client_origin', ], columns = ['radiotap.dbm_antsignal', ],
+                 nullable = True)
+register_feature('rssi__sd', __rssi_sd, masks = ['client_origin', ], columns = ['radiotap.dbm_antsignal', ],
+                 nullable = True)
+register_feature('frame__loss_rate', __frame_loss_rate, masks = ['client_origin', 'retry', 'no_retry', ],
+                 columns = ['wlan.fc.retry', ])
+register_feature('frame__frequency', __frame_frequency, masks = ['client_origin', ],
+                 columns = ['frame.time_epoch', ])
+# deauthentication frames sent to / by the client
+register_feature('ap_deauth__count', lambda frames: frames.count('deauth', 'to_client'),
+                 masks = ['deauth', 'to_client', ])
+register_feature('client_deauth__count', lambda frames: frames.count('deauth', 'from_client'),
+                 masks = ['deauth', 'from_client', ])
+register_feature('beacon__count', lambda frames: frames.count('beacon'), masks = ['beacon', ])
+register_feature('max_consecutive_beacons__count', __max_consecutive_beacons, masks = ['beacon', ],
+                 columns = ['frame.time_epoch', ])
+# acks received by the client
+register_feature('ack__count', lambda frames: frames.count('ack', 'client_receiver'),
+                 masks = ['ack', 'client_receiver', ])
+# null / qos null frames sent by the client with the power management bit = 0
+register_feature('null_dataframe__count', lambda frames: frames.count('null', 'from_client', 'pwrmgt_off'),
+                 masks = ['null', 'from_client', 'pwrmgt_off', ])
+# (re)association responses sent to the client
+register_feature('failure_assoc__count', lambda frames: frames.count('assoc_response', 'status_failure', 'to_client'),
+                 masks = ['assoc_response', 'status_failure', 'to_client', ])
+register_feature('success_assoc__count', lambda frames: frames.count('assoc_response', 'status_success', 'to_client'),
+                 masks = ['assoc_response', 'status_success', 'to_client', ])
+register_feature('class_3_frames__count', lambda frames: frames.count('class_3'), masks = ['class_3', ])
@@ -0,0 +1,201 @@
+"""
+Index of the episodes (SQLite), to look up the episodes of a client in a time range and their causes without
+reading the processed episode csv files and the prediction csv files.
+
+The index is filled incrementally:
+	- by the preprocessor (`convert_frames_to_episodes.main`, `frame_streams.main`): the episodes of each
+	  processed file (client, time range, frames file uuid, source file and rule based system tags)
+	- by `machine_learning.run_model.run`: the predicted causes of the episodes (per classifier stage)
+	- or from existing processed episode csv files (`index_processed_csv_file`)
+An episode is identified by (frames file uuid, client, episode id); indexing it again replaces it.
+
+Usage:
+	with EpisodeIndex(directories.episode_index_file) as index:
+		index.find_episodes(client = 'aa:bb:cc:dd:ee:ff', start = 1500000000, end = 1500003600)
+		index.count_causes(client = 'aa:bb:cc:dd:ee:ff', start = 1500000000, end = 1500003600, stage = 2)
+"""
+
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from preprocessor.convert_frames_to_episodes import EpisodeProperties
+
+rbs_tags_column = 'rbs__cause_tags'
+
+__EPISODE_COLUMNS = [
+	EpisodeProperties.frames_file__uuid.value,
+	EpisodeProperties.associated_client__mac.value,
+	EpisodeProperties.episode__id.value,
+	EpisodeProperties.start__time_epoch.value,
+	EpisodeProperties.end__time_epoch.value,
+]
+
+
+def get_episode_key_columns():
+	"""
+	Columns identifying an episode (in the processed episode csv files).
+	"""
+
+	return __EPISODE_COLUMNS[:3]
+
+
+def get_episode_columns():
+	return list(__EPISODE_COLUMNS)
+
+
+class EpisodeIndex:
+	"""
+	Episodes and their predicted causes, in a SQLite database (see the module).
+	"""
+
+	def __init__(self, filepath: str):
+		self.filepath = filepath
+		self.__connection = sqlite3.connect(filepath)
+		with self.__connection:
+			self.__connection.execute(
+				'CREATE TABLE IF NOT EXISTS episodes (frames_file__uuid TEXT NOT NULL, '
+				'associated_client__mac TEXT NOT NULL, episode__id INTEGER NOT NULL, start__time_epoch REAL NOT NULL, '
+				'end__time_epoch REAL NOT NULL, source TEXT, rbs__cause_tags TEXT, '
+				'PRIMARY KEY (frames_file__uuid, associated_client__mac, episode__id))')
+			self.__connection.execute(
+				'CREATE INDEX IF NOT EXISTS episodes_by_client ON episodes (associated_client__mac, start__time_epoch)')
+			self.__connection.execute(
+				'CREATE INDEX IF NOT EXISTS episodes_by_time ON episodes (start__time_epoch)')
+			self.__connection.execute(
+				'CREATE TABLE IF NOT EXISTS predictions (frames_file__uuid TEXT NOT NULL, '
+				'associated_client__mac TEXT NOT NULL, episode__id INTEGER NOT NULL, stage INTEGER NOT NULL, '
+				'prediction__label INTEGER NOT NULL, prediction__name TEXT, model_file TEXT, '
+				'PRIMARY KEY (frames_file__uuid, associated_client__mac, episode__id, stage))')
+			self.__connection.execute(
+				'CREATE INDEX IF NOT EXISTS predictions_by_cause ON predictions (prediction__name)')
+
+	def add_episodes(self, episodes_df: pd.DataFrame, source: str = None):
+		"""
+		Indexes the episodes of a processed episode dataframe (see `get_episode_columns`, and the rule based
+		system tags if they are assigned). Returns the number of indexed episodes.
+
+		:param source: name of the frames csv file (or site) of the episodes
+		"""
+
+		if len(episodes_df) == 0:
+			return 0
+
+		columns = [episodes_df[column].values for column in get_episode_columns()]
+		rbs_tags = episodes_df[rbs_tags_column].values if rbs_tags_column in episodes_df.columns \
+			else [None, ] * len(episodes_df)
+		rows = zip(columns[0].astype(str), columns[1].astype(str), columns[2].astype(int).tolist(),
+		           columns[3].astype(float).tolist(), columns[4].astype(float).tolist(), [source, ] * len(episodes_df),
+		           [None if pd.isna(tags) else str(tags) for tags in rbs_tags])
+		with self.__connection:
+			self.__connection.executemany(
+				'INSERT OR REPLACE INTO episodes (frames_file__uuid, associated_client__mac, episode__id, '
+				'start__time_epoch, end__time_epoch, source, rbs__cause_tags) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+		return len(episodes_df)
+
+	def add_predictions(self, keys_df: pd.DataFrame, labels, stage: int, names = None, model_file: str = None):
+		"""
+		Indexes the predicted causes of episodes. Returns the number of indexed predictions.
+
+		:param keys_df: the episodes (see `get_episode_key_columns`), in the order of the labels
+		:param labels: predicted labels
+		:param stage: classifier stage (1, 2, ...), or the stage of each prediction (e.g. the stages of
+		              `CascadeModel.predict_stages`)
+		:param names: names of the predicted causes (e.g. `ASCause` names), None = unknown
+		"""
+
+		if names is None:
+			names = [None, ] * len(keys_df)
+		stages = [stage, ] * len(keys_df) if np.ndim(stage) == 0 else stage
+		uuids, clients, episode_ids = [keys_df[column].values for column in get_episode_key_columns()]
+		rows = zip(uuids.astype(str), clients.astype(str), episode_ids.astype(int).tolist(),
+		           [int(stage) for stage in stages], [int(label) for label in labels],
+		           [None if name is None else str(name) for name in names], [model_file, ] * len(keys_df))
+		with self.__connection:
+			self.__connection.executemany(
+				'INSERT OR REPLACE INTO predictions (frames_file__uuid, associated_client__mac, episode__id, stage, '
+				'prediction__label, prediction__name, model_file) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+		return len(keys_df)
+
+	def index_processed_csv_file(self, filepath: str):
+		"""
+		Indexes the episodes of an existing processed episode csv file (compressed or not).
+		"""
+
+		columns = get_episode_columns() + [rbs_tags_column, ]
+		episodes_df = pd.read_csv(filepath, usecols = lambda column: column in columns,
+		                          dtype = {rbs_tags_column: str, })
+		return self.add_episodes(episodes_df, source = os.path.basename(filepath))
+
+	def find_episodes(self, client: str = None, start: float = None, end: float = None, cause: str = None,
+	                  stage: int = None, rbs_tag: str = None, frames_file__uuid: str = None):
+		"""
+		Returns the episodes matching all the given conditions as a dataframe (sorted by client and start time),
+		with their predicted causes (`prediction__label`, `prediction__name`, `stage`: one row per prediction,
+		None if the episode has no prediction).
+
+		:param client: mac address of the client
+		:param start: the episodes ending at or after this epoch
+		:param end: the episodes starting at or before this epoch
+		:param cause: name of the predicted cause (`prediction__name`)
+		:param stage: the predictions of this classifier stage only
+		:param rbs_tag: tag of the rule based system (`RBSCauses` value)
+		:param frames_file__uuid: the episodes of a frames file
+		"""
+
+		conditions = list()
+		parameters = list()
+		if client is not None:
+			conditions.append('e.associated_client__mac = ?')
+			parameters.append(client)
+		if start is not None:
+			conditions.append('e.end__time_epoch >= ?')
+			parameters.append(start)
+		if end is not None:
+			conditions.append('e.start__time_epoch <= ?')
+			parameters.append(end)
+		if rbs_tag is not None:
+			conditions.append('instr(e.rbs__cause_tags, ?) > 0')
+			parameters.append(rbs_tag)
+		if frames_file__uuid is not None:
+			conditions.append('e.frames_file__uuid = ?')
+			parameters.append(frames_file__uuid)
+		if cause is not None:
+			conditions.append('p.prediction__name = ?')
+			parameters.append(cause)
+
+		join_condition = ''
+		if stage is not None:
+			join_condition = ' AND p.stage = ?'
+			parameters.insert(0, stage)
+
+		query = (
+			'SELECT e.*, p.stage, p.prediction__label, p.prediction__name FROM episodes e '
+			'LEFT JOIN predictions p ON p.frames_file__uuid = e.frames_file__uuid AND '
+			'p.associated_client__mac = e.associated_client__mac AND p.episode__id = e.episode__id' + join_condition)
+		if len(conditions) > 0:
+			query += ' WHERE ' + ' AND '.join(conditions)
+		query += ' ORDER BY e.associated_client__mac, e.start__time_epoch, p.stage'
+		return pd.read_sql_query(query, self.__connection, params = parameters)
+
+	def count_causes(self, client: str = None, start: float = None, end: float = None, stage: int = None):
+		"""
+		Returns the number of episodes per predicted cause name (None = not predicted) of a client in a time
+		range, see `find_episodes`.
+		"""
+
+		episodes_df = self.find_episodes(client = client, start = start, end = end, stage = stage)
+		counts = episodes_df['prediction__name'].value_counts(dropna = False)
+		return {(None if pd.isna(name) else name): int(count) for name, count in counts.items()}
+
+	def close(self):
+		self.__connection.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+		return False
@@ -0,0 +1,163 @@
+"""
+Time-window sharding of the episode stage (episodes and their characteristics) for long captures.
+
+The frames of a client are split into time windows (e.g. hourly) that are processed in parallel by a process
+pool. A window knows the episode ends between its own probe requests (a probe request more than 1 second before
+the next one), and computes the characteristics of the episodes between two of these ends.
+The reconciliation, in the calling process:
+	- the last probe request of a window ends an episode if the first probe request of the next windows is more
+	  than 1 second later (the 1 second probe gap rule across the window boundary)
+	- the episodes crossing a window boundary (and the first / last episode of each window) are computed on their
+	  frames from all the windows
+The episodes and their characteristics are the same as without sharding
+(`convert_frames_to_episodes.define_episodes_from_frames` then `compute_client_episodes_characteristics`).
+
+NOTE: the features registered at runtime (`episode_features.register_feature`) are only known by the workers
+      of a forked process pool (the default on linux).
+"""
+
+import numpy as np
+import pandas as pd
+
+from preprocessor import instrumentation
+from preprocessor.convert_frames_to_episodes import EpisodeProperties, compute_client_episodes_characteristics
+from preprocessor.pipelining import get_process_pool
+
+
+def get_probe_epochs(frames_df: pd.DataFrame):
+	"""
+	Epochs of the probe requests of time sorted frames.
+	"""
+
+	return frames_df['frame.time_epoch'].values[frames_df['wlan.fc.type_subtype'].values == 4]
+
+
+def find_episode_end_epochs(probe_epochs: np.ndarray):
+	"""
+	Epochs of the probe requests followed by a probe request more than 1 second later (sorted probe epochs).
+	The last probe request is not included: it depends on the next probe requests.
+	"""
+
+	return probe_epochs[:-1][np.diff(probe_epochs) > 1]
+
+
+def split_into_shards(frames_df: pd.DataFrame, shard_duration: float):
+	"""
+	Splits time sorted frames into time windows of `shard_duration` seconds (aligned on multiples of the
+	duration, e.g. hours). Returns the (non empty) shards as a list of dataframes.
+	"""
+
+	epochs = frames_df['frame.time_epoch'].values
+	windows = np.floor(epochs / shard_duration)
+	boundaries = np.flatnonzero(np.diff(windows)) + 1
+	starts = np.r_[0, boundaries]
+	ends = np.r_[boundaries, len(frames_df)]
+	return [frames_df.iloc[start:end] for start, end in zip(starts, ends)]
+
+
+def _process_shard(shard_df: pd.DataFrame, the_client: str, frames_file__uuid: str, feature_names: list = None):
+	"""
+	Worker: the episode ends of a shard and the characteristics of the episodes between them.
+	Returns (first probe epoch, last probe epoch, episode end epochs, characteristics dataframe (the episode ids
+	are the positions of the end of the episodes in the episode end epochs) or None).
+	"""
+
+	probe_epochs = get_probe_epochs(shard_df)
+	if len(probe_epochs) == 0:
+		return None, None, probe_epochs, None
+
+	end_epochs = find_episode_end_epochs(probe_epochs)
+	if len(end_epochs) < 2:
+		return probe_epochs[0], probe_epochs[-1], end_epochs, None
+
+	# frames of the episodes between the first and the last episode end of the shard
+	epochs = shard_df['frame.time_epoch'].values
+	first, last = np.searchsorted(epochs, [end_epochs[0], end_epochs[-1]], side = 'right')
+	episodes_df = shard_df.iloc[first:last].copy()
+	episodes_df[EpisodeProperties.episode__id.value] = np.searchsorted(end_epochs, epochs[first:last], side = 'left')
+
+	characteristics_df = compute_client_episodes_characteristics(episodes_df, the_client, frames_file__uuid,
+	                                                             feature_names = feature_names)
+	return probe_epochs[0], probe_epochs[-1], end_epochs, characteristics_df
+
+
+def define_episodes_and_characteristics(frames_df: pd.DataFrame, the_client: str, frames_file__uuid: str,
+                                        feature_names: list = None, shard_duration: float = 3600.0,
+                                        max_workers: int = None):
+	"""
+	Defines the episodes of the frames of a client and computes their characteristics, in time-window shards
+	processed in parallel.
+	Returns
+		1. the frames of the episodes (with the `episode__id` field)
+		2. the episode characteristics (one row per episode)
+	or (None, None) if there are no episodes.
+
+	:param frames_df: frames of the client (`convert_frames_to_episodes.filter_client_frames`)
+	:param feature_names: see `compute_client_episodes_characteristics`
+	:param shard_duration: duration of the time windows (seconds)
+	:param max_workers: size of the process pool if it isn't created yet (None = number of cpus),
+	                    see `pipelining.get_process_pool`
+	"""
+
+	# time sorted frames (the frame order within an episode is kept)
+	frames_df = frames_df.sort_values(by = 'frame.time_epoch', kind = 'mergesort')
+	shards = split_into_shards(frames_df, shard_duration)
+
+	executor = get_process_pool(max_workers)
+	with instrumentation.measure('shards') as measurement:
+		results = list(executor.map(_process_shard, shards, [the_client] * len(shards),
+		                            [frames_file__uuid] * len(shards), [feature_names] * len(shards)))
+		measurement.rows = len(frames_df)
+
+	# reconciliation
+	with instrumentation.measure('shards_reconciliation') as measurement:
+		# 1. episode ends of all the shards, and the last probe request of a shard if the next probe request
+		#    (in the next shards) is more than 1 second later
+		end_epochs_list = list()
+		last_probe_epoch = None
+		for first_probe_epoch, shard_last_probe_epoch, shard_end_epochs, _ in results:
+			if first_probe_epoch is None:
+				continue
+			if last_probe_epoch is not None and abs(last_probe_epoch - first_probe_epoch) > 1:
+				end_epochs_list.append([last_probe_epoch, ])
+			end_epochs_list.append(shard_end_epochs)
+			last_probe_epoch = shard_last_probe_epoch
+		if last_probe_epoch is None:
+			measurement.rows = 0
+			return None, None
+		# the last episode ends with the last probe request
+		end_epochs_list.append([last_probe_epoch, ])
+		end_epochs = np.concatenate(end_epochs_list)
+
+		# 2. episode of each frame (frames after the last episode are dropped)
+		epochs = frames_df['frame.time_epoch'].values
+		n_frames = np.searchsorted(epochs, end_epochs[-1], side = 'right')
+		frames_df = frames_df.iloc[:n_frames].copy()
+		episode_ids = np.searchsorted(end_epochs, epochs[:n_frames], side = 'left')
+		frames_df[EpisodeProperties.episode__id.value] = episode_ids
+
+		# 3. characteristics computed by the shards, with the episode ids of the client
+		characteristics_list = list()
+		computed = np.zeros(len(end_epochs), dtype = bool)
+		for _, _, shard_end_epochs, characteristics_df in results:
+			if characteristics_df is None:
+				continue
+			shard_episode_ids = np.searchsorted(end_epochs, shard_end_epochs, side = 'left')
+			characteristics_df[EpisodeProperties.episode__id.value] = shard_episode_ids[
+				characteristics_df[EpisodeProperties.episode__id.value].values]
+			computed[characteristics_df[EpisodeProperties.episode__id.value].values] = True
+			characteristics_list.append(characteristics_df)
+
+		# 4. the other episodes (crossing a shard boundary, first and last episode of the shards)
+		remaining = ~computed[episode_ids]
+		if remaining.any():
+			characteristics_list.append(
+				compute_client_episodes_characteristics(frames_df[remaining], the_client, frames_file__uuid,
+				                                        feature_names = feature_names))
+
+		characteristics_df = pd.concat(characteristics_list, ignore_index = True)
+		characteristics_df.sort_values(by = EpisodeProperties.episode__id.value, inplace = True, kind = 'mergesort',
+		                               ignore_index = True)
+		measurement.rows = len(frames_df)
+
+	return frames_df, characteristics_df
@@ -0,0 +1,609 @@
+"""
+Streaming processing of the frames csv files of a site.
+
+A site is captured by several sniffers (different channels and locations), each producing a separate
+time-sorted frames csv file. The files of a site are read in chunks and merged into a single time-ordered
+frame stream (k-way merge on `frame.time_epoch`), which is fed directly to a streaming episode builder per
+client. Memory is bounded by one chunk per file plus the frames of the open episodes, the files are never
+concatenated into one dataframe.
+
+The episodes are the same as the ones of `convert_frames_to_episodes.define_episodes_from_frames` on the
+concatenation of the files: an episode ends with the last probe request of a burst (next probe request more than
+1 second later) and contains the frames of the client after the end of the previous episode, at most
+`pending_window` seconds before its first probe request (see `StreamingEpisodeBuilder`; None = no limit).
+
+When the sniffers overlap in coverage the same frame is captured several times; `FrameDeduplicator` removes
+the copies from the merged stream (see `process_site_frames_csv_files(dedup_window = ...)`).
+"""
+
+import collections
+import datetime
+import heapq
+import os
+from uuid import uuid4
+
+import numpy as np
+import pandas as pd
+
+from preprocessor import compression, directories, instrumentation
+from preprocessor.convert_frames_to_episodes import EpisodeProperties, MappingParameters, \
+	assign_rule_based_system_tags_to_episodes, coerce_rssi_values, compute_client_episodes_characteristics, \
+	filter_client_frames, filter_out_irrelevant_frames, get_features_to_compute, get_output_column_order, \
+	prepare_environment, write_quarantined_frames
+
+# index of the frames csv file (in the list of files of the site) a frame was read from
+frame_source_column = 'frame__source'
+
+
+def iter_frames_csv_chunks(filepath, chunksize: int = 100000, quarantine_file = None):
+	"""
+	Reads a frames csv file in chunks, sanitized as in `convert_frames_to_episodes.read_frames_csv_file`.
+	Each chunk is sorted by `frame.time_epoch`. Raises a ValueError if the file is not sorted across chunks.
+	"""
+
+	reader = pd.read_csv(
+		filepath_or_buffer = filepath,
+		sep = ',',  # comma separated values (default)
+		header = 0,  # use first row as column_names
+		index_col = None,  # do not use any column to index
+		skipinitialspace = True,  # skip any space after delimiter
+		na_values = ['', ],  # values to consider as `not available`
+		na_filter = True,  # detect `not available` values
+		skip_blank_lines = True,  # skip any blank lines in the file
+		float_precision = 'high',
+		on_bad_lines = 'warn',  # drop malformed lines, with a warning
+		chunksize = chunksize
+	)
+
+	last_epoch = -np.inf
+	for chunk in reader:
+		# drop unnecessary columns
+		chunk.drop(columns = ['radiotap.dbm_antsignal_2', 'radiotap.dbm_antsignal_3', 'radiotap.dbm_antsignal_4',
+		                      'radiotap.dbm_antsignal_5', ], inplace = True, errors = 'ignore')
+
+		# make sure every available rssi value is a float (the index is the position of the frame in the file)
+		chunk['radiotap.dbm_antsignal'], quarantined_df = coerce_rssi_values(chunk)
+		if len(quarantined_df) > 0 and quarantine_file is not None:
+			write_quarantined_frames(quarantined_df, os.path.basename(filepath), quarantine_file)
+
+		chunk.dropna(axis = 0, subset = ['frame.time_epoch', 'radiotap.dbm_antsignal', ], inplace = True)
+		if len(chunk) == 0:
+			continue
+		chunk.sort_values(by = 'frame.time_epoch', axis = 0, ascending = True, inplace = True, kind = 'mergesort')
+
+		if chunk['frame.time_epoch'].iat[0] < last_epoch:
+			raise ValueError('"{:s}" is not sorted by `frame.time_epoch`'.format(filepath))
+		last_epoch = chunk['frame.time_epoch'].iat[-1]
+
+		yield chunk
+
+
+def merge_frames_streams(streams: list):
+	"""
+	k-way merge of time sorted streams of frames (iterables of time sorted dataframes).
+	Yields time sorted dataframes; frames with the same epoch keep the order of the streams.
+
+	The streams are merged chunk by chunk: a heap keeps the streams ordered by the epoch of the last buffered
+	frame, everything up to the smallest of them (the watermark) can be released since no stream can produce
+	an earlier frame. Only one chunk per stream is buffered.
+	"""
+
+	streams = [iter(stream) for stream in streams]
+	buffers = [None] * len(streams)
+	heap = list()
+
+	def __refill(stream_idx):
+		for chunk in streams[stream_idx]:
+			if len(chunk) > 0:
+				buffers[stream_idx] = chunk
+				heapq.heappush(heap, (chunk['frame.time_epoch'].iat[-1], stream_idx))
+				return
+		buffers[stream_idx] = None
+
+	for _stream_idx in range(len(streams)):
+		__refill(_stream_idx)
+
+	while len(heap) > 0:
+		watermark = heap[0][0]
+
+		# release all the buffered frames up to the watermark
+		parts = list()
+		for stream_idx, buffer in enumerate(buffers):
+			if buffer is None:
+				continue
+			n_frames = int(np.searchsorted(buffer['frame.time_epoch'].values, watermark, side = 'right'))
+			if n_frames > 0:
+				parts.append(buffer.iloc[:n_frames])
+				buffers[stream_idx] = buffer.iloc[n_frames:]
+
+		# the streams at the top of the heap are exhausted
+		while len(heap) > 0 and len(buffers[heap[0][1]]) == 0:
+			_, stream_idx = heapq.heappop(heap)
+			__refill(stream_idx)
+
+		merged = pd.concat(parts, ignore_index = True) if len(parts) > 1 else parts[0]
+		if len(parts) > 1:
+			merged.sort_values(by = 'frame.time_epoch', axis = 0, ascending = True, inplace = True, kind = 'mergesort')
+		yield merged
+
+
+def merge_frames_csv_files(filepaths: list, chunksize: int = 100000, quarantine_file = None):
+	"""
+	Merges time sorted frames csv files into a single time sorted stream of dataframes.
+	The index of the file of each frame is kept in the `frame__source` column.
+	"""
+
+	def __stream(source_idx, filepath):
+		for chunk in iter_frames_csv_chunks(filepath, chunksize = chunksize, quarantine_file = quarantine_file):
+			chunk[frame_source_column] = source_idx
+			yield chunk
+
+	return merge_frames_streams([__stream(idx, filepath) for idx, filepath in enumerate(filepaths)])
+
+
+def find_all_client_mac_addresses_in_files(filepaths: list, chunksize: int = 100000):
+	"""
+	Returns a sorted list of all the client mac addresses (senders or receivers of probe requests) in the files.
+	Reads only the required columns, in chunks.
+	"""
+
+	address_columns = ['wlan.sa', 'wlan.da', 'wlan.ta', 'wlan.ra', ]
+	client_mac_addresses = set()
+	for filepath in filepaths:
+		reader = pd.read_csv(filepath, sep = ',', header = 0, skipinitialspace = True, chunksize = chunksize,
+		                     usecols = address_columns + ['wlan.fc.type_subtype', ], on_bad_lines = 'skip')
+		for chunk in reader:
+			_preq_df = chunk[chunk['wlan.fc.type_subtype'] == 4]
+			for column in address_columns:
+				client_mac_addresses.update(_preq_df[column].dropna().unique())
+
+	# remove `broadcast`
+	client_mac_addresses = list(client_mac_addresses.difference({'ff:ff:ff:ff:ff:ff', }))
+	client_mac_addresses.sort()
+	return client_mac_addresses
+
+
+class FrameDeduplicator:
+	"""
+	Removes the copies of a frame captured by several sniffers from a time ordered (merged) frame stream.
+
+	Frames are identified by a key: transmitter and receiver addresses, subtype, retry bit and (if the column
+	is available) sequence number. A frame is a duplicate if a frame with the same key was captured by another
+	sniffer (`frame__source`) at most `window` seconds earlier and was not already matched with a frame of
+	this sniffer; the first copy is kept. Frames of the same sniffer are never removed (retransmissions).
+	Without `wlan.seq`, distinct frames with the same key captured by different sniffers within the window
+	are merged, so the window should only cover the clock offset between the sniffers.
+
+	The recent keys are kept in a hash map with a time ordered queue for expiry, so memory is bounded by the
+	number of frames in the window.
+	"""
+
+	key_columns = ['wlan.ta', 'wlan.ra', 'wlan.fc.type_subtype', 'wlan.fc.retry', ]
+	sequence_number_column = 'wlan.seq'
+	# numbers of the key, hashed as floats: the dtype inferred for a chunk (or file) depends on its missing values
+	numeric_key_columns = ['wlan.fc.type_subtype', 'wlan.fc.retry', 'wlan.seq', ]
+
+	def __init__(self, window: float = 0.002):
+		self.window = window
+		self.n_frames = 0
+		self.n_duplicates = 0
+		# key -> list of [epoch, sources] of the recent frames with the key
+		self.__recent = dict()
+		# (epoch, key) in arrival order, for expiry
+		self.__queue = collections.deque()
+
+	def filter_frames(self, dataframe: pd.DataFrame):
+		"""
+		Returns the frames of a time sorted chunk (later than the previous chunks) without the duplicates.
+		"""
+
+		if len(dataframe) == 0:
+			return dataframe
+
+		key_columns = list(self.key_columns)
+		if self.sequence_number_column in dataframe.columns:
+			key_columns.append(self.sequence_number_column)
+		# the same dtype for every chunk, and NaN != NaN, so missing values are replaced before hashing the keys
+		key_df = pd.DataFrame({
+			column: (pd.to_numeric(dataframe[column], errors = 'coerce').astype(np.float64).fillna(-1)
+			         if column in self.numeric_key_columns else
+			         dataframe[column].astype(object).where(dataframe[column].notna(), ''))
+			for column in key_columns
+		})
+		keys = pd.util.hash_pandas_object(key_df.astype(str), index = False).values
+		epochs = dataframe['frame.time_epoch'].values
+		sources = dataframe[frame_source_column].values
+
+		keep = np.ones(len(dataframe), dtype = bool)
+		recent = self.__recent
+		queue = self.__queue
+		window = self.window
+		for position, (key, epoch, source) in enumerate(zip(keys.tolist(), epochs.tolist(), sources.tolist())):
+			# expire the frames out of the window
+			while len(queue) > 0 and queue[0][0] < epoch - window:
+				_, expired_key = queue.popleft()
+				occurrences = recent[expired_key]
+				occurrences.pop(0)
+				if len(occurrences) == 0:
+					del recent[expired_key]
+
+			occurrences = recent.get(key)
+			if occurrences is not None:
+				for occurrence in occurrences:
+					if source not in occurrence[1]:
+						occurrence[1].add(source)
+						keep[position] = False
+						break
+				if not keep[position]:
+					continue
+			else:
+				occurrences = recent[key] = list()
+			occurrences.append([epoch, {source, }])
+			queue.append((epoch, key))
+
+		self.n_frames += len(dataframe)
+		self.n_duplicates += int(len(dataframe) - keep.sum())
+		return dataframe[keep]
+
+
+class StreamingEpisodeBuilder:
+	"""
+	Builds the episodes of a client from a time ordered stream of its frames.
+	An episode is closed as soon as it can't be extended anymore: when a probe request (or any frame) arrives more
+	than 1 second after its last probe request.
+
+	The frames after the last closed episode are kept until the next episode claims them. With `pending_window`
+	(seconds), an episode keeps only the frames at most `pending_window` seconds before its first probe request,
+	so the frames of a client that stops probing (e.g. leaves the site) are dropped instead of being kept until
+	the end of the stream: memory is bounded by the frames of the window. Without it (None), an episode has all
+	the frames after the previous episode, as in `define_episodes_from_frames`.
+	"""
+
+	def __init__(self, the_client: str, pending_window: float = None):
+		if pending_window is not None and pending_window <= 1:
+			raise ValueError('The pending window must be longer than 1 second')
+		self.the_client = the_client
+		self.pending_window = pending_window
+		self.n_episodes = 0
+		# number of frames dropped by the pending window
+		self.n_dropped_frames = 0
+		# frames after the end of the last closed episode
+		self.__pending = list()
+		self.__last_probe_epoch = None
+		# first probe request of the open episode (None = no open episode)
+		self.__first_probe_epoch = None
+
+	def add_frames(self, dataframe: pd.DataFrame):
+		"""
+		Adds time sorted frames (later than the frames added before).
+		Returns the frames of the episodes closed by these frames (with the `episode__id` field), or None.
+		"""
+
+		epochs = dataframe['frame.time_epoch'].values
+		probe_epochs = epochs[dataframe['wlan.fc.type_subtype'].values == 4]
+
+		# ends (last probe request of a burst) and first probe requests of the episodes closed by these frames
+		episode_end_epochs = list()
+		episode_first_probe_epochs = list()
+		for probe_epoch in probe_epochs:
+			if self.__first_probe_epoch is not None and abs(self.__last_probe_epoch - probe_epoch) > 1:
+				episode_end_epochs.append(self.__last_probe_epoch)
+				episode_first_probe_epochs.append(self.__first_probe_epoch)
+				self.__first_probe_epoch = None
+			if self.__first_probe_epoch is None:
+				self.__first_probe_epoch = probe_epoch
+			self.__last_probe_epoch = probe_epoch
+		# the open episode is complete if the frames are more than 1 second after its last probe request
+		# (any later probe request would close it)
+		if self.__first_probe_epoch is not None and len(epochs) > 0 and epochs[-1] - self.__last_probe_epoch > 1:
+			episode_end_epochs.append(self.__last_probe_epoch)
+			episode_first_probe_epochs.append(self.__first_probe_epoch)
+			self.__first_probe_epoch = None
+
+		self.__pending.append(dataframe)
+		episodes_df = None
+		if len(episode_end_epochs) > 0:
+			episodes_df = self.__close_episodes(episode_end_epochs, episode_first_probe_epochs)
+		if self.pending_window is not None and len(epochs) > 0:
+			self.__trim_pending(epochs[-1])
+		return episodes_df
+
+	def finish(self):
+		"""
+		Closes the last episode (ends with the last probe request), frames after it are dropped.
+		Returns the frames of the episode (with the `episode__id` field), or None.
+		"""
+
+		episodes_df = None
+		if self.__first_probe_epoch is not None:
+			episodes_df = self.__close_episodes([self.__last_probe_epoch, ], [self.__first_probe_epoch, ])
+		self.__pending = list()
+		self.__last_probe_epoch = None
+		self.__first_probe_epoch = None
+		return episodes_df
+
+	def __close_episodes(self, episode_end_epochs: list, episode_first_probe_epochs: list):
+		frames_df = pd.concat(self.__pending, ignore_index = True) if len(self.__pending) > 1 else self.__pending[0]
+		epochs = frames_df['frame.time_epoch'].values
+
+		# number of frames up to (including) each episode end
+		boundaries = np.searchsorted(epochs, episode_end_epochs, side = 'right')
+		counts = np.diff(np.r_[0, boundaries])
+		n_closed = int(boundaries[-1])
+
+		episodes_df = frames_df.iloc[:n_closed].copy()
+		episodes_df[EpisodeProperties.episode__id.value] = np.repeat(
+			np.arange(self.n_episodes, self.n_episodes + len(episode_end_epochs)), counts)
+		if self.pending_window is not None:
+			window_starts = np.repeat(np.asarray(episode_first_probe_epochs) - self.pending_window, counts)
+			in_window = epochs[:n_closed] >= window_starts
+			self.n_dropped_frames += int(n_closed - in_window.sum())
+			episodes_df = episodes_df[in_window]
+		self.n_episodes += len(episode_end_epochs)
+
+		self.__pending = [frames_df.iloc[n_closed:], ]
+		return episodes_df
+
+	def __trim_pending(self, last_epoch):
+		"""
+		Drops the pending frames more than `pending_window` seconds before the first probe request of the open
+		episode, or before the last frame if no episode is open (the next probe request can't be earlier).
+		"""
+
+		first_probe_epoch = self.__first_probe_epoch if self.__first_probe_epoch is not None else last_epoch
+		window_start = first_probe_epoch - self.pending_window
+		pending = [frames_df for frames_df in self.__pending if len(frames_df) > 0]
+		if len(pending) == 0 or pending[0]['frame.time_epoch'].values[0] >= window_start:
+			self.__pending = pending
+			return
+
+		frames_df = pd.concat(pending, ignore_index = True) if len(pending) > 1 else pending[0]
+		n_dropped = int(np.searchsorted(frames_df['frame.time_epoch'].values, window_start, side = 'left'))
+		self.n_dropped_frames += n_dropped
+		self.__pending = [frames_df.iloc[n_dropped:], ]
+
+
+def group_frames_csv_files_by_site(frames_csv_file_names: list, separator: str = '__'):
+	"""
+	Groups frames csv files named `<site><separator><sniffer>.csv` by site.
+	Files without the separator are sites of their own.
+	Returns a dictionary: site -> sorted list of file names
+	"""
+
+	sites = dict()
+	for name in frames_csv_file_names:
+		site = compression.split_extension(name)[0].split(separator)[0]
+		sites.setdefault(site, list()).append(name)
+	for site in sites:
+		sites[site].sort()
+	return sites
+
+
+def process_site_frames_csv_files(site_name: str, frames_csv_names: list, access_points, clients, assign_rbs_tags,
+                                  mapping_file, quarantine_file = None, frames_csv_dir = directories.frames_csv_files,
+                                  semi_processed_dir = directories.semi_processed_frames_csv_files,
+                                  processed_dir = directories.processed_episode_csv_files,
+                                  required_features = None, chunksize: int = 100000, dedup_window: float = None,
+                                  episode_index = None, pending_window: float = 600.0):
+	"""
+	Processes the frames csv files of a site (one per sniffer) as a single merged frame stream to generate
+	episode characteristics. Same outputs as `convert_frames_to_episodes.process_frame_csv_file`, named after
+	the site; the mapping file gets a row per frames csv file (all with the uuid of the site).
+
+	:param site_name: name of the output files
+	:param frames_csv_names: time sorted frames csv files of the site
+	:param chunksize: number of frames read at once from each file
+	:param dedup_window: remove the frames captured by more than one sniffer, matching copies at most
+	                     `dedup_window` seconds apart (None = keep all the frames), see `FrameDeduplicator`
+	:param episode_index: `episode_index.EpisodeIndex` to add the episodes to (None = not indexed)
+	:param pending_window: an episode keeps only the frames at most `pending_window` seconds before its first
+	                       probe request, to bound the memory used by the clients that stop probing (None = all
+	                       the frames after the previous episode), see `StreamingEpisodeBuilder`
+	:return: number of episodes
+	"""
+
+	# current time
+	timestamp = datetime.datetime.now()
+
+	frames_csv_files = [os.path.join(frames_csv_dir, name) for name in frames_csv_names]
+	instrumentation.set_context(frames_file = site_name)
+	frames_file__uuid = timestamp.strftime('%d%m%Y%H%M%S') + '.' + str(uuid4())
+	print('• UUID generated for the site {:s}: {:s}'.format(site_name, frames_file__uuid))
+
+	if clients is None:
+		with instrumentation.measure('find_clients'):
+			clients = find_all_client_mac_addresses_in_files(frames_csv_files, chunksize = chunksize)
+
+	# update mapping file
+	mapping = {
+		MappingParameters.timestamp__date.value: [timestamp.strftime('%d-%m-%Y'), ] * len(frames_csv_names),
+		MappingParameters.timestamp__time.value: [timestamp.strftime('%H-%M-%S'), ] * len(frames_csv_names),
+		MappingParameters.frames_file__name.value: list(frames_csv_names),
+		MappingParameters.frames_file__uuid.value: [frames_file__uuid, ] * len(frames_csv_names),
+	}
+	mapping_df = pd.DataFrame.from_dict(mapping)
+	mapping_columns = mapping_df.columns.values.tolist()
+	mapping_columns.sort()
+	mapping_headers = not os.path.exists(mapping_file)
+	mapping_df.to_csv(mapping_file, mode = 'a', index = False, header = mapping_headers, columns = mapping_columns)
+
+	processed_output_column_order = get_output_column_order()
+	if assign_rbs_tags:
+		processed_output_column_order.append('rbs__cause_tags')
+	feature_names = get_features_to_compute(required_features, assign_rbs_tags)
+
+	# the outputs have the extension (compression) of the frames csv files of the site
+	output_extension = compression.split_extension(frames_csv_names[0])[1]
+	semi_processed_csvfile = os.path.join(semi_processed_dir, frames_file__uuid + output_extension)
+	semi_processed_output_column_order = None
+
+	builders = {the_client: StreamingEpisodeBuilder(the_client, pending_window) for the_client in clients}
+	deduplicator = FrameDeduplicator(dedup_window) if dedup_window is not None and len(frames_csv_files) > 1 else None
+	ep_characteristics_list = list()
+
+	def __process_episodes(the_client, episodes_df):
+		nonlocal semi_processed_output_column_order
+		if episodes_df is None or len(episodes_df) == 0:
+			return
+
+		instrumentation.set_context(frames_file = site_name, client = the_client)
+		# save semi_processed frames (can be used to link predictions for episodes back to frames)
+		episodes_df[EpisodeProperties.associated_client__mac.value] = the_client
+		episodes_df[EpisodeProperties.frames_file__uuid.value] = frames_file__uuid
+		if semi_processed_output_column_order is None:
+			semi_processed_output_column_order = [
+				column for column in episodes_df.columns.values.tolist()
+				if column not in [EpisodeProperties.episode__id.value, EpisodeProperties.associated_client__mac.value,
+				                  EpisodeProperties.frames_file__uuid.value, ]
+			]
+			semi_processed_output_column_order.sort()
+			semi_processed_output_column_order.extend([EpisodeProperties.episode__id.value,
+			                                           EpisodeProperties.associated_client__mac.value,
+			                                           EpisodeProperties.frames_file__uuid.value, ])
+		with instrumentation.measure('semi_processed_write') as measurement:
+			episodes_df.to_csv(semi_processed_csvfile, sep = ',', mode = 'a', index = False,
+			                   header = not os.path.exists(semi_processed_csvfile),
+			                   columns = semi_processed_output_column_order,
+			                   compression = compression.get_to_csv_compression(semi_processed_csvfile))
+			measurement.rows = len(episodes_df)
+
+		with instrumentation.measure('characteristics') as measurement:
+			ep_characteristics_list.append(
+				compute_client_episodes_characteristics(episodes_df, the_client, frames_file__uuid,
+				                                        feature_names = feature_names))
+			measurement.rows = len(episodes_df)
+
+	# ### Processing ###
+	for chunk in merge_frames_csv_files(frames_csv_files, chunksize = chunksize, quarantine_file = quarantine_file):
+		instrumentation.set_context(frames_file = site_name)
+		# 1. remove the frames captured by more than one sniffer
+		if deduplicator is not None:
+			with instrumentation.measure('dedup') as measurement:
+				chunk = deduplicator.filter_frames(chunk)
+				measurement.rows = len(chunk)
+
+		# 1.a. keep only relevant frames
+		with instrumentation.measure('relevance_filter') as measurement:
+			chunk = filter_out_irrelevant_frames(chunk, clients, access_points)
+			measurement.rows = 0 if chunk is None else len(chunk)
+		if chunk is None:
+			continue
+
+		# 2. feed the frames of each client to its episode builder
+		for the_client, builder in builders.items():
+			instrumentation.set_context(frames_file = site_name, client = the_client)
+			with instrumentation.measure('client_filter', memory = False) as measurement:
+				client_df = filter_client_frames(chunk, the_client)
+				measurement.rows = 0 if client_df is None else len(client_df)
+			if client_df is None:
+				continue
+
+			with instrumentation.measure('segmentation', memory = False):
+				episodes_df = builder.add_frames(client_df)
+			__process_episodes(the_client, episodes_df)
+
+	# 3. close the last episode of each client
+	for the_client, builder in builders.items():
+		__process_episodes(the_client, builder.finish())
+		print('• Episodes generated for client {:s} -'.format(the_client), builder.n_episodes)
+		if builder.n_dropped_frames > 0:
+			print('• Frames outside the pending window dropped for client {:s} -'.format(the_client),
+			      builder.n_dropped_frames)
+
+	instrumentation.set_context(frames_file = site_name)
+	if deduplicator is not None:
+		print('• Duplicate frames removed: {:d} of {:d}'.format(deduplicator.n_duplicates, deduplicator.n_frames))
+
+	# 4. make a dataframe from episode characteristics
+	with instrumentation.measure('to_dataframe') as measurement:
+		if len(ep_characteristics_list) > 0:
+			ep_characteristics_df = pd.concat(ep_characteristics_list, ignore_index = True)
+			# same order as the episodes of `process_frame_csv_file` (by client, then episode)
+			client_positions = {the_client: idx for idx, the_client in enumerate(clients)}
+			ep_characteristics_df.sort_values(
+				by = [EpisodeProperties.associated_client__mac.value, EpisodeProperties.episode__id.value],
+				key = lambda column: column.map(client_positions)
+				if column.name == EpisodeProperties.associated_client__mac.value else column,
+				inplace = True, kind = 'mergesort', ignore_index = True)
+		else:
+			ep_characteristics_df = pd.DataFrame(columns = get_output_column_order())
+		measurement.rows = len(ep_characteristics_df)
+	print('• Total episodes generated: {:d}'.format(len(ep_characteristics_df)))
+	ep_characteristics_df.dropna(axis = 0, inplace = True)
+	print('• Total episodes generated (after dropping null values): {:d}'.format(len(ep_characteristics_df)))
+
+	# 5. (optional) assign tags for causes according to old rule-based-system
+	if assign_rbs_tags:
+		with instrumentation.measure('tagging') as measurement:
+			ep_characteristics_df = assign_rule_based_system_tags_to_episodes(ep_characteristics_df)
+			measurement.rows = len(ep_characteristics_df)
+
+	# 5.a. (optional) index the episodes
+	if episode_index is not None:
+		with instrumentation.measure('episodes_index') as measurement:
+			measurement.rows = episode_index.add_episodes(ep_characteristics_df, source = site_name)
+
+	# 6. generate a csv file as an output
+	output_csvfile = os.path.join(processed_dir, site_name + output_extension)
+	with instrumentation.measure('episodes_write') as measurement:
+		ep_characteristics_df.to_csv(output_csvfile, sep = ',', index = False, header = True,
+		                             columns = processed_output_column_order,
+		                             compression = compression.get_to_csv_compression(output_csvfile))
+		measurement.rows = len(ep_characteristics_df)
+
+	return len(ep_characteristics_df)
+
+
+def main(sites: dict = None, access_points = None, clients = None, assign_rbs_tags = True,
+         mapping_file = directories.conversion_mapping_file, chunksize: int = 100000, dedup_window: float = None,
+         episode_index_file = None, pending_window: float = 600.0):
+	"""
+	:param sites: site -> frames csv file names (None = group the files in `frames_csv_files` by name,
+	              see `group_frames_csv_files_by_site`)
+	:param dedup_window: seconds within which copies of a frame captured by different sniffers are removed
+	                     (None = keep all the frames)
+	:param episode_index_file: SQLite index the episodes are added to (None = disabled), see `episode_index`
+	:param pending_window: seconds of frames kept before the first probe request of an episode (None = all the
+	                       frames after the previous episode), see `StreamingEpisodeBuilder`
+	"""
+
+	prepare_environment()
+
+	if sites is None:
+		frames_csv_file_names = [name for name in os.listdir(directories.frames_csv_files)
+		                         if compression.is_csv_file(name)]
+		sites = group_frames_csv_files_by_site(frames_csv_file_names)
+
+	# one quarantine file per run
+	quarantine_csvname = 'quarantine_' + datetime.datetime.now().strftime('%d%m%Y%H%M%S') + '.csv'
+	quarantine_file = os.path.join(directories.temporary, quarantine_csvname)
+
+	episode_index = None
+	if episode_index_file is not None:
+		from preprocessor.episode_index import EpisodeIndex
+		episode_index = EpisodeIndex(episode_index_file)
+
+	for site_name in sorted(sites.keys()):
+		print('Started processing site: {:s}'.format(site_name), sites[site_name])
+		process_site_frames_csv_files(site_name, sites[site_name], access_points = access_points, clients = clients,
+		                              assign_rbs_tags = assign_rbs_tags, mapping_file = mapping_file,
+		                              quarantine_file = quarantine_file, chunksize = chunksize,
+		                              dedup_window = dedup_window, episode_index = episode_index,
+		                              pending_window = pending_window)
+		print('-' * 40)
+		print()
+
+	if episode_index is not None:
+		episode_index.close()
+
+
+if __name__ == '__main__':
+	# disable warnings
+	pd.options.mode.chained_assignment = None
+
+	#   - sites = None, to group the frames csv files by name (`<site>__<sniffer>.csv`)
+	#   - clients = None, to process all clients
+	#   - access points = None, to use all beacon frames
+	#   - dedup window = None, to keep the frames captured by more than one sniffer
+	main(sites = None, clients = None, access_points = None, assign_rbs_tags = False,
+	     mapping_file = directories.conversion_mapping_file, dedup_window = 0.002)
@@ -0,0 +1,418 @@
+"""
+Instrumentation for the episode pipeline (and the machine learning scripts).
+Records the wall time, row count and peak memory of each stage of the pipeline, aggregated per
+(frames file, client, stage), and writes them as a report (json or csv) at the end of a run.
+
+The peak memory of a stage (`stage_peak__kb`) is the largest memory growth within one execution of the stage
+(from its start): the peak traced by `tracemalloc` in memory profiling mode, else the growth of the rss at the
+end of the execution (the rss has no per stage high-water mark). Nested stages are included in the peak of the
+enclosing stage. `tracemalloc` is process wide, so the peaks of stages running in parallel threads include the
+allocations of the other threads.
+
+Memory profiling mode (opt-in) additionally samples the current rss and the top allocators
+(`tracemalloc`) at the end of each pipeline stage and keeps them as a timeline, which can be written
+per run for capacity planning.
+
+When disabled (default), `measure` returns a shared no-op context manager, so the instrumented code pays
+only for a function call and a flag check.
+
+The context (frames file, client) is per thread, so stages running in background threads (prefetching,
+asynchronous writers) set their own context; the aggregation is thread safe.
+
+Usage:
+	instrumentation.enable()
+	instrumentation.set_context(frames_file = 'capture.csv', client = None)
+	with instrumentation.measure('read') as m:
+		df = read(...)
+		m.rows = len(df)
+	instrumentation.write_report('report.json')
+
+	with instrumentation.profile_memory('memory_timeline.json'):
+		run(...)
+"""
+
+import contextlib
+import csv
+import json
+import linecache
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+	import resource
+except ImportError:  # not available on windows
+	resource = None
+
+__state = {
+	'enabled': False,
+	# per thread: frames_file, client
+	'context': threading.local(),
+	'lock': threading.Lock(),
+	# (frames_file, client, stage) -> aggregated record
+	'records': dict(),
+	# order in which the keys were first seen (the report follows the pipeline order)
+	'order': list(),
+	# memory profiling
+	'memory_profiling': False,
+	'top_allocators': 5,
+	'start_time': 0.0,
+	'timeline': list(),
+}
+
+report_columns = [
+	'frames_file', 'client', 'stage', 'calls', 'wall_time__total', 'wall_time__max', 'rows__total',
+	'stage_peak__kb',
+]
+
+timeline_columns = [
+	'elapsed_time', 'frames_file', 'client', 'stage', 'rows', 'rss__kb', 'peak_rss__kb', 'traced__kb',
+	'stage_peak__kb', 'top_allocators',
+]
+
+
+def get_peak_rss_kb():
+	"""
+	Returns the peak resident set size (high-water mark) of the process in kilobytes.
+	"""
+
+	if resource is None:
+		return -1
+
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# `ru_maxrss` is in bytes on macOS and in kilobytes on linux
+	if sys.platform == 'darwin':
+		peak_rss = peak_rss // 1024
+	return peak_rss
+
+
+def get_current_rss_kb():
+	"""
+	Returns the current resident set size of the process in kilobytes (-1 if it can't be determined).
+	"""
+
+	try:
+		with open('/proc/self/statm', 'r') as file:
+			resident_pages = int(file.read().split()[1])
+		return resident_pages * os.sysconf('SC_PAGE_SIZE') // 1024
+	except (OSError, ValueError, IndexError):
+		return -1
+
+
+def get_top_allocators(limit: int):
+	"""
+	Returns the `limit` source lines holding the most memory traced by `tracemalloc` as a list of
+	(location, size in kilobytes, source line).
+	"""
+
+	snapshot = tracemalloc.take_snapshot()
+	snapshot = snapshot.filter_traces([
+		tracemalloc.Filter(False, tracemalloc.__file__),
+		tracemalloc.Filter(False, __file__),
+		tracemalloc.Filter(False, linecache.__file__),
+		tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+	])
+
+	top_allocators = list()
+	for statistic in snapshot.statistics('lineno')[:limit]:
+		frame = statistic.traceback[0]
+		location = '{:s}:{:d}'.format(frame.filename, frame.lineno)
+		source_line = linecache.getline(frame.filename, frame.lineno).strip()
+		top_allocators.append((location, statistic.size // 1024, source_line))
+	return top_allocators
+
+
+class _NullMeasurement:
+	"""
+	Measurement returned when instrumentation is disabled. Ignores everything.
+	"""
+
+	rows = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		return False
+
+	def __setattr__(self, key, value):
+		pass
+
+
+__null_measurement = _NullMeasurement()
+
+
+class _Measurement:
+	"""
+	Measures a single execution of a stage. Set `rows` inside the `with` block to record a row count.
+	"""
+
+	__slots__ = ('stage', 'rows', 'memory', '__start', '__start_memory', '__peak_memory')
+
+	def __init__(self, stage, memory):
+		self.stage = stage
+		self.rows = None
+		self.memory = memory
+		self.__start = 0.0
+		# memory at the start, and peak (absolute) observed during the execution: bytes (traced) or kb (rss)
+		self.__start_memory = 0
+		self.__peak_memory = 0
+
+	def __enter__(self):
+		self.__start = time.perf_counter()
+		if self.memory:
+			stack = _get_measurement_stack()
+			if _is_tracing_peaks():
+				traced, traced_peak = tracemalloc.get_traced_memory()
+				# the enclosing stage keeps the peak reached before this stage
+				if len(stack) > 0:
+					stack[-1].observe_peak(traced_peak)
+				tracemalloc.reset_peak()
+				self.__start_memory = traced
+			else:
+				self.__start_memory = get_current_rss_kb()
+			self.__peak_memory = self.__start_memory
+			stack.append(self)
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		stage_peak = None
+		if self.memory:
+			stack = _get_measurement_stack()
+			if len(stack) > 0 and stack[-1] is self:
+				stack.pop()
+			if _is_tracing_peaks():
+				self.observe_peak(tracemalloc.get_traced_memory()[1])
+				stage_peak = (self.__peak_memory - self.__start_memory) // 1024
+			else:
+				self.observe_peak(get_current_rss_kb())
+				stage_peak = self.__peak_memory - self.__start_memory
+			# the enclosing stage includes the peak of this stage
+			if len(stack) > 0:
+				stack[-1].observe_peak(self.__peak_memory)
+		_record(self.stage, time.perf_counter() - self.__start, self.rows, self.memory, stage_peak)
+		return False
+
+	def observe_peak(self, memory):
+		self.__peak_memory = max(self.__peak_memory, memory)
+
+
+def _get_measurement_stack():
+	"""
+	Measurements (with memory) in progress in the current thread, the innermost last.
+	"""
+
+	context = __state['context']
+	if not hasattr(context, 'measurements'):
+		context.measurements = list()
+	return context.measurements
+
+
+def _is_tracing_peaks():
+	# the peak can be reset per stage since python 3.9
+	return tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak')
+
+
+def _record(stage, wall_time, rows, memory, stage_peak = None):
+	context = get_context()
+	key = (context['frames_file'], context['client'], stage)
+
+	with __state['lock']:
+		record = __state['records'].get(key)
+		if record is None:
+			record = {
+				'frames_file': key[0],
+				'client': key[1],
+				'stage': stage,
+				'calls': 0,
+				'wall_time__total': 0.0,
+				'wall_time__max': 0.0,
+				'rows__total': 0,
+				'stage_peak__kb': 0,
+			}
+			__state['records'][key] = record
+			__state['order'].append(key)
+
+		record['calls'] += 1
+		record['wall_time__total'] += wall_time
+		record['wall_time__max'] = max(record['wall_time__max'], wall_time)
+		if rows is not None:
+			record['rows__total'] += int(rows)
+		if stage_peak is not None:
+			record['stage_peak__kb'] = max(record['stage_peak__kb'], stage_peak)
+
+		if memory and __state['memory_profiling']:
+			_sample_memory(stage, rows, context, stage_peak)
+
+
+def _sample_memory(stage, rows, context, stage_peak):
+	traced = tracemalloc.get_traced_memory()[0]
+
+	__state['timeline'].append({
+		'elapsed_time': time.perf_counter() - __state['start_time'],
+		'frames_file': context['frames_file'],
+		'client': context['client'],
+		'stage': stage,
+		'rows': rows,
+		'rss__kb': get_current_rss_kb(),
+		'peak_rss__kb': get_peak_rss_kb(),
+		'traced__kb': traced // 1024,
+		'stage_peak__kb': stage_peak,
+		'top_allocators': get_top_allocators(__state['top_allocators']),
+	})
+
+
+def enable(memory_profiling: bool = False, top_allocators: int = 5):
+	"""
+	Enables the instrumentation.
+
+	:param memory_profiling: sample rss and top allocators at the end of each pipeline stage (slow)
+	:param top_allocators: number of allocators to keep per sample
+	"""
+
+	__state['enabled'] = True
+	__state['memory_profiling'] = memory_profiling
+	__state['top_allocators'] = top_allocators
+	__state['start_time'] = time.perf_counter()
+	if memory_profiling and not tracemalloc.is_tracing():
+		tracemalloc.start()
+
+
+def disable():
+	__state['enabled'] = False
+	if __state['memory_profiling'] and tracemalloc.is_tracing():
+		tracemalloc.stop()
+	__state['memory_profiling'] = False
+
+
+def is_enabled():
+	return __state['enabled']
+
+
+def reset():
+	"""
+	Discards all the recorded measurements and the context.
+	"""
+
+	set_context()
+	__state['records'] = dict()
+	__state['order'] = list()
+	__state['timeline'] = list()
+
+
+def set_context(frames_file = None, client = None):
+	"""
+	Sets the frames file and the client the following measurements (of the current thread) belong to.
+	`None` clears the respective part of the context.
+	"""
+
+	__state['context'].frames_file = '' if frames_file is None else str(frames_file)
+	__state['context'].client = '' if client is None else str(client)
+
+
+def get_context():
+	"""
+	Returns the context of the current thread as a dictionary (arguments of `set_context`).
+	"""
+
+	return {
+		'frames_file': getattr(__state['context'], 'frames_file', ''),
+		'client': getattr(__state['context'], 'client', ''),
+	}
+
+
+def measure(stage: str, memory: bool = True):
+	"""
+	Returns a context manager that measures the enclosed block as one execution of `stage`.
+
+	:param memory: sample the memory at the end of the block (if memory profiling is enabled).
+	               Should be False for the fine grained stages (per episode, per feature).
+	"""
+
+	if not __state['enabled']:
+		return __null_measurement
+	return _Measurement(stage, memory)
+
+
+def get_report():
+	"""
+	Returns the aggregated measurements as a list of dictionaries (in pipeline order).
+	"""
+
+	return [dict(__state['records'][key]) for key in __state['order']]
+
+
+def write_report(filepath):
+	"""
+	Writes the aggregated measurements to `filepath`.
+	The format is chosen by the extension: `.json` or `.csv`.
+	"""
+
+	report = get_report()
+
+	if os.path.splitext(filepath)[1] == '.json':
+		with open(filepath, 'w') as file:
+			json.dump(report, file, indent = 2)
+	else:
+		with open(filepath, 'w', newline = '') as file:
+			writer = csv.DictWriter(file, fieldnames = report_columns)
+			writer.writeheader()
+			writer.writerows(report)
+
+	print('• Instrumentation report saved at {:s}'.format(filepath))
+
+
+def get_memory_timeline():
+	"""
+	Returns the memory samples (in order) as a list of dictionaries.
+	"""
+
+	return [dict(sample) for sample in __state['timeline']]
+
+
+def write_memory_timeline(filepath):
+	"""
+	Writes the memory timeline to `filepath`.
+	The format is chosen by the extension: `.json` or `.csv` (top allocators are joined in a single column).
+	"""
+
+	timeline = get_memory_timeline()
+
+	if os.path.splitext(filepath)[1] == '.json':
+		with open(filepath, 'w') as file:
+			json.dump(timeline, file, indent = 2)
+	else:
+		for sample in timeline:
+			sample['top_allocators'] = '; '.join(
+				'{:s}={:d}KB'.format(location, size) for location, size, _ in sample['top_allocators'])
+		with open(filepath, 'w', newline = '') as file:
+			writer = csv.DictWriter(file, fieldnames = timeline_columns)
+			writer.writeheader()
+			writer.writerows(timeline)
+
+	print('• Memory timeline saved at {:s}'.format(filepath))
+
+
+@contextlib.contextmanager
+def profile_memory(timeline_file, report_file = None, top_allocators: int = 5):
+	"""
+	Runs the enclosed block with memory profiling enabled and writes the memory timeline
+	(and the stage report, if `report_file` is given) at the end.
+	Does nothing if `timeline_file` is None.
+	"""
+
+	if timeline_file is None:
+		yield
+		return
+
+	reset()
+	enable(memory_profiling = True, top_allocators = top_allocators)
+	try:
+		yield
+	finally:
+		write_memory_timeline(timeline_file)
+		if report_file is not None:
+			write_report(report_file)
+		disable()
@@ -0,0 +1,101 @@
+"""
+Parallel parsing of large csv files (e.g. multi-GB frames csv files).
+
+The file is split into byte ranges aligned on line boundaries, the ranges are parsed by the process pool of the
+preprocessor (`pipelining.get_process_pool`) with the same options, and the parsed parts are concatenated in file
+order. The columns of the parts are upcast to a common type by the concatenation, as the columns of the complete
+file are by a single `pandas.read_csv`. A column with text in a part is a text column of the file: the parts that
+parsed numbers for it are parsed again with the column as text (the numbers keep their text, as with a single
+`pandas.read_csv`).
+
+NOTE: a line break inside a quoted field would break the alignment of the ranges (there are no quoted fields in
+      the frames csv files written by tshark). Compressed files (see `compression`) are parsed by a single
+      `pandas.read_csv`, their byte ranges can't be decompressed separately.
+"""
+
+import io
+import os
+
+import pandas as pd
+
+from preprocessor.compression import get_compression
+from preprocessor.pipelining import get_process_pool
+
+# smaller files (or ranges) are not worth the processes
+min_range_size = 16 * 1024 * 1024
+
+
+def find_byte_ranges(filepath: str, n_ranges: int):
+	"""
+	Splits the lines of a csv file after the header into (at most) `n_ranges` byte ranges of about the same size,
+	starting at the beginning of a line.
+	Returns the header line (bytes) and the list of (start, end) byte offsets of the ranges.
+	"""
+
+	size = os.path.getsize(filepath)
+	with open(filepath, 'rb') as f:
+		header = f.readline()
+		boundaries = [f.tell(), ]
+		data_size = size - boundaries[0]
+		for idx in range(1, n_ranges):
+			offset = boundaries[0] + data_size * idx // n_ranges
+			if offset <= boundaries[-1]:
+				continue
+			# move to the beginning of the next line (or stay, if the offset is the beginning of a line)
+			f.seek(offset - 1)
+			f.readline()
+			if boundaries[-1] < f.tell() < size:
+				boundaries.append(f.tell())
+		boundaries.append(size)
+
+	return header, list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _parse_byte_range(filepath: str, start: int, end: int, header: bytes, read_csv_kwargs: dict):
+	"""
+	Worker: parses a byte range of a csv file (with the header line of the file).
+	"""
+
+	with open(filepath, 'rb') as f:
+		f.seek(start)
+		data = f.read(end - start)
+	return pd.read_csv(io.BytesIO(header + data), **read_csv_kwargs)
+
+
+def read_csv_parallel(filepath: str, n_workers: int = None, **read_csv_kwargs):
+	"""
+	Same as `pandas.read_csv(filepath, **read_csv_kwargs)` for a csv file with a header line (the dataframe has a
+	range index), parsed in parallel byte ranges.
+	Files smaller than `2 * min_range_size` bytes and compressed files are parsed by `pandas.read_csv` directly.
+
+	:param n_workers: number of byte ranges (None = number of cpus)
+	"""
+
+	if n_workers is None:
+		n_workers = os.cpu_count()
+	n_ranges = min(n_workers, os.path.getsize(filepath) // min_range_size)
+	if n_ranges < 2 or get_compression(filepath) is not None:
+		return pd.read_csv(filepath, **read_csv_kwargs)
+
+	header, byte_ranges = find_byte_ranges(filepath, n_ranges)
+	starts, ends = zip(*byte_ranges)
+	n = len(byte_ranges)
+	parts = list(get_process_pool(n_workers).map(_parse_byte_range, [filepath] * n, starts, ends, [header] * n,
+	                                             [read_csv_kwargs] * n))
+
+	# empty parts (e.g. blank lines) would upcast the columns to `object`
+	non_empty = [idx for idx, part in enumerate(parts) if len(part) > 0]
+	if len(non_empty) == 0:
+		return parts[0]
+
+	# text columns: parse the numbers of the other parts as text
+	text_columns = [column for column in parts[non_empty[0]].columns
+	                if any(parts[idx][column].dtype == object for idx in non_empty)]
+	for idx in non_empty:
+		numeric_columns = [column for column in text_columns
+		                   if parts[idx][column].dtype != object and parts[idx][column].notna().any()]
+		dtype = read_csv_kwargs.get('dtype') or dict()
+		if len(numeric_columns) > 0 and isinstance(dtype, dict):
+			text_kwargs = dict(read_csv_kwargs, dtype = dict(dtype, **{column: str for column in numeric_columns}))
+			parts[idx] = _parse_byte_range(filepath, starts[idx], ends[idx], header, text_kwargs)
+	return pd.concat([parts[idx] for idx in non_empty], ignore_index = True)
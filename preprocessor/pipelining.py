@@ -0,0 +1,180 @@
+"""
+Helpers to overlap the i/o of the pipeline with the computation.
+	- `prefetch`: produces the items of an iterable in a background thread, e.g. parses frames file N+1 while
+	  file N is being processed.
+	- `AsyncWriter`: runs the writes of the outputs in a background thread, in submission order. The queue of
+	  pending writes is bounded: `submit` blocks while it is full (backpressure), which bounds the memory held
+	  by the pending outputs.
+	- `get_process_pool`: the process pool shared by the parallel stages (parallel reads, episode shards).
+
+Errors raised in the background threads are raised again in the calling thread.
+"""
+
+import concurrent.futures
+import os
+import queue
+import threading
+
+from preprocessor import instrumentation
+
+__state = {
+	'process_pool': None,
+}
+
+
+def prefetch(iterable, depth: int = 1):
+	"""
+	Yields the items of `iterable`, producing them in a background thread at most `depth` items ahead of the
+	consumer (the producer waits until the consumer has taken an item before producing the next one).
+
+	If the consumer stops early (error, `break`, the generator is closed), the producer stops after the item it
+	is producing, closes `iterable` (if it is a generator) and the prefetched items are dropped.
+	"""
+
+	items = queue.Queue()
+	slots = threading.Semaphore(depth)
+	stop = threading.Event()
+	end_of_items = object()
+
+	def __produce():
+		try:
+			for item in iterable:
+				items.put((item, None))
+				slots.acquire()
+				if stop.is_set():
+					if hasattr(iterable, 'close'):
+						iterable.close()
+					return
+		except BaseException as error:
+			items.put((None, error))
+			return
+		items.put((end_of_items, None))
+
+	slots.acquire()
+	thread = threading.Thread(target = __produce, name = 'prefetch', daemon = True)
+	thread.start()
+
+	try:
+		while True:
+			item, error = items.get()
+			if error is not None:
+				raise error
+			if item is end_of_items:
+				break
+			# let the producer start on the next item
+			slots.release()
+			yield item
+	finally:
+		# wake the producer if it waits for the consumer, and drop the prefetched items
+		stop.set()
+		slots.release()
+		while True:
+			try:
+				items.get_nowait()
+			except queue.Empty:
+				break
+	thread.join()
+
+
+def append_to_csv_file(dataframe, filepath, columns: list, header: bool = None, **kwargs):
+	"""
+	Appends a dataframe to a csv file. `header = None` writes the header only if the file doesn't exist
+	(decided when the write runs, so it works for queued writes).
+	"""
+
+	if header is None:
+		header = not os.path.exists(filepath)
+	dataframe.to_csv(filepath, mode = 'a', index = False, header = header, columns = columns, **kwargs)
+
+
+class AsyncWriter:
+	"""
+	Runs write jobs (functions without arguments) in a background thread, in submission order.
+
+	Usage:
+		with AsyncWriter(max_pending = 8) as writer:
+			writer.submit('episodes_write', functools.partial(dataframe.to_csv, filepath), rows = len(dataframe))
+	"""
+
+	def __init__(self, max_pending: int = 8):
+		self.__jobs = queue.Queue(maxsize = max_pending)
+		self.__error = None
+		self.__thread = threading.Thread(target = self.__run, name = 'async-writer', daemon = True)
+		self.__thread.start()
+
+	def submit(self, stage: str, function, rows: int = None):
+		"""
+		Queues a write job. Blocks while `max_pending` jobs are pending.
+		The job is measured as `stage` in the instrumentation context of the caller.
+
+		NOTE: the objects written by the job must not be modified after the submission.
+		"""
+
+		self.__raise_error()
+		self.__jobs.put((instrumentation.get_context(), stage, function, rows))
+
+	def close(self):
+		"""
+		Waits for all the pending jobs to finish.
+		"""
+
+		self.__jobs.put(None)
+		self.__thread.join()
+		self.__raise_error()
+
+	def __run(self):
+		while True:
+			job = self.__jobs.get()
+			if job is None:
+				return
+			if self.__error is not None:
+				# drop the remaining jobs after an error
+				continue
+
+			context, stage, function, rows = job
+			try:
+				instrumentation.set_context(**context)
+				with instrumentation.measure(stage) as measurement:
+					function()
+					measurement.rows = rows
+			except BaseException as error:
+				self.__error = error
+
+	def __raise_error(self):
+		if self.__error is not None:
+			error, self.__error = self.__error, None
+			raise error
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		if exc_type is None:
+			self.close()
+		else:
+			# don't hide the original error
+			self.__jobs.put(None)
+			self.__thread.join()
+		return False
+
+
+def get_process_pool(max_workers: int = None):
+	"""
+	Returns the process pool shared by the parallel stages, created on first use with `max_workers` processes
+	(None = number of cpus). The size of an existing pool is kept (see `shutdown_process_pool`).
+
+	NOTE: the workers are started (forked) when the pool is created, create it before starting other threads
+	      (e.g. `prefetch`, `AsyncWriter`).
+	"""
+
+	if __state['process_pool'] is None:
+		__state['process_pool'] = concurrent.futures.ProcessPoolExecutor(max_workers = max_workers)
+		# start the workers
+		__state['process_pool'].submit(int).result()
+	return __state['process_pool']
+
+
+def shutdown_process_pool():
+	if __state['process_pool'] is not None:
+		__state['process_pool'].shutdown()
+		__state['process_pool'] = None
@@ -0,0 +1,167 @@
+"""
+Journal of a batch run of the preprocessor, to resume the run after a crash.
+
+The unit of work is a (frames file, client) pair. The outputs of a unit are staged in a directory of the file
+(in `directories.temporary`) and the unit is recorded as completed in the journal (SQLite) once they are
+written. When all the units of a file are completed, the outputs of the file are assembled into temporary files
+and moved to the output directories atomically (`os.replace`), and the file is recorded as completed.
+
+A restarted run skips the completed files and units, and reuses the uuid (and timestamp) of the unfinished
+files, so no output row is written twice.
+"""
+
+import contextlib
+import json
+import os
+import sqlite3
+
+temporary_file_suffix = '.tmp'
+
+
+@contextlib.contextmanager
+def atomic_output_file(filepath: str):
+	"""
+	Yields a temporary path to write the output to, which is moved to `filepath` (atomically) when the block
+	ends without an error. The temporary file is removed otherwise.
+
+	Usage:
+		with atomic_output_file(output_csvfile) as temporary_csvfile:
+			dataframe.to_csv(temporary_csvfile)
+	"""
+
+	temporary_filepath = filepath + temporary_file_suffix
+	try:
+		yield temporary_filepath
+		# make sure the content is on disk before the file becomes visible
+		with open(temporary_filepath, 'rb+') as f:
+			os.fsync(f.fileno())
+		os.replace(temporary_filepath, filepath)
+	finally:
+		if os.path.exists(temporary_filepath):
+			os.remove(temporary_filepath)
+
+
+def remove_temporary_files(directory: str):
+	"""
+	Removes the temporary files left in a directory by an interrupted run, returns their number.
+	"""
+
+	if not os.path.isdir(directory):
+		return 0
+	temporary_files = [name for name in os.listdir(directory) if name.endswith(temporary_file_suffix)]
+	for name in temporary_files:
+		os.remove(os.path.join(directory, name))
+	return len(temporary_files)
+
+
+class RunJournal:
+	"""
+	Completed files and (file, client) units of a batch run, in a SQLite database.
+
+	Usage:
+		with RunJournal(journal_file) as journal:
+			journal.check_settings({'assign_rbs_tags': True, })
+			...
+	"""
+
+	def __init__(self, filepath: str):
+		self.filepath = filepath
+		self.__connection = sqlite3.connect(filepath)
+		with self.__connection:
+			self.__connection.execute(
+				'CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+			self.__connection.execute(
+				'CREATE TABLE IF NOT EXISTS files (frames_file__name TEXT PRIMARY KEY, frames_file__uuid TEXT NOT NULL, '
+				'timestamp TEXT NOT NULL, completed INTEGER NOT NULL DEFAULT 0)')
+			self.__connection.execute(
+				'CREATE TABLE IF NOT EXISTS units (frames_file__name TEXT NOT NULL, client TEXT NOT NULL, '
+				'n_episodes INTEGER NOT NULL, PRIMARY KEY (frames_file__name, client))')
+
+	def is_empty(self):
+		"""
+		True if no file was started in the journal (new run).
+		"""
+
+		return self.__connection.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 0
+
+	def get_setting(self, name: str, default = None):
+		"""
+		Returns the value of a setting of the run, `default` (stored in the journal) if it isn't set.
+		"""
+
+		row = self.__connection.execute('SELECT value FROM settings WHERE name = ?', (name,)).fetchone()
+		if row is not None:
+			return json.loads(row[0])
+		with self.__connection:
+			self.__connection.execute('INSERT INTO settings (name, value) VALUES (?, ?)', (name, json.dumps(default)))
+		return default
+
+	def check_settings(self, settings: dict):
+		"""
+		Stores the settings of the run, or makes sure they are the settings of the journaled run
+		(raises `ValueError` otherwise, the outputs of both runs would be mixed).
+		"""
+
+		for name, value in settings.items():
+			# normalize the value as it is stored (e.g. tuples as lists)
+			value = json.loads(json.dumps(value))
+			journaled_value = self.get_setting(name, value)
+			if journaled_value != value:
+				raise ValueError('The journal {:s} is for a run with {:s} = {!r} (not {!r})'.format(
+					self.filepath, name, journaled_value, value))
+
+	def start_file(self, frames_file__name: str, frames_file__uuid: str, timestamp: str):
+		"""
+		Records a file as started, returns its (uuid, timestamp): the given ones for a new file, the journaled
+		ones for a file that was already started.
+		"""
+
+		with self.__connection:
+			self.__connection.execute(
+				'INSERT OR IGNORE INTO files (frames_file__name, frames_file__uuid, timestamp) VALUES (?, ?, ?)',
+				(frames_file__name, frames_file__uuid, timestamp))
+		return self.__connection.execute(
+			'SELECT frames_file__uuid, timestamp FROM files WHERE frames_file__name = ?',
+			(frames_file__name,)).fetchone()
+
+	def get_started_files(self):
+		"""
+		Returns the names of the files started in the journal (completed or not).
+		"""
+
+		return set(row[0] for row in self.__connection.execute('SELECT frames_file__name FROM files').fetchall())
+
+	def is_file_completed(self, frames_file__name: str):
+		row = self.__connection.execute(
+			'SELECT completed FROM files WHERE frames_file__name = ?', (frames_file__name,)).fetchone()
+		return row is not None and row[0] == 1
+
+	def complete_file(self, frames_file__name: str):
+		with self.__connection:
+			self.__connection.execute(
+				'UPDATE files SET completed = 1 WHERE frames_file__name = ?', (frames_file__name,))
+
+	def get_completed_units(self, frames_file__name: str):
+		"""
+		Returns the completed clients of a file: client -> number of episodes.
+		"""
+
+		rows = self.__connection.execute(
+			'SELECT client, n_episodes FROM units WHERE frames_file__name = ?', (frames_file__name,)).fetchall()
+		return dict(rows)
+
+	def complete_unit(self, frames_file__name: str, client: str, n_episodes: int):
+		with self.__connection:
+			self.__connection.execute(
+				'INSERT OR REPLACE INTO units (frames_file__name, client, n_episodes) VALUES (?, ?, ?)',
+				(frames_file__name, client, int(n_episodes)))
+
+	def close(self):
+		self.__connection.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+		return False
@@ -0,0 +1,259 @@
+"""
+Generates synthetic monitor mode capture files (`pcap` or `pcapng`) with radiotap headers.
+
+The frames are the same as the ones created by `synthetic_frames.generate_frames_dataframe`
+(probe requests, beacons, data / null frames, acks, deauthentications and (re)association responses),
+encoded as 802.11 frames. Every frame carries a radiotap header with flags, rate, channel and the combined
+`dbm_antsignal`, followed by one `dbm_antsignal` + `antenna` pair per receive chain (extended presence bitmaps),
+the way MIMO capable sniffers report per-chain rssi.
+
+Only the standard library is used for encoding, so the files can be created fully offline.
+"""
+
+import argparse
+import os
+import struct
+
+import numpy as np
+
+from preprocessor.synthetic_frames import generate_frames_dataframe
+
+# link type: IEEE 802.11 plus radiotap header
+__LINKTYPE_IEEE802_11_RADIOTAP = 127
+__SNAPLEN = 65535
+
+# radiotap presence bits
+__RADIOTAP_FLAGS = 1
+__RADIOTAP_RATE = 2
+__RADIOTAP_CHANNEL = 3
+__RADIOTAP_DBM_ANTSIGNAL = 5
+__RADIOTAP_ANTENNA = 11
+__RADIOTAP_NAMESPACE = 29
+__RADIOTAP_EXT = 31
+
+# channel 6, 2.4GHz
+__CHANNEL_FREQUENCY = 2437
+__CHANNEL_FLAGS = 0x00a0  # cck + 2ghz
+
+# 802.11 frame control flags (second byte)
+__FC_TO_DS = 0x01
+__FC_FROM_DS = 0x02
+__FC_RETRY = 0x08
+__FC_PWRMGT = 0x10
+
+capture_files_extensions = ['.pcap', '.cap', '.pcapng', ]
+
+
+def mac_to_bytes(mac):
+	if not isinstance(mac, str):
+		return b'\x00' * 6
+	return bytes(int(octet, 16) for octet in mac.split(':'))
+
+
+def __align(offset, alignment):
+	return (offset + alignment - 1) // alignment * alignment
+
+
+def build_radiotap_header(rssi: int, chain_rssis: list, rate: int = 2):
+	"""
+	Builds a radiotap header.
+
+	:param rssi: combined signal strength (dBm)
+	:param chain_rssis: signal strength per receive chain (dBm), can be empty
+	:param rate: data rate in 500kbps units
+	:return: bytes
+	"""
+
+	# presence bitmaps
+	#   - first: flags, rate, channel, antsignal (+ extension to the per-chain bitmaps)
+	#   - one per chain: antsignal, antenna (each one, except the last, extends to the next)
+	present_words = [(1 << __RADIOTAP_FLAGS) | (1 << __RADIOTAP_RATE) | (1 << __RADIOTAP_CHANNEL) |
+	                 (1 << __RADIOTAP_DBM_ANTSIGNAL)]
+	if len(chain_rssis) > 0:
+		present_words[0] |= (1 << __RADIOTAP_NAMESPACE) | (1 << __RADIOTAP_EXT)
+	for chain_idx in range(len(chain_rssis)):
+		word = (1 << __RADIOTAP_DBM_ANTSIGNAL) | (1 << __RADIOTAP_ANTENNA)
+		if chain_idx < len(chain_rssis) - 1:
+			word |= (1 << __RADIOTAP_NAMESPACE) | (1 << __RADIOTAP_EXT)
+		present_words.append(word)
+
+	# fields (offsets are relative to the start of the header)
+	fields = bytearray()
+	offset = 4 + 4 * len(present_words)
+
+	def __append(data, alignment = 1):
+		nonlocal offset
+		padding = __align(offset, alignment) - offset
+		fields.extend(b'\x00' * padding)
+		fields.extend(data)
+		offset += padding + len(data)
+
+	__append(struct.pack('<B', 0))  # flags
+	__append(struct.pack('<B', rate))  # rate
+	__append(struct.pack('<HH', __CHANNEL_FREQUENCY, __CHANNEL_FLAGS), alignment = 2)  # channel
+	__append(struct.pack('<b', rssi))  # dbm_antsignal
+	for chain_idx, chain_rssi in enumerate(chain_rssis):
+		__append(struct.pack('<b', chain_rssi))  # dbm_antsignal
+		__append(struct.pack('<B', chain_idx))  # antenna
+
+	header_length = 4 + 4 * len(present_words) + len(fields)
+	return struct.pack('<BBH', 0, 0, header_length) + struct.pack('<' + 'I' * len(present_words),
+	                                                              *present_words) + bytes(fields)
+
+
+def build_80211_frame(subtype: int, ra, ta, sa, da, retry: int, pwrmgt: int, status_code, sequence_number: int,
+                      from_access_point: bool):
+	"""
+	Builds an 802.11 frame (without fcs) for the given `wlan.fc.type_subtype`.
+	`from_access_point` tells if the transmitter is the access point (decides ds bits and bssid).
+	"""
+
+	frame_type, frame_subtype = subtype >> 4, subtype & 0x0f
+	fc_flags = (__FC_RETRY if retry else 0) | (__FC_PWRMGT if pwrmgt else 0)
+	sequence_control = struct.pack('<H', (sequence_number & 0x0fff) << 4)
+
+	def __frame_control(flags):
+		return struct.pack('<BB', (frame_subtype << 4) | (frame_type << 2), flags)
+
+	rates_ie = b'\x01\x08\x82\x84\x8b\x96\x0c\x12\x18\x24'
+	ssid_ie = b'\x00\x07synthAP'
+
+	# control frames
+	if frame_type == 1:
+		# ack (and other control frames): receiver address only
+		return __frame_control(fc_flags) + struct.pack('<H', 0) + mac_to_bytes(ra)
+
+	# data frames
+	if frame_type == 2:
+		# the access point is the receiver of uplink frames and the transmitter of downlink frames
+		if from_access_point:
+			flags = fc_flags | __FC_FROM_DS
+			addresses = mac_to_bytes(ra) + mac_to_bytes(ta) + mac_to_bytes(sa)
+		else:
+			flags = fc_flags | __FC_TO_DS
+			addresses = mac_to_bytes(ra) + mac_to_bytes(ta) + mac_to_bytes(da)
+
+		header = __frame_control(flags) + struct.pack('<H', 44) + addresses + sequence_control
+		if frame_subtype & 0x08:  # qos
+			header += struct.pack('<H', 0)
+		if frame_subtype & 0x04:  # no data (null, qos null)
+			return header
+		# llc/snap + ipv4 ethertype + dummy payload
+		return header + b'\xaa\xaa\x03\x00\x00\x00\x08\x00' + bytes(64)
+
+	# management frames
+	header = __frame_control(fc_flags) + struct.pack('<H', 0) + mac_to_bytes(da) + mac_to_bytes(sa)
+	if subtype == 4:  # probe request (bssid = broadcast)
+		return header + mac_to_bytes('ff:ff:ff:ff:ff:ff') + sequence_control + b'\x00\x00' + rates_ie
+	if subtype == 8:  # beacon
+		body = struct.pack('<QHH', 0, 100, 0x0401) + ssid_ie + rates_ie + b'\x03\x01\x06'
+		return header + mac_to_bytes(sa) + sequence_control + body
+	if subtype == 12:  # deauthentication (reason: previous authentication no longer valid)
+		bssid = sa if from_access_point else da
+		return header + mac_to_bytes(bssid) + sequence_control + struct.pack('<H', 2)
+	if subtype in [1, 3]:  # (re)association response
+		status = 0 if status_code != status_code else int(status_code)
+		body = struct.pack('<HHH', 0x0401, status, 0xc001) + rates_ie
+		return header + mac_to_bytes(sa) + sequence_control + body
+
+	return header + mac_to_bytes(sa) + sequence_control
+
+
+def write_pcap_header(file):
+	file.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, __SNAPLEN, __LINKTYPE_IEEE802_11_RADIOTAP))
+
+
+def write_pcap_record(file, epoch: float, packet: bytes):
+	seconds = int(epoch)
+	microseconds = int(round((epoch - seconds) * 1e6))
+	if microseconds >= 1000000:
+		seconds, microseconds = seconds + 1, microseconds - 1000000
+	file.write(struct.pack('<IIII', seconds, microseconds, len(packet), len(packet)))
+	file.write(packet)
+
+
+def __pcapng_block(block_type, body: bytes):
+	padding = b'\x00' * (__align(len(body), 4) - len(body))
+	total_length = 12 + len(body) + len(padding)
+	return struct.pack('<II', block_type, total_length) + body + padding + struct.pack('<I', total_length)
+
+
+def write_pcapng_header(file):
+	# section header block (no options, unknown section length)
+	file.write(__pcapng_block(0x0a0d0d0a, struct.pack('<IHHq', 0x1a2b3c4d, 1, 0, -1)))
+	# interface description block (default timestamp resolution: microseconds)
+	file.write(__pcapng_block(0x00000001, struct.pack('<HHI', __LINKTYPE_IEEE802_11_RADIOTAP, 0, __SNAPLEN)))
+
+
+def write_pcapng_record(file, epoch: float, packet: bytes):
+	timestamp = int(round(epoch * 1e6))
+	body = struct.pack('<IIIII', 0, timestamp >> 32, timestamp & 0xffffffff, len(packet), len(packet)) + packet
+	file.write(__pcapng_block(0x00000006, body))
+
+
+def write_capture_file(filepath, n_chains: int = 2, **kwargs):
+	"""
+	Writes a synthetic capture file. The format is chosen by the extension (`.pcapng` or `.pcap`/`.cap`).
+	See `synthetic_frames.generate_frames_dataframe` for the remaining arguments.
+
+	:param filepath: path to the capture file
+	:param n_chains: number of receive chains reported in the radiotap header (0 = combined rssi only)
+	:return: number of frames written
+	"""
+
+	dataframe = generate_frames_dataframe(**kwargs)
+	random_state = np.random.RandomState(kwargs.get('seed', 0))
+
+	if os.path.splitext(filepath)[1] == '.pcapng':
+		write_header, write_record = write_pcapng_header, write_pcapng_record
+	else:
+		write_header, write_record = write_pcap_header, write_pcap_record
+
+	columns = ['frame.time_epoch', 'wlan.ra', 'wlan.ta', 'wlan.sa', 'wlan.da', 'wlan_mgt.fixed.status_code',
+	           'wlan.fc.type_subtype', 'wlan.fc.retry', 'wlan.fc.pwrmgt', 'radiotap.dbm_antsignal', ]
+	chain_offsets = random_state.randint(-6, 4, (len(dataframe), n_chains))
+	sequence_numbers = dict()
+	# every beacon transmitter is an access point
+	access_points = set(dataframe['wlan.ta'][dataframe['wlan.fc.type_subtype'] == 8].unique())
+
+	with open(filepath, 'wb') as file:
+		write_header(file)
+		for idx, (epoch, ra, ta, sa, da, status_code, subtype, retry, pwrmgt, rssi) in enumerate(
+				zip(*[dataframe[column].values for column in columns])):
+			sequence_number = sequence_numbers.get(ta, 0)
+			sequence_numbers[ta] = sequence_number + 1
+
+			chain_rssis = [max(-127, min(0, int(rssi) + int(offset))) for offset in chain_offsets[idx]]
+			packet = build_radiotap_header(int(rssi), chain_rssis) + build_80211_frame(
+				int(subtype), ra, ta, sa, da, int(retry), int(pwrmgt), status_code, sequence_number, ta in access_points)
+			write_record(file, float(epoch), packet)
+
+	return len(dataframe)
+
+
+def define_command_line_parser():
+	arg_parser = argparse.ArgumentParser(description = 'Generate a synthetic monitor mode capture file.')
+	arg_parser.add_argument('outfile', action = 'store', help = 'path to the output `.pcap` or `.pcapng` file')
+	arg_parser.add_argument('--chains', action = 'store', dest = 'n_chains', type = int, default = 2)
+	arg_parser.add_argument('--clients', action = 'store', dest = 'n_clients', type = int, default = 10)
+	arg_parser.add_argument('--access-points', action = 'store', dest = 'n_access_points', type = int, default = 3)
+	arg_parser.add_argument('--duration', action = 'store', dest = 'duration', type = float, default = 600.0)
+	arg_parser.add_argument('--probe-burst-period', action = 'store', dest = 'probe_burst_period', type = float,
+	                        default = 60.0)
+	arg_parser.add_argument('--beacon-rate', action = 'store', dest = 'beacon_rate', type = float, default = 9.765625)
+	arg_parser.add_argument('--data-rate', action = 'store', dest = 'data_rate', type = float, default = 5.0)
+	arg_parser.add_argument('--null-ratio', action = 'store', dest = 'null_ratio', type = float, default = 0.2)
+	arg_parser.add_argument('--ack-ratio', action = 'store', dest = 'ack_ratio', type = float, default = 0.9)
+	arg_parser.add_argument('--retry-ratio', action = 'store', dest = 'retry_ratio', type = float, default = 0.1)
+	arg_parser.add_argument('--deauth-rate', action = 'store', dest = 'deauth_rate', type = float, default = 0.2)
+	arg_parser.add_argument('--association-rate', action = 'store', dest = 'association_rate', type = float,
+	                        default = 0.5)
+	arg_parser.add_argument('--seed', action = 'store', dest = 'seed', type = int, default = 0)
+	return arg_parser
+
+
+if __name__ == '__main__':
+	_args = vars(define_command_line_parser().parse_args())
+	_outfile = os.path.abspath(_args.pop('outfile'))
+	_n_frames = write_capture_file(_outfile, **_args)
+	print('• {:d} frames written to {:s}'.format(_n_frames, _outfile))
@@ -0,0 +1,198 @@
+"""
+Generates synthetic frames csv files in the exact format produced by `convert_pcaps_to_frames_csv`
+(and read by `convert_frames_to_episodes.read_frames_csv_file`).
+
+The capture is modelled as a set of access points sending beacons and a set of clients that
+	- send probe request bursts periodically (active scanning episodes)
+	- exchange data / null frames with an access point (acknowledged with ack frames, some retried)
+	- receive / send deauthentication frames
+	- receive (re)association responses (successful or failed)
+
+Can be used to create reproducible inputs for benchmarking when real captures can not be shared.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from preprocessor.convert_pcaps_to_frames_csv import prepare_and_get_command_format_string, \
+	prepare_and_get_csv_header
+
+broadcast_mac = 'ff:ff:ff:ff:ff:ff'
+
+
+def get_frames_csv_header():
+	"""
+	Returns the column names of a frames csv file (same as the csv files created from the captures)
+	"""
+
+	header_string = prepare_and_get_csv_header(prepare_and_get_command_format_string())
+	return header_string.strip().split(',')
+
+
+def get_client_mac_addresses(n_clients: int):
+	return ['02:00:00:00:{:02x}:{:02x}'.format(idx // 256, idx % 256) for idx in range(n_clients)]
+
+
+def get_access_point_mac_addresses(n_access_points: int):
+	return ['06:00:00:00:{:02x}:{:02x}'.format(idx // 256, idx % 256) for idx in range(n_access_points)]
+
+
+def __poisson_epochs(random_state, rate, start_epoch, duration):
+	"""
+	Epochs of a poisson process with `rate` events per second in [start_epoch, start_epoch + duration)
+	"""
+
+	n_events = random_state.poisson(rate * duration)
+	return np.sort(start_epoch + random_state.uniform(0, duration, n_events))
+
+
+def generate_frames_dataframe(n_clients: int = 10, n_access_points: int = 3, duration: float = 600.0,
+                              probe_burst_period: float = 60.0, probes_per_burst: int = 8,
+                              beacon_rate: float = 9.765625, data_rate: float = 5.0, null_ratio: float = 0.2,
+                              ack_ratio: float = 0.9, retry_ratio: float = 0.1, deauth_rate: float = 0.2,
+                              association_rate: float = 0.5, association_failure_ratio: float = 0.2,
+                              start_epoch: float = 1514764800.0, seed: int = 0):
+	"""
+	Creates a dataframe of synthetic frames with the columns of a frames csv file, sorted by `frame.time_epoch`.
+
+	:param n_clients: number of clients
+	:param n_access_points: number of access points (each client is associated with one of them)
+	:param duration: duration of the capture in seconds
+	:param probe_burst_period: mean interval (seconds) between two probe request bursts of a client
+	:param probes_per_burst: number of probe requests in a burst
+	:param beacon_rate: beacons per second per access point (default = 102.4ms beacon interval)
+	:param data_rate: data and null frames per second per client
+	:param null_ratio: fraction of the data frames that are null / qos null frames
+	:param ack_ratio: fraction of the data frames that are acknowledged
+	:param retry_ratio: fraction of the data frames with the retry bit set
+	:param deauth_rate: deauthentication frames per minute per client
+	:param association_rate: (re)association responses per minute per client
+	:param association_failure_ratio: fraction of (re)association responses with a non zero status code
+	:param start_epoch: epoch of the first frame
+	:param seed: seed for the random number generator
+	:return: dataframe object
+	"""
+
+	random_state = np.random.RandomState(seed)
+	clients = get_client_mac_addresses(n_clients)
+	access_points = get_access_point_mac_addresses(n_access_points)
+
+	# columns of the output, filled per frame kind and concatenated at the end
+	parts = list()
+
+	def __add_frames(epochs, ra, ta, sa, da, subtype, retry = 0, pwrmgt = 0, status_code = np.nan, rssi = -60.0):
+		n_frames = len(epochs)
+		if n_frames == 0:
+			return
+
+		part = pd.DataFrame({
+			'frame.time_epoch': np.round(epochs, 6),
+			'wlan.ra': ra,
+			'wlan.ta': ta,
+			'wlan.sa': sa,
+			'wlan.da': da,
+			'wlan_mgt.fixed.status_code': status_code,
+			'wlan.fc.type_subtype': subtype,
+			'wlan.fc.retry': retry,
+			'wlan.fc.pwrmgt': pwrmgt,
+			'radiotap.dbm_antsignal': np.round(rssi + random_state.normal(0, 4, n_frames)).astype(int),
+		})
+		parts.append(part)
+
+	# 1. beacons
+	beacon_interval = 1.0 / beacon_rate
+	for ap_idx, ap in enumerate(access_points):
+		n_beacons = int(duration * beacon_rate)
+		epochs = start_epoch + random_state.uniform(0, beacon_interval) + np.arange(n_beacons) * beacon_interval
+		__add_frames(epochs, broadcast_mac, ap, ap, broadcast_mac, 8, rssi = -50.0 - 10 * ap_idx)
+
+	for client_idx, client in enumerate(clients):
+		ap = access_points[client_idx % n_access_points]
+		client_rssi = float(random_state.uniform(-85, -40))
+
+		# 2. probe request bursts
+		n_bursts = max(1, int(duration / probe_burst_period))
+		burst_starts = start_epoch + np.sort(random_state.uniform(0, duration, n_bursts))
+		epochs = (burst_starts[:, np.newaxis] +
+		          np.cumsum(random_state.uniform(0.005, 0.04, (n_bursts, probes_per_burst)), axis = 1)).ravel()
+		__add_frames(epochs, broadcast_mac, client, client, broadcast_mac, 4, rssi = client_rssi)
+
+		# 3. data, null and ack frames
+		epochs = __poisson_epochs(random_state, data_rate, start_epoch, duration)
+		n_frames = len(epochs)
+		uplink = random_state.uniform(size = n_frames) < 0.5
+		null = uplink & (random_state.uniform(size = n_frames) < null_ratio)
+		subtype = np.where(null, random_state.choice([36, 44], n_frames), random_state.choice([32, 40], n_frames))
+		retry = (random_state.uniform(size = n_frames) < retry_ratio).astype(int)
+		pwrmgt = (null & (random_state.uniform(size = n_frames) < 0.5)).astype(int)
+		transmitter = np.where(uplink, client, ap)
+		receiver = np.where(uplink, ap, client)
+		__add_frames(epochs, receiver, transmitter, transmitter, receiver, subtype, retry = retry, pwrmgt = pwrmgt,
+		             rssi = client_rssi)
+
+		# acks are sent back to the transmitter of the data frame (ack frames only have a receiver address)
+		acked = random_state.uniform(size = n_frames) < ack_ratio
+		__add_frames(epochs[acked] + 0.00005, transmitter[acked], np.nan, np.nan, np.nan, 29, rssi = client_rssi)
+
+		# 4. deauthentication frames (half of them from the access point)
+		epochs = __poisson_epochs(random_state, deauth_rate / 60.0, start_epoch, duration)
+		from_ap = random_state.uniform(size = len(epochs)) < 0.5
+		transmitter = np.where(from_ap, ap, client)
+		receiver = np.where(from_ap, client, ap)
+		__add_frames(epochs, receiver, transmitter, transmitter, receiver, 12, rssi = client_rssi)
+
+		# 5. (re)association responses
+		epochs = __poisson_epochs(random_state, association_rate / 60.0, start_epoch, duration)
+		n_frames = len(epochs)
+		status_code = np.where(random_state.uniform(size = n_frames) < association_failure_ratio, 17, 0)
+		__add_frames(epochs, client, ap, ap, client, random_state.choice([1, 3], n_frames), status_code = status_code,
+		             rssi = client_rssi)
+
+	dataframe = pd.concat(parts, ignore_index = True)
+	dataframe.sort_values(by = 'frame.time_epoch', axis = 0, ascending = True, inplace = True, kind = 'mergesort')
+
+	# the extra rssi columns (MIMO chains) are not generated
+	for column in get_frames_csv_header():
+		if column not in dataframe.columns:
+			dataframe[column] = np.nan
+	return dataframe[get_frames_csv_header()]
+
+
+def write_frames_csv_file(filepath, **kwargs):
+	"""
+	Writes a synthetic frames csv file. See `generate_frames_dataframe` for the arguments.
+	Returns the number of frames written.
+	"""
+
+	dataframe = generate_frames_dataframe(**kwargs)
+	dataframe.to_csv(filepath, sep = ',', index = False, header = True)
+	return len(dataframe)
+
+
+def define_command_line_parser():
+	arg_parser = argparse.ArgumentParser(description = 'Generate a synthetic frames csv file.')
+	arg_parser.add_argument('outfile', action = 'store', help = 'path to the output csv file')
+	arg_parser.add_argument('--clients', action = 'store', dest = 'n_clients', type = int, default = 10)
+	arg_parser.add_argument('--access-points', action = 'store', dest = 'n_access_points', type = int, default = 3)
+	arg_parser.add_argument('--duration', action = 'store', dest = 'duration', type = float, default = 600.0)
+	arg_parser.add_argument('--probe-burst-period', action = 'store', dest = 'probe_burst_period', type = float,
+	                        default = 60.0)
+	arg_parser.add_argument('--beacon-rate', action = 'store', dest = 'beacon_rate', type = float, default = 9.765625)
+	arg_parser.add_argument('--data-rate', action = 'store', dest = 'data_rate', type = float, default = 5.0)
+	arg_parser.add_argument('--ack-ratio', action = 'store', dest = 'ack_ratio', type = float, default = 0.9)
+	arg_parser.add_argument('--retry-ratio', action = 'store', dest = 'retry_ratio', type = float, default = 0.1)
+	arg_parser.add_argument('--deauth-rate', action = 'store', dest = 'deauth_rate', type = float, default = 0.2)
+	arg_parser.add_argument('--association-rate', action = 'store', dest = 'association_rate', type = float,
+	                        default = 0.5)
+	arg_parser.add_argument('--seed', action = 'store', dest = 'seed', type = int, default = 0)
+	return arg_parser
+
+
+if __name__ == '__main__':
+	_args = vars(define_command_line_parser().parse_args())
+	_outfile = os.path.abspath(_args.pop('outfile'))
+	_n_frames = write_frames_csv_file(_outfile, **_args)
+	print('• {:d} frames written to {:s}'.format(_n_frames, _outfile))
@@ -0,0 +1,80 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from preprocessor.association_index import AssociationIndex
+from preprocessor.convert_frames_to_episodes import filter_client_frames
+
+client = '02:00:00:00:00:0c'
+other_client = '02:00:00:00:00:0d'
+access_point_a = 'aa:00:00:00:00:0a'
+access_point_b = 'bc:00:00:00:00:0b'
+broadcast = 'ff:ff:ff:ff:ff:ff'
+
+
+def make_frames(frames):
+	"""
+	Frames dataframe from (epoch, type_subtype, receiver, transmitter, status code) tuples
+	"""
+
+	dataframe = pd.DataFrame(frames, columns = ['frame.time_epoch', 'wlan.fc.type_subtype', 'wlan.ra', 'wlan.ta',
+	                                            'wlan_mgt.fixed.status_code', ])
+	dataframe['wlan.sa'] = dataframe['wlan.ta']
+	dataframe['wlan.da'] = dataframe['wlan.ra']
+	return dataframe
+
+
+class AssociationIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		self.frames = make_frames([
+			(1.0, 8, broadcast, access_point_a, np.nan),
+			(2.0, 8, broadcast, access_point_b, np.nan),
+			# associated with a
+			(3.0, 1, client, access_point_a, 0),
+			(4.0, 8, broadcast, access_point_a, np.nan),
+			(5.0, 8, broadcast, access_point_b, np.nan),
+			# data frame to b: associated with b
+			(6.0, 32, access_point_b, client, np.nan),
+			(7.0, 8, broadcast, access_point_a, np.nan),
+			# multicast data frame: not an access point
+			(7.5, 32, '01:00:5e:00:00:01', client, np.nan),
+			(8.0, 8, broadcast, access_point_b, np.nan),
+			# deauthentication: unassociated
+			(9.0, 12, access_point_b, client, np.nan),
+			(10.0, 8, broadcast, access_point_a, np.nan),
+			# failed association response
+			(10.5, 1, client, access_point_b, 17),
+			(11.0, 8, broadcast, access_point_b, np.nan),
+		])
+		self.index = AssociationIndex(self.frames, [client, other_client, ])
+
+	def test_serving_access_points(self):
+		start_epochs, access_points = self.index.get_serving_access_points(client)
+
+		np.testing.assert_array_equal(start_epochs, [3.0, 6.0, 9.0])
+		self.assertEqual(list(access_points), [access_point_a, access_point_b, None])
+		self.assertEqual(len(self.index.get_serving_access_points(other_client)[0]), 0)
+
+	def test_beacons_of_the_serving_access_point(self):
+		beacons = self.frames['frame.time_epoch'][self.index.get_client_beacon_mask(client)]
+
+		# all the beacons while unassociated
+		self.assertEqual(beacons.tolist(), [1.0, 2.0, 4.0, 8.0, 10.0, 11.0])
+		np.testing.assert_array_equal(self.index.get_client_beacon_mask(other_client),
+		                              self.frames['wlan.fc.type_subtype'].values == 8)
+
+	def test_filter_client_frames(self):
+		all_beacons = filter_client_frames(self.frames, client)
+		serving_beacons = filter_client_frames(self.frames, client, association_index = self.index)
+
+		self.assertEqual(len(all_beacons), len(self.frames))
+		self.assertEqual(serving_beacons['frame.time_epoch'].tolist(),
+		                 [1.0, 2.0, 3.0, 4.0, 6.0, 7.5, 8.0, 9.0, 10.0, 10.5, 11.0])
+		with self.assertRaises(ValueError):
+			filter_client_frames(self.frames.iloc[1:], client, association_index = self.index)
+
+
+if __name__ == '__main__':
+	unittest.main()
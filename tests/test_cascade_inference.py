@@ -0,0 +1,84 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from machine_learning.aux.constants import get_processed_data_file_header_segregation
+from machine_learning.aux.persist import save_model
+from machine_learning.cascade_model import CascadeModel, stage_1, stage_2
+from machine_learning.preprocessing.classifier_stage_2 import prepare_dataset
+
+
+class StreamingCascadeInferenceTest(unittest.TestCase):
+
+	def setUp(self):
+		self.scratch_dir = tempfile.mkdtemp(prefix = 'cascade_inference_test_')
+		self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors = True)
+
+		# episodes, stage 1 labels (0, 1: periodic scans) and stage 2 labels learned from the first features
+		self.feature_set, self.extra_properties = get_processed_data_file_header_segregation(for_training = False)
+		rng = np.random.RandomState(0)
+		n_rows = 3000
+		self.dataframe = pd.DataFrame({column: rng.randint(0, 100, n_rows) for column in self.feature_set})
+		self.dataframe[self.extra_properties[0]] = ['episode_{:d}'.format(idx) for idx in range(n_rows)]
+		self.infile = os.path.join(self.scratch_dir, 'episodes.csv')
+		self.dataframe.to_csv(self.infile, index = False)
+
+		x = self.dataframe[self.feature_set].values.astype(float)
+		self.stage_1_model = RandomForestClassifier(5, random_state = 0).fit(x, (x[:, 0] // 34).astype(float))
+		self.stage_2_model = RandomForestClassifier(5, random_state = 0).fit(x, (x[:, 1] // 17).astype(float))
+		self.stage_1_file = os.path.join(self.scratch_dir, 'stage_1.pkl')
+		self.stage_2_file = os.path.join(self.scratch_dir, 'stage_2.pkl')
+		with contextlib.redirect_stdout(io.StringIO()):
+			save_model(self.stage_1_model, self.stage_1_file)
+			save_model(self.stage_2_model, self.stage_2_file)
+		self.stage_1_labels = self.stage_1_model.predict(x)
+		self.stage_2_labels = self.stage_2_model.predict(x)
+		self.pscan = np.isin(self.stage_1_labels, [0, 1])
+
+	def test_pscan_filter_keeps_the_other_rows_in_order(self):
+		outputs = list()
+		for chunksize in [777, 100000, ]:
+			outfile = os.path.join(self.scratch_dir, 'reduced_{:d}.csv'.format(chunksize))
+			with contextlib.redirect_stdout(io.StringIO()):
+				prepare_dataset.identify_pscans_using_stage_1_classifier(self.infile, outfile, self.stage_1_file,
+				                                                         for_training = False, chunksize = chunksize)
+			outputs.append(pd.read_csv(outfile))
+
+		self.assertGreater(np.count_nonzero(self.pscan), 0)
+		pd.testing.assert_frame_equal(outputs[0], self.dataframe[~self.pscan].reset_index(drop = True))
+		pd.testing.assert_frame_equal(outputs[1], outputs[0])
+
+	def test_fused_inference_is_stage_1_then_stage_2(self):
+		outfile = os.path.join(self.scratch_dir, 'causes.csv')
+		with contextlib.redirect_stdout(io.StringIO()):
+			prepare_dataset.predict_causes_using_cascade(self.infile, outfile, self.stage_1_file, self.stage_2_file,
+			                                             chunksize = 1000)
+		output_df = pd.read_csv(outfile)
+
+		# every episode, in order
+		self.assertEqual(output_df[self.extra_properties[0]].tolist(),
+		                 self.dataframe[self.extra_properties[0]].tolist())
+		np.testing.assert_array_equal(output_df['prediction__stage'], np.where(self.pscan, stage_1, stage_2))
+		np.testing.assert_array_equal(output_df['prediction__label'],
+		                              np.where(self.pscan, self.stage_1_labels, self.stage_2_labels))
+		self.assertEqual(set(output_df['prediction__name'][self.pscan]), {'pscan_unassoc', 'pscan_assoc', })
+
+		# the same output from a saved cascade model
+		cascade_file = os.path.join(self.scratch_dir, 'cascade.pkl')
+		cascade_outfile = os.path.join(self.scratch_dir, 'cascade_causes.csv')
+		with contextlib.redirect_stdout(io.StringIO()):
+			CascadeModel.from_model_files(self.stage_1_file, self.stage_2_file).save(cascade_file)
+			prepare_dataset.predict_causes_using_cascade(self.infile, cascade_outfile, cascade_file, None,
+			                                             chunksize = 999)
+		pd.testing.assert_frame_equal(pd.read_csv(cascade_outfile), output_df)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,133 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+from machine_learning.aux import constants
+from machine_learning.aux.constants import get_processed_data_file_header_segregation
+from machine_learning.cascade_model import CascadeModel, count_gating, get_gating_report, load_cascade_model, \
+	other_causes_name, rbs_rules_stage, stage_1, stage_2
+from machine_learning.preprocessing.classifier_stage_1.prepare_dataset import \
+	get_training_labels as get_stage_1_training_labels
+from machine_learning.preprocessing.classifier_stage_2.prepare_dataset import \
+	get_training_labels as get_stage_2_training_labels
+
+
+class CascadeModelTest(unittest.TestCase):
+
+	def setUp(self):
+		self.scratch_dir = tempfile.mkdtemp(prefix = 'cascade_model_test_')
+		self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors = True)
+
+		# stage 1 labels (0, 1: periodic scans) and stage 2 labels learned from the first features
+		feature_set, _ = get_processed_data_file_header_segregation(for_training = False)
+		rng = np.random.RandomState(0)
+		self.x = rng.randint(0, 100, (2000, len(feature_set))).astype(float)
+		self.stage_1_model = RandomForestClassifier(5, random_state = 0).fit(self.x, self.x[:, 0] // 34)
+		self.stage_2_model = RandomForestClassifier(5, random_state = 0).fit(self.x, self.x[:, 1] // 17)
+		self.model = CascadeModel(self.stage_1_model, self.stage_2_model, get_stage_1_training_labels(),
+		                          get_stage_2_training_labels())
+		self.rbs_tags = rng.choice(['d', 'h', 'ab', None, 'i'], len(self.x))
+
+	def test_predict_stages(self):
+		stages, labels, names = self.model.predict_stages(self.x)
+
+		stage_1_labels = self.stage_1_model.predict(self.x)
+		pscan = np.isin(stage_1_labels, [0, 1])
+		np.testing.assert_array_equal(stages, np.where(pscan, stage_1, stage_2))
+		np.testing.assert_array_equal(labels, np.where(pscan, stage_1_labels, self.stage_2_model.predict(self.x)))
+		stage_2_names = {label: cause.name for cause, label in get_stage_2_training_labels().items()}
+		self.assertEqual(names[~pscan].tolist(), [stage_2_names[label] for label in labels[~pscan]])
+		self.assertEqual(set(names[pscan]), {'pscan_unassoc', 'pscan_assoc', })
+
+		# by batches
+		for arrays, batch_arrays in zip((stages, labels, names), self.model.predict_stages(self.x, batch_size = 333)):
+			np.testing.assert_array_equal(batch_arrays, arrays)
+
+	def test_save_and_load(self):
+		self.model.set_gating(stage_1_threshold = 0.8, rbs_rules = {'d': constants.ASCause.lrssi, })
+		filepath = os.path.join(self.scratch_dir, 'cascade.pkl')
+		with contextlib.redirect_stdout(io.StringIO()):
+			self.model.save(filepath)
+		loaded_model = load_cascade_model(filepath)
+
+		self.assertEqual(loaded_model.stage_1_threshold, 0.8)
+		np.testing.assert_array_equal(loaded_model.predict(self.x, rbs_tags = self.rbs_tags),
+		                              self.model.predict(self.x, rbs_tags = self.rbs_tags))
+
+	def test_predict_proba(self):
+		proba = self.model.predict_proba(self.x, batch_size = 500)
+
+		self.assertEqual(proba.shape, (len(self.x), len(self.model.get_cause_names())))
+		np.testing.assert_allclose(proba.sum(axis = 1), 1.0)
+		np.testing.assert_array_equal(proba, self.model.predict_proba(self.x))
+
+	def test_rule_gate(self):
+		self.model.set_gating(rbs_rules = {'d': constants.ASCause.lrssi, 'h': constants.ASCause.bl, })
+
+		stages, labels, names = self.model.predict_stages(self.x, rbs_tags = self.rbs_tags)
+
+		ruled = np.isin(self.rbs_tags, ['d', 'h', ])
+		np.testing.assert_array_equal(stages[ruled], rbs_rules_stage)
+		np.testing.assert_array_equal(labels[ruled], -1)
+		self.assertEqual(names[ruled].tolist(),
+		                 ['lrssi' if tags == 'd' else 'bl' for tags in self.rbs_tags[ruled]])
+		# the other episodes are predicted as without the gate
+		ungated = self.model.predict_stages(self.x, rbs_tags = self.rbs_tags, gating = False)
+		for arrays, ungated_arrays in zip((stages, labels, names), ungated):
+			np.testing.assert_array_equal(arrays[~ruled], ungated_arrays[~ruled])
+
+		# the rule settles the probabilities
+		proba = self.model.predict_proba(self.x, rbs_tags = self.rbs_tags)
+		cause_names = self.model.get_cause_names()
+		np.testing.assert_array_equal(proba[ruled].argmax(axis = 1), [cause_names.index(name) for name in names[ruled]])
+		np.testing.assert_array_equal(proba[ruled].max(axis = 1), 1.0)
+
+	def test_confidence_gate_only_saves_stage_2_work(self):
+		_, _, ungated_names = self.model.predict_stages(self.x)
+		n_stage_2 = list()
+		for threshold in [0.99, 0.8, 0.5, ]:
+			self.model.set_gating(stage_1_threshold = threshold)
+			stages, _, names = self.model.predict_stages(self.x)
+			n_stage_2.append(np.count_nonzero(stages == stage_2))
+
+			# confident non periodic scans exit at stage 1 without a cause, the other predictions don't change
+			exits = names == other_causes_name
+			np.testing.assert_array_equal(stages[exits], stage_1)
+			np.testing.assert_array_equal(names[~exits], ungated_names[~exits])
+
+		self.assertEqual(n_stage_2, sorted(n_stage_2, reverse = True))
+		ungated_stages, _, _ = self.model.predict_stages(self.x, gating = False)
+		self.assertLess(n_stage_2[-1], np.count_nonzero(ungated_stages == stage_2))
+
+	def test_gating_report(self):
+		self.model.set_gating(stage_1_threshold = 0.8, rbs_rules = {'d': constants.ASCause.lrssi, })
+		_, _, true_names = self.model.predict_stages(self.x, gating = False)
+
+		report = self.model.evaluate_gating(self.x, rbs_tags = self.rbs_tags, true_names = true_names)
+
+		self.assertAlmostEqual(report['rbs_rules_hit_rate'], np.mean(self.rbs_tags == 'd'))
+		self.assertEqual(report['accuracy_without_gating'], 1.0)
+		self.assertAlmostEqual(report['accuracy_delta'], report['accuracy'] - 1.0)
+		self.assertAlmostEqual(report['stage_2_load_saved'],
+		                       report['stage_2_rate_without_gating'] - report['stage_2_rate'])
+		self.assertAlmostEqual(report['stage_1_exit_rate'] + report['stage_2_rate'] + report['rbs_rules_hit_rate'], 1.0)
+
+		# counts summed over batches give the same report
+		counts = dict()
+		for idx in range(0, len(self.x), 300):
+			gated = self.model.predict_stages(self.x[idx:idx + 300], rbs_tags = self.rbs_tags[idx:idx + 300])
+			ungated = self.model.predict_stages(self.x[idx:idx + 300], rbs_tags = self.rbs_tags[idx:idx + 300],
+			                                    gating = False)
+			batch_counts = count_gating(gated[0], gated[2], ungated[0], ungated[2], true_names[idx:idx + 300])
+			counts = {key: counts.get(key, 0) + value for key, value in batch_counts.items()}
+		self.assertEqual(get_gating_report(counts), report)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,95 @@
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from preprocessor import compression
+from preprocessor.convert_frames_to_episodes import process_frame_csv_file
+from preprocessor.synthetic_frames import write_frames_csv_file
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+
+class CompressionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.scratch_dir = tempfile.mkdtemp(prefix = 'compression_test_')
+		self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors = True)
+		rng = np.random.RandomState(0)
+		self.chunks = [pd.DataFrame({'frame.time_epoch': rng.uniform(0, 100, 50), 'wlan.ta': 'aa:bb:cc:00:00:01'})
+		               for _ in range(3)]
+
+	def test_extensions(self):
+		self.assertEqual(compression.split_extension('capture.csv.gz'), ('capture', '.csv.gz'))
+		self.assertEqual(compression.split_extension('capture.csv'), ('capture', '.csv'))
+		self.assertTrue(compression.is_csv_file('capture.csv.zst'))
+		self.assertFalse(compression.is_csv_file('capture.pcap.gz'))
+		self.assertEqual([compression.get_compression(name) for name in ['a.csv', 'a.csv.gz', 'a.csv.zst', ]],
+		                 [None, 'gzip', 'zstd'])
+
+	def assert_appended_parts_round_trip(self, filepath):
+		for idx, chunk in enumerate(self.chunks):
+			chunk.to_csv(filepath, mode = 'a', index = False, header = idx == 0,
+			             compression = compression.get_to_csv_compression(filepath))
+
+		pd.testing.assert_frame_equal(pd.read_csv(filepath), pd.concat(self.chunks, ignore_index = True))
+
+	def test_appended_gzip_parts_are_read_as_one_file(self):
+		filepath = os.path.join(self.scratch_dir, 'frames.csv.gz')
+		self.assert_appended_parts_round_trip(filepath)
+		with gzip.open(filepath) as f:
+			self.assertTrue(f.readline().startswith(b'frame.time_epoch'))
+
+	@unittest.skipIf(zstandard is None, 'zstandard is not installed')
+	def test_appended_zstd_parts_are_read_as_one_file(self):
+		self.assert_appended_parts_round_trip(os.path.join(self.scratch_dir, 'frames.csv.zst'))
+
+	def test_output_stream(self):
+		for extension in ['.csv', '.csv.gz', ] + (['.csv.zst', ] if zstandard is not None else []):
+			filepath = os.path.join(self.scratch_dir, 'output' + extension)
+			with compression.open_output_stream(filepath, compression.get_compression(filepath)) as output:
+				for idx, chunk in enumerate(self.chunks):
+					output.write(chunk.to_csv(index = False, header = idx == 0).encode())
+
+			pd.testing.assert_frame_equal(pd.read_csv(filepath), pd.concat(self.chunks, ignore_index = True))
+
+	def test_compressed_frames_csv_file_gives_compressed_outputs(self):
+		frames_dir = os.path.join(self.scratch_dir, 'frames')
+		os.mkdir(frames_dir)
+		write_frames_csv_file(os.path.join(frames_dir, 'capture.csv'), n_clients = 2, duration = 300.0, seed = 2)
+		with open(os.path.join(frames_dir, 'capture.csv'), 'rb') as source:
+			with gzip.open(os.path.join(frames_dir, 'capture.csv.gz'), 'wb') as target:
+				shutil.copyfileobj(source, target)
+
+		outputs = list()
+		for name in ['capture.csv', 'capture.csv.gz', ]:
+			run_dir = os.path.join(self.scratch_dir, name)
+			for directory in ['semi_processed', 'processed', ]:
+				os.makedirs(os.path.join(run_dir, directory))
+			with contextlib.redirect_stdout(io.StringIO()):
+				process_frame_csv_file(name, access_points = None, clients = None, assign_rbs_tags = True,
+				                       separate_client_files = False,
+				                       mapping_file = os.path.join(run_dir, 'mapping.csv'), frames_csv_dir = frames_dir,
+				                       semi_processed_dir = os.path.join(run_dir, 'semi_processed'),
+				                       processed_dir = os.path.join(run_dir, 'processed'))
+			self.assertEqual(os.listdir(os.path.join(run_dir, 'processed')), [name, ])
+			semi_processed_name = os.listdir(os.path.join(run_dir, 'semi_processed'))[0]
+			self.assertEqual(compression.split_extension(semi_processed_name)[1],
+			                 compression.split_extension(name)[1])
+			episodes_df = pd.read_csv(os.path.join(run_dir, 'processed', name))
+			outputs.append(episodes_df.drop(columns = ['frames_file__uuid', ]))
+
+		pd.testing.assert_frame_equal(outputs[1], outputs[0])
+
+
+if __name__ == '__main__':
+	unittest.main()
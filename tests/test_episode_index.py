@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from preprocessor.episode_index import EpisodeIndex, get_episode_key_columns
+
+client = 'aa:bb:cc:00:00:01'
+other_client = 'aa:bb:cc:00:00:02'
+
+
+def make_episodes(uuid, the_client, start_epochs, rbs_tags = None):
+	dataframe = pd.DataFrame({
+		'frames_file__uuid': uuid,
+		'associated_client__mac': the_client,
+		'episode__id': np.arange(len(start_epochs)),
+		'start__time_epoch': np.asarray(start_epochs, dtype = float),
+		'end__time_epoch': np.asarray(start_epochs, dtype = float) + 2.0,
+	})
+	if rbs_tags is not None:
+		dataframe['rbs__cause_tags'] = rbs_tags
+	return dataframe
+
+
+class EpisodeIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		self.scratch_dir = tempfile.mkdtemp(prefix = 'episode_index_test_')
+		self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors = True)
+		self.filepath = os.path.join(self.scratch_dir, 'index.sqlite')
+		self.episodes_df = make_episodes('uuid-1', client, [100.0, 200.0, 300.0], rbs_tags = ['ab', np.nan, 'd'])
+		self.other_episodes_df = make_episodes('uuid-1', other_client, [150.0, 250.0])
+
+	def test_round_trip(self):
+		with EpisodeIndex(self.filepath) as index:
+			self.assertEqual(index.add_episodes(self.episodes_df, source = 'capture.csv'), 3)
+			index.add_episodes(self.other_episodes_df, source = 'capture.csv')
+			index.add_predictions(self.episodes_df[get_episode_key_columns()], [0, 4, 1], stage = 2,
+			                      names = ['apsp', 'lrssi', 'bl'], model_file = 'stage_2.pkl')
+
+		# the index is persistent
+		with EpisodeIndex(self.filepath) as index:
+			episodes_df = index.find_episodes(client = client)
+			self.assertEqual(episodes_df['episode__id'].tolist(), [0, 1, 2])
+			self.assertEqual(episodes_df['prediction__name'].tolist(), ['apsp', 'lrssi', 'bl'])
+			self.assertEqual(episodes_df['source'].tolist(), ['capture.csv', ] * 3)
+			self.assertEqual(episodes_df['rbs__cause_tags'].tolist(), ['ab', None, 'd'])
+
+			# time range: the episodes overlapping it
+			self.assertEqual(index.find_episodes(start = 201.0, end = 260.0)['start__time_epoch'].tolist(),
+			                 [200.0, 250.0])
+			self.assertEqual(index.find_episodes(rbs_tag = 'd')['episode__id'].tolist(), [2, ])
+			self.assertEqual(index.count_causes(client = client, stage = 2), {'apsp': 1, 'lrssi': 1, 'bl': 1})
+			self.assertEqual(index.count_causes(client = other_client), {None: 2})
+
+	def test_indexing_again_replaces(self):
+		with EpisodeIndex(self.filepath) as index:
+			index.add_episodes(self.episodes_df)
+			index.add_episodes(self.episodes_df)
+			keys_df = self.episodes_df[get_episode_key_columns()]
+			index.add_predictions(keys_df, [0, 4, 1], stage = 2)
+			index.add_predictions(keys_df, [1, 1, 1], stage = 2, names = ['bl', ] * 3)
+
+			self.assertEqual(len(index.find_episodes()), 3)
+			self.assertEqual(index.count_causes(), {'bl': 3})
+
+	def test_stage_of_each_prediction(self):
+		with EpisodeIndex(self.filepath) as index:
+			index.add_episodes(self.episodes_df)
+			index.add_predictions(self.episodes_df[get_episode_key_columns()], [-1, 0, 3], stage = np.array([0, 1, 2]),
+			                      names = ['lrssi', 'pscan_unassoc', 'dfl'])
+
+			episodes_df = index.find_episodes(client = client)
+			self.assertEqual(episodes_df['stage'].tolist(), [0, 1, 2])
+			self.assertEqual(index.count_causes(stage = 1), {'pscan_unassoc': 1, None: 2})
+
+	def test_processed_csv_file(self):
+		filepath = os.path.join(self.scratch_dir, 'capture.csv')
+		self.episodes_df.assign(rssi__mean = -60.0).to_csv(filepath, index = False)
+
+		with EpisodeIndex(self.filepath) as index:
+			self.assertEqual(index.index_processed_csv_file(filepath), 3)
+			episodes_df = index.find_episodes(frames_file__uuid = 'uuid-1')
+		self.assertEqual(episodes_df['source'].tolist(), ['capture.csv', ] * 3)
+		self.assertEqual(episodes_df['rbs__cause_tags'].tolist(), ['ab', None, 'd'])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,68 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from preprocessor import episode_shards
+from preprocessor.convert_frames_to_episodes import filter_out_irrelevant_frames, find_all_client_mac_addresses, \
+	process_client_frames, read_frames_csv_file
+from preprocessor.pipelining import shutdown_process_pool
+from preprocessor.synthetic_frames import write_frames_csv_file
+
+
+class EpisodeShardsTest(unittest.TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		scratch_dir = tempfile.mkdtemp(prefix = 'episode_shards_test_')
+		try:
+			frames_csv_file = os.path.join(scratch_dir, 'capture.csv')
+			write_frames_csv_file(frames_csv_file, n_clients = 2, duration = 900.0, seed = 5)
+			main_dataframe = read_frames_csv_file(frames_csv_file)
+		finally:
+			shutil.rmtree(scratch_dir, ignore_errors = True)
+		cls.clients = find_all_client_mac_addresses(main_dataframe)
+		cls.main_dataframe = filter_out_irrelevant_frames(main_dataframe, cls.clients, None)
+
+	@classmethod
+	def tearDownClass(cls):
+		shutdown_process_pool()
+
+	def process(self, the_client, shard_duration = None):
+		with contextlib.redirect_stdout(io.StringIO()):
+			return process_client_frames(self.main_dataframe, the_client, 'uuid', shard_duration = shard_duration,
+			                             shard_workers = 2)
+
+	def test_sharded_episodes_are_the_unsharded_episodes(self):
+		for the_client in self.clients:
+			frames_df, episodes_df = self.process(the_client)
+			self.assertGreater(len(episodes_df), 10)
+			# short windows: most episodes cross a window boundary
+			for shard_duration in [7.0, 300.0, ]:
+				sharded_frames_df, sharded_episodes_df = self.process(the_client, shard_duration = shard_duration)
+				pd.testing.assert_frame_equal(sharded_episodes_df.reset_index(drop = True),
+				                              episodes_df.reset_index(drop = True))
+				pd.testing.assert_frame_equal(sharded_frames_df, frames_df)
+
+	def test_episode_ends(self):
+		probe_epochs = np.array([1.0, 1.5, 3.0, 3.2, 3.4, 10.0])
+
+		# the last probe request depends on the next ones
+		np.testing.assert_array_equal(episode_shards.find_episode_end_epochs(probe_epochs), [1.5, 3.4])
+
+	def test_shards_are_aligned_time_windows(self):
+		frames_df = pd.DataFrame({'frame.time_epoch': [3599.0, 3600.0, 3601.0, 7300.0, 11000.0]})
+
+		shards = episode_shards.split_into_shards(frames_df, 3600.0)
+
+		self.assertEqual([shard['frame.time_epoch'].tolist() for shard in shards],
+		                 [[3599.0, ], [3600.0, 3601.0, ], [7300.0, ], [11000.0, ]])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from machine_learning.aux.constants import get_processed_data_file_header_segregation
+from machine_learning.aux.episode_store import EpisodeStore, testing_split, training_split
+from preprocessor.convert_frames_to_episodes import get_processed_output_column_order
+
+
+class EpisodeStoreTest(unittest.TestCase):
+
+	def setUp(self):
+		self.scratch_dir = tempfile.mkdtemp(prefix = 'episode_store_test_')
+		self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors = True)
+		self.rng = np.random.RandomState(0)
+		self.store = EpisodeStore(os.path.join(self.scratch_dir, 'store'))
+
+	def write_processed_file(self, name, n_episodes, rbs_tags = None):
+		columns = get_processed_output_column_order(assign_rbs_tags = True)
+		dataframe = pd.DataFrame({column: self.rng.randint(0, 100, n_episodes) for column in columns})
+		for column in ['rssi__mean', 'rssi__sd', 'frame__frequency', 'frame__loss_rate', ]:
+			dataframe[column] = self.rng.uniform(0, 100, n_episodes)
+		dataframe['associated_client__mac'] = 'aa:bb:cc:00:00:01'
+		dataframe['frames_file__uuid'] = 'uuid-' + name
+		dataframe['rbs__cause_tags'] = rbs_tags if rbs_tags is not None else [np.nan, ] * n_episodes
+		filepath = os.path.join(self.scratch_dir, name)
+		dataframe.to_csv(filepath, index = False, columns = columns)
+		return pd.read_csv(filepath)
+
+	def test_round_trip(self):
+		first_df = self.write_processed_file('first.csv', 5, rbs_tags = ['ab', np.nan, 'd', np.nan, 'h'])
+		second_df = self.write_processed_file('second.csv', 3)
+		self.assertEqual(self.store.add_processed_csv_file(os.path.join(self.scratch_dir, 'first.csv'), training_split,
+		                                                   cause = 'bl'), 5)
+		self.store.add_processed_csv_file(os.path.join(self.scratch_dir, 'second.csv'), training_split, cause = 'ce')
+
+		expected_df = pd.concat([first_df, second_df], ignore_index = True)
+		dataframe = EpisodeStore(self.store.directory).read_dataframe(list(expected_df.columns))
+		pd.testing.assert_frame_equal(dataframe, expected_df, check_dtype = False)
+		# missing text values stay missing
+		self.assertEqual(dataframe['rbs__cause_tags'].isna().tolist(),
+		                 [False, True, False, True, False, True, True, True])
+
+	def test_partition_without_episodes(self):
+		self.write_processed_file('empty.csv', 0)
+		expected_df = self.write_processed_file('episodes.csv', 4)
+		for name in ['empty.csv', 'episodes.csv', ]:
+			self.store.add_processed_csv_file(os.path.join(self.scratch_dir, name), testing_split)
+
+		features_x, extra_z = self.store.read_dataset_as_np_arrays(for_training = False)
+
+		feature_set, extra_properties = get_processed_data_file_header_segregation(for_training = False)
+		self.assertEqual(features_x.dtype, np.float64)
+		np.testing.assert_array_equal(features_x, expected_df[feature_set].values.astype(np.float64))
+		np.testing.assert_array_equal(extra_z, expected_df[extra_properties].values)
+
+	def test_side_columns(self):
+		for name, n_episodes, cause in [('first.csv', 5, 'bl'), ('second.csv', 3, 'ce'), ]:
+			self.write_processed_file(name, n_episodes)
+			self.store.add_processed_csv_file(os.path.join(self.scratch_dir, name), training_split, cause = cause)
+		first, second = [partition['path'] for partition in self.store.partitions]
+
+		self.store.set_side_column('label', by_cause = {'bl': 1, 'ce': 2})
+		self.store.set_side_column('sample', per_episode = {first: np.array([1, 0, 1, 0, 1], dtype = bool)},
+		                           default = False)
+		self.store.set_side_column('score', per_episode = {first: np.arange(5), second: np.arange(3)})
+		values = self.store.read_columns(['label', 'sample', 'episode__id', ], mask_column = 'sample')
+		self.assertEqual(values['label'].tolist(), [1, 1, 1])
+		self.assertEqual(len(values['episode__id']), 3)
+
+		with self.assertRaises(ValueError):
+			self.store.set_side_column('score', per_episode = {first: np.arange(4)})
+
+		# replacing a partition drops its per episode values
+		self.store.add_processed_csv_file(os.path.join(self.scratch_dir, 'first.csv'), training_split, cause = 'bl',
+		                                  replace = True)
+		self.assertEqual(self.store.read_columns(['sample', ])['sample'].tolist(), [False, ] * 8)
+		with self.assertRaises(KeyError):
+			self.store.read_columns(['score', ])
+
+
+if __name__ == '__main__':
+	unittest.main()
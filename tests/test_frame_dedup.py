@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from preprocessor.frame_streams import FrameDeduplicator, frame_source_column, iter_frames_csv_chunks
+
+
+def make_frames(epochs, sources, transmitters = None, sequence_numbers = None):
+	n_frames = len(epochs)
+	dataframe = pd.DataFrame({
+		'frame.time_epoch': np.asarray(epochs, dtype = float),
+		'wlan.ta': transmitters if transmitters is not None else ['aa:bb:cc:00:00:01', ] * n_frames,
+		'wlan.ra': ['ff:ff:ff:ff:ff:ff', ] * n_frames,
+		'wlan.fc.type_subtype': [4, ] * n_frames,
+		'wlan.fc.retry': [0, ] * n_frames,
+		frame_source_column: sources,
+	})
+	if sequence_numbers is not None:
+		dataframe['wlan.seq'] = sequence_numbers
+	return dataframe
+
+
+def merge_sniffers(*dataframes):
+	return pd.concat(dataframes, ignore_index = True).sort_values(by = 'frame.time_epoch', kind = 'mergesort',
+	                                                              ignore_index = True)
+
+
+class FrameDeduplicatorTest(unittest.TestCase):
+
+	def setUp(self):
+		# one sniffer captures 100 frames, an overlapping sniffer captures 40 of them 0.3 ms later
+		rng = np.random.RandomState(0)
+		epochs = np.cumsum(rng.uniform(0.01, 0.5, 100)) + 1500000000.0
+		transmitters = ['aa:bb:cc:00:00:{:02x}'.format(idx % 7) for idx in range(100)]
+		sequence_numbers = np.arange(100) % 4096
+		self.sniffer_0 = make_frames(epochs, [0, ] * 100, transmitters, sequence_numbers)
+		copied = np.sort(rng.choice(100, 40, replace = False))
+		self.sniffer_1 = make_frames(epochs[copied] + 0.0003, [1, ] * 40, [transmitters[idx] for idx in copied],
+		                             sequence_numbers[copied])
+
+	def test_copies_of_other_sniffers_are_removed(self):
+		merged = merge_sniffers(self.sniffer_0, self.sniffer_1)
+		deduplicator = FrameDeduplicator(window = 0.002)
+
+		kept = deduplicator.filter_frames(merged)
+
+		self.assertEqual(deduplicator.n_frames, 140)
+		self.assertEqual(deduplicator.n_duplicates, 40)
+		self.assertEqual(len(kept), 100)
+		# the first copy is kept
+		self.assertTrue((kept[frame_source_column] == 0).all())
+		np.testing.assert_array_equal(kept['frame.time_epoch'].values, self.sniffer_0['frame.time_epoch'].values)
+
+	def test_counts_do_not_depend_on_the_chunks(self):
+		merged = merge_sniffers(self.sniffer_0, self.sniffer_1)
+		whole = FrameDeduplicator(window = 0.002)
+		kept_whole = whole.filter_frames(merged)
+
+		chunked = FrameDeduplicator(window = 0.002)
+		kept_chunks = pd.concat([chunked.filter_frames(merged.iloc[idx:idx + 17]) for idx in range(0, len(merged), 17)])
+
+		self.assertEqual((chunked.n_frames, chunked.n_duplicates), (whole.n_frames, whole.n_duplicates))
+		pd.testing.assert_frame_equal(kept_chunks, kept_whole)
+
+	def test_retransmissions_of_a_sniffer_are_kept(self):
+		frames = make_frames([10.0, 10.0005, 10.001], [0, 0, 0])
+		deduplicator = FrameDeduplicator(window = 0.002)
+
+		self.assertEqual(len(deduplicator.filter_frames(frames)), 3)
+		self.assertEqual(deduplicator.n_duplicates, 0)
+
+	def test_each_copy_matches_one_frame(self):
+		# 2 frames of sniffer 0 with the same key, copied once by sniffer 1 and twice by sniffer 2
+		frames = make_frames([10.0, 10.0002, 10.0003, 10.0004, 10.0005, 10.0006], [0, 0, 1, 2, 2, 2])
+		deduplicator = FrameDeduplicator(window = 0.002)
+
+		kept = deduplicator.filter_frames(frames)
+
+		self.assertEqual(deduplicator.n_duplicates, 3)
+		self.assertEqual(kept[frame_source_column].tolist(), [0, 0, 2])
+
+	def test_frames_out_of_the_window_are_kept(self):
+		frames = make_frames([10.0, 10.01], [0, 1])
+		deduplicator = FrameDeduplicator(window = 0.002)
+
+		self.assertEqual(len(deduplicator.filter_frames(frames)), 2)
+		self.assertEqual(deduplicator.n_duplicates, 0)
+
+	def test_sequence_numbers_distinguish_frames(self):
+		frames = make_frames([10.0, 10.0003], [0, 1], sequence_numbers = [1, 2])
+		deduplicator = FrameDeduplicator(window = 0.002)
+
+		self.assertEqual(len(deduplicator.filter_frames(frames)), 2)
+
+	def test_files_with_other_dtypes_for_the_same_key(self):
+		# the sequence numbers of the second sniffer are read as floats (a frame without one), not as integers
+		scratch_dir = tempfile.mkdtemp(prefix = 'frame_dedup_test_')
+		self.addCleanup(shutil.rmtree, scratch_dir, ignore_errors = True)
+		sniffers = [
+			make_frames([10.0, 10.5], [0, 0], sequence_numbers = [1, 2]),
+			make_frames([10.0003, 10.5003, 11.0], [1, 1, 1], sequence_numbers = [1, 2, np.nan]),
+		]
+		chunks = list()
+		for sniffer_idx, frames in enumerate(sniffers):
+			filepath = os.path.join(scratch_dir, 'sniffer_{:d}.csv'.format(sniffer_idx))
+			frames.drop(columns = [frame_source_column, ]).assign(**{'radiotap.dbm_antsignal': -60.0}).to_csv(
+				filepath, index = False)
+			chunk = next(iter_frames_csv_chunks(filepath))
+			chunk[frame_source_column] = sniffer_idx
+			chunks.append(chunk)
+		self.assertNotEqual(chunks[0]['wlan.seq'].dtype, chunks[1]['wlan.seq'].dtype)
+
+		deduplicator = FrameDeduplicator(window = 0.002)
+		kept = [deduplicator.filter_frames(chunk.iloc[[idx]]) for chunk, idx in [
+			(chunks[0], 0), (chunks[1], 0), (chunks[0], 1), (chunks[1], 1), (chunks[1], 2), ]]
+
+		self.assertEqual(deduplicator.n_duplicates, 2)
+		self.assertEqual(sum(len(frames) for frames in kept), 3)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,133 @@
+import contextlib
+import filecmp
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from machine_learning.aux import constants, directories
+from machine_learning.preprocessing.classifier_stage_1 import prepare_dataset
+from preprocessor.convert_frames_to_episodes import get_output_column_order
+
+
+class IncrementalMergeTest(unittest.TestCase):
+
+	def setUp(self):
+		self.scratch_dir = tempfile.mkdtemp(prefix = 'merge_test_')
+		self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors = True)
+		self.rng = np.random.RandomState(0)
+
+		self.training_directories = {cause: os.path.join(self.scratch_dir, 'training', cause.value)
+		                             for cause in constants.ASCause}
+		testing_directory = os.path.join(self.scratch_dir, 'testing')
+		for directory in list(self.training_directories.values()) + [testing_directory, ]:
+			os.makedirs(directory)
+			for idx in range(6):
+				self.write_processed_file(os.path.join(directory, 'file_{:02d}.csv'.format(idx)))
+
+		for patch in [mock.patch.object(constants, 'get_training_data_directories',
+		                                lambda: self.training_directories),
+		              mock.patch.object(directories, 'processed_files_testing', testing_directory), ]:
+			patch.start()
+			self.addCleanup(patch.stop)
+		self.training_labels = prepare_dataset.get_training_labels()
+
+	def write_processed_file(self, filepath, n_episodes = None):
+		if n_episodes is None:
+			n_episodes = self.rng.randint(0, 20)
+		columns = get_output_column_order()
+		dataframe = pd.DataFrame({column: self.rng.randint(0, 100, n_episodes) for column in columns})
+		for column in ['rssi__mean', 'rssi__sd', 'frame__frequency', 'frame__loss_rate', ]:
+			dataframe[column] = self.rng.uniform(0, 100, n_episodes)
+		dataframe['associated_client__mac'] = 'aa:bb:cc:00:00:01'
+		dataframe.to_csv(filepath, index = False)
+
+	def merge(self, outfile, for_training = True, incremental = True):
+		with contextlib.redirect_stdout(io.StringIO()) as output:
+			prepare_dataset.merge_and_label_processed_csv_files(outfile, self.training_labels,
+			                                                    for_training = for_training, batch_size = 4,
+			                                                    incremental = incremental)
+		return [line for line in output.getvalue().splitlines() if 'reused' in line][0]
+
+	def assert_same_as_full_rebuild(self, for_training = True):
+		"""
+		Merges incrementally and from scratch, returns the reused files message of the incremental merge
+		"""
+
+		incremental_file = os.path.join(self.scratch_dir, 'incremental.csv')
+		full_file = os.path.join(self.scratch_dir, 'full.csv')
+		reused = self.merge(incremental_file, for_training = for_training)
+		self.merge(full_file, for_training = for_training, incremental = False)
+		self.assertTrue(filecmp.cmp(incremental_file, full_file, shallow = False))
+		return reused
+
+	def test_unchanged_files_are_reused(self):
+		self.assertIn('0 of 48', self.assert_same_as_full_rebuild())
+		self.assertIn('48 of 48', self.assert_same_as_full_rebuild())
+
+	def test_changes_anywhere_only_read_the_changed_files(self):
+		self.assert_same_as_full_rebuild()
+		bl_directory = self.training_directories[constants.ASCause.bl]
+		pwr_state_directory = self.training_directories[constants.ASCause.pwr_state]
+
+		# files added in the middle and at the end of the output
+		self.write_processed_file(os.path.join(bl_directory, 'file_02a.csv'), n_episodes = 5)
+		self.write_processed_file(os.path.join(pwr_state_directory, 'file_99.csv'), n_episodes = 5)
+		self.assertIn('48 of 50', self.assert_same_as_full_rebuild())
+
+		# a removed file
+		os.remove(os.path.join(bl_directory, 'file_00.csv'))
+		self.assertIn('49 of 49', self.assert_same_as_full_rebuild())
+
+		# a changed file and a touched file (same content)
+		self.write_processed_file(os.path.join(bl_directory, 'file_03.csv'), n_episodes = 7)
+		os.utime(os.path.join(pwr_state_directory, 'file_01.csv'), ns = (0, 0))
+		self.assertIn('48 of 49', self.assert_same_as_full_rebuild())
+
+	def test_relabeled_files_are_read_again(self):
+		self.assert_same_as_full_rebuild()
+		self.training_labels[constants.ASCause.pwr_state] = 1
+		self.assertIn('42 of 48', self.assert_same_as_full_rebuild())
+
+	def test_testing_files(self):
+		self.assertIn('0 of 6', self.assert_same_as_full_rebuild(for_training = False))
+		os.remove(os.path.join(directories.processed_files_testing, 'file_04.csv'))
+		self.assertIn('5 of 5', self.assert_same_as_full_rebuild(for_training = False))
+
+	def test_merge_is_the_sequential_append_of_the_labeled_files(self):
+		outfile = os.path.join(self.scratch_dir, 'merged.csv')
+		self.merge(outfile, incremental = False)
+
+		# each file appended in turn, in the order of the causes then of the files
+		head_features, head_properties = constants.get_processed_data_file_header_segregation(for_training = False)
+		header = head_features + head_properties + [prepare_dataset.get_training_label_header(), ]
+		expected = pd.DataFrame(columns = header).to_csv(index = False)
+		for cause, directory in self.training_directories.items():
+			for filename in prepare_dataset.get_processed_csv_file_names(directory):
+				dataframe = pd.read_csv(os.path.join(directory, filename))
+				dataframe[header[-1]] = self.training_labels[cause]
+				expected += dataframe.to_csv(columns = header, header = False, index = False)
+		with open(outfile) as file:
+			self.assertEqual(file.read(), expected)
+
+	def test_threads_and_batches_do_not_change_the_output(self):
+		outfile = os.path.join(self.scratch_dir, 'merged.csv')
+		contents = list()
+		for max_workers, batch_size in [(1, 1), (8, 5), (3, 64), ]:
+			with contextlib.redirect_stdout(io.StringIO()):
+				prepare_dataset.merge_and_label_processed_csv_files(outfile, self.training_labels,
+				                                                    max_workers = max_workers, batch_size = batch_size,
+				                                                    incremental = False)
+			with open(outfile, 'rb') as file:
+				contents.append(file.read())
+		self.assertEqual(contents[1], contents[0])
+		self.assertEqual(contents[2], contents[0])
+
+
+if __name__ == '__main__':
+	unittest.main()
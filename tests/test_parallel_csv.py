@@ -0,0 +1,89 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from preprocessor import parallel_csv
+from preprocessor.convert_frames_to_episodes import read_frames_csv_file
+from preprocessor.pipelining import shutdown_process_pool
+from preprocessor.synthetic_frames import write_frames_csv_file
+
+
+class ParallelCsvTest(unittest.TestCase):
+
+	def setUp(self):
+		self.scratch_dir = tempfile.mkdtemp(prefix = 'parallel_csv_test_')
+		self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors = True)
+		self.addCleanup(shutdown_process_pool)
+		# ranges of a few kB
+		range_size_patch = mock.patch.object(parallel_csv, 'min_range_size', 1024)
+		range_size_patch.start()
+		self.addCleanup(range_size_patch.stop)
+
+		# the last rows upcast the integer column to float and the float column to object
+		rng = np.random.RandomState(0)
+		n_rows = 2000
+		self.dataframe = pd.DataFrame({
+			'frame.time_epoch': 1500000000.0 + np.cumsum(rng.uniform(0, 1, n_rows)),
+			'wlan.seq': rng.randint(0, 4096, n_rows).astype(object),
+			'radiotap.dbm_antsignal': rng.uniform(-90, -30, n_rows).astype(object),
+			'wlan.ta': ['aa:bb:cc:00:00:{:02x}'.format(idx % 11) for idx in range(n_rows)],
+		})
+		self.dataframe.loc[n_rows - 3, 'wlan.seq'] = np.nan
+		self.dataframe.loc[n_rows - 2, 'radiotap.dbm_antsignal'] = '-50,-52'
+		self.filepath = os.path.join(self.scratch_dir, 'frames.csv')
+		self.dataframe.to_csv(self.filepath, index = False)
+
+	def test_byte_ranges_are_the_lines_after_the_header(self):
+		header, byte_ranges = parallel_csv.find_byte_ranges(self.filepath, 7)
+
+		with open(self.filepath, 'rb') as f:
+			content = f.read()
+		self.assertEqual(len(byte_ranges), 7)
+		self.assertEqual(header, content[:len(header)])
+		self.assertEqual(byte_ranges[0][0], len(header))
+		self.assertEqual(byte_ranges[-1][1], len(content))
+		for (_, end), (start, _) in zip(byte_ranges[:-1], byte_ranges[1:]):
+			self.assertEqual(end, start)
+			self.assertEqual(content[start - 1:start], b'\n')
+
+	def test_same_dataframe_as_read_csv(self):
+		expected_df = pd.read_csv(self.filepath)
+		# the numbers of a text column are text
+		self.assertIsInstance(expected_df['radiotap.dbm_antsignal'][0], str)
+
+		for n_workers in [2, 5, ]:
+			pd.testing.assert_frame_equal(parallel_csv.read_csv_parallel(self.filepath, n_workers = n_workers),
+			                              expected_df)
+		# with options
+		pd.testing.assert_frame_equal(
+			parallel_csv.read_csv_parallel(self.filepath, n_workers = 3, usecols = ['wlan.ta', 'wlan.seq', ]),
+			pd.read_csv(self.filepath, usecols = ['wlan.ta', 'wlan.seq', ]))
+
+	def test_compressed_files_are_read_at_once(self):
+		compressed_filepath = self.filepath + '.gz'
+		self.dataframe.to_csv(compressed_filepath, index = False)
+
+		with mock.patch.object(parallel_csv, 'find_byte_ranges') as find_byte_ranges:
+			dataframe = parallel_csv.read_csv_parallel(compressed_filepath, n_workers = 4)
+		find_byte_ranges.assert_not_called()
+		pd.testing.assert_frame_equal(dataframe, pd.read_csv(self.filepath))
+
+	def test_frames_csv_file(self):
+		frames_csv_file = os.path.join(self.scratch_dir, 'capture.csv')
+		write_frames_csv_file(frames_csv_file, n_clients = 2, duration = 120.0, seed = 1)
+
+		with contextlib.redirect_stdout(io.StringIO()):
+			expected_df = read_frames_csv_file(frames_csv_file)
+			dataframe = read_frames_csv_file(frames_csv_file, read_workers = 4)
+		pd.testing.assert_frame_equal(dataframe, expected_df)
+
+
+if __name__ == '__main__':
+	unittest.main()
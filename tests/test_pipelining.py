@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import pandas as pd
+
+from preprocessor.pipelining import AsyncWriter, append_to_csv_file, prefetch
+
+
+class PrefetchTest(unittest.TestCase):
+
+	def test_items_in_order(self):
+		self.assertEqual(list(prefetch(iter(range(10)), depth = 3)), list(range(10)))
+		self.assertEqual(list(prefetch([])), [])
+
+	def test_errors_are_raised_in_the_consumer(self):
+		def __items():
+			yield 1
+			raise KeyError('item')
+
+		consumed = list()
+		with self.assertRaises(KeyError):
+			for item in prefetch(__items()):
+				consumed.append(item)
+		self.assertEqual(consumed, [1, ])
+
+	def test_producer_stops_when_the_consumer_stops(self):
+		produced = list()
+		closed = threading.Event()
+
+		def __items():
+			try:
+				for item in range(100):
+					produced.append(item)
+					yield item
+			finally:
+				closed.set()
+
+		for item in prefetch(__items(), depth = 2):
+			if item == 4:
+				break
+
+		self.assertTrue(closed.wait(5.0))
+		# at most the prefetched items after the last consumed one
+		self.assertLessEqual(len(produced), 5 + 2)
+
+
+class AsyncWriterTest(unittest.TestCase):
+
+	def setUp(self):
+		self.scratch_dir = tempfile.mkdtemp(prefix = 'pipelining_test_')
+		self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors = True)
+
+	def test_jobs_run_in_submission_order(self):
+		filepath = os.path.join(self.scratch_dir, 'output.csv')
+		chunks = [pd.DataFrame({'a': [idx, idx + 1], 'b': ['x', 'y']}) for idx in range(0, 20, 2)]
+
+		with AsyncWriter(max_pending = 2) as writer:
+			for chunk in chunks:
+				writer.submit('write', lambda chunk = chunk: append_to_csv_file(chunk, filepath, columns = ['a', 'b']),
+				              rows = len(chunk))
+
+		# a single header
+		pd.testing.assert_frame_equal(pd.read_csv(filepath), pd.concat(chunks, ignore_index = True))
+
+	def test_errors_are_raised_in_the_caller(self):
+		ran = list()
+
+		def __fail():
+			raise OSError('disk full')
+
+		with self.assertRaises(OSError):
+			with AsyncWriter() as writer:
+				writer.submit('write', __fail)
+				writer.submit('write', lambda: ran.append(True))
+		# the jobs after the error are dropped
+		self.assertEqual(ran, [])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from preprocessor import convert_frames_to_episodes, directories
+from preprocessor.convert_frames_to_episodes import MappingParameters, process_frame_csv_file, \
+	process_frame_csv_file_resumable
+from preprocessor.run_journal import RunJournal
+from preprocessor.synthetic_frames import write_frames_csv_file
+
+frames_csv_name = 'capture.csv'
+
+
+class Crash(Exception):
+	pass
+
+
+class ResumableRunTest(unittest.TestCase):
+
+	def setUp(self):
+		self.scratch_dir = tempfile.mkdtemp(prefix = 'run_journal_test_')
+		self.frames_dir = os.path.join(self.scratch_dir, 'frames_csv_files')
+		os.mkdir(self.frames_dir)
+		write_frames_csv_file(os.path.join(self.frames_dir, frames_csv_name), n_clients = 4, duration = 600.0,
+		                      seed = 3)
+
+		temporary_patch = mock.patch.object(directories, 'temporary', os.path.join(self.scratch_dir, 'temporary'))
+		temporary_patch.start()
+		self.addCleanup(temporary_patch.stop)
+		self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors = True)
+
+	def make_run(self, name):
+		"""
+		Output directories and journal of a run
+		"""
+
+		run_dir = os.path.join(self.scratch_dir, name)
+		for directory in ['semi_processed', 'processed', ]:
+			os.makedirs(os.path.join(run_dir, directory))
+		return run_dir, RunJournal(os.path.join(run_dir, 'journal.sqlite'))
+
+	def process(self, run_dir, journal):
+		process_frame_csv_file_resumable(frames_csv_name, access_points = None, clients = None,
+		                                 assign_rbs_tags = True, separate_client_files = False,
+		                                 mapping_file = os.path.join(run_dir, 'mapping.csv'), journal = journal,
+		                                 frames_csv_dir = self.frames_dir,
+		                                 semi_processed_dir = os.path.join(run_dir, 'semi_processed'),
+		                                 processed_dir = os.path.join(run_dir, 'processed'))
+
+	def read_output_files(self, run_dir):
+		"""
+		Content of the processed episodes and semi processed frames files of a run, without the uuid of the file
+		"""
+
+		semi_processed_dir = os.path.join(run_dir, 'semi_processed')
+		semi_processed_name = os.listdir(semi_processed_dir)[0]
+		uuid = os.path.splitext(semi_processed_name)[0]
+		contents = list()
+		for filepath in [os.path.join(run_dir, 'processed', frames_csv_name),
+		                 os.path.join(semi_processed_dir, semi_processed_name), ]:
+			with open(filepath) as file:
+				contents.append(file.read().replace(uuid, ''))
+		return contents
+
+	def read_outputs(self, run_dir):
+		"""
+		Processed episodes, semi processed frames file content (both without the uuid of the file) and mapping file
+		of a run
+		"""
+
+		processed_dir = os.path.join(run_dir, 'processed')
+		self.assertEqual(os.listdir(processed_dir), [frames_csv_name, ])
+		self.assertEqual(len(os.listdir(os.path.join(run_dir, 'semi_processed'))), 1)
+		episodes_df = pd.read_csv(os.path.join(processed_dir, frames_csv_name))
+		mapping_df = pd.read_csv(os.path.join(run_dir, 'mapping.csv'))
+		return episodes_df.drop(columns = ['frames_file__uuid', ], errors = 'ignore'), \
+		       self.read_output_files(run_dir)[1], mapping_df
+
+	def test_resumed_run_has_the_outputs_of_an_uninterrupted_run(self):
+		reference_dir, reference_journal = self.make_run('reference')
+		with reference_journal:
+			self.process(reference_dir, reference_journal)
+		reference_episodes_df, reference_frames, _ = self.read_outputs(reference_dir)
+		self.assertGreater(len(reference_episodes_df), 0)
+
+		# crash while processing the third client
+		run_dir, journal = self.make_run('resumed')
+		process_client_frames = convert_frames_to_episodes.process_client_frames
+		n_calls = [0, ]
+
+		def crashing_process_client_frames(*args, **kwargs):
+			n_calls[0] += 1
+			if n_calls[0] == 3:
+				raise Crash()
+			return process_client_frames(*args, **kwargs)
+
+		with journal:
+			with mock.patch.object(convert_frames_to_episodes, 'process_client_frames',
+			                       crashing_process_client_frames):
+				with self.assertRaises(Crash):
+					self.process(run_dir, journal)
+			self.assertEqual(len(journal.get_completed_units(frames_csv_name)), 2)
+			self.assertEqual(os.listdir(os.path.join(run_dir, 'processed')), [])
+
+			# the resumed run only processes the remaining clients
+			n_calls[0] = 0
+			with mock.patch.object(convert_frames_to_episodes, 'process_client_frames',
+			                       crashing_process_client_frames):
+				self.process(run_dir, journal)
+			self.assertEqual(n_calls[0], 2)
+			self.assertTrue(journal.is_file_completed(frames_csv_name))
+
+		episodes_df, frames, mapping_df = self.read_outputs(run_dir)
+		pd.testing.assert_frame_equal(episodes_df, reference_episodes_df)
+		self.assertEqual(frames, reference_frames)
+		self.assertFalse(episodes_df.duplicated().any())
+		self.assertEqual(len(mapping_df), 1)
+
+	def test_crash_after_the_outputs_are_moved_does_not_duplicate_them(self):
+		reference_dir, reference_journal = self.make_run('reference')
+		with reference_journal:
+			self.process(reference_dir, reference_journal)
+		reference_episodes_df, reference_frames, _ = self.read_outputs(reference_dir)
+
+		# crash before the file is recorded as completed, the outputs and the mapping entry are already written
+		run_dir, journal = self.make_run('resumed')
+		with journal:
+			with mock.patch.object(journal, 'complete_file', side_effect = Crash()):
+				with self.assertRaises(Crash):
+					self.process(run_dir, journal)
+			uuid = journal.start_file(frames_csv_name, 'unused', 'unused')[0]
+			self.process(run_dir, journal)
+			self.assertTrue(journal.is_file_completed(frames_csv_name))
+
+		episodes_df, frames, mapping_df = self.read_outputs(run_dir)
+		pd.testing.assert_frame_equal(episodes_df, reference_episodes_df)
+		self.assertEqual(frames, reference_frames)
+		self.assertEqual(mapping_df[MappingParameters.frames_file__uuid.value].tolist(), [uuid, ])
+
+	def test_outputs_are_the_outputs_of_process_frame_csv_file(self):
+		run_dir, journal = self.make_run('journaled')
+		with journal:
+			self.process(run_dir, journal)
+		reference_dir, _ = self.make_run('reference')
+		process_frame_csv_file(frames_csv_name, access_points = None, clients = None, assign_rbs_tags = True,
+		                       separate_client_files = False, mapping_file = os.path.join(reference_dir, 'mapping.csv'),
+		                       frames_csv_dir = self.frames_dir,
+		                       semi_processed_dir = os.path.join(reference_dir, 'semi_processed'),
+		                       processed_dir = os.path.join(reference_dir, 'processed'))
+
+		episodes, frames = self.read_output_files(run_dir)
+		self.assertEqual([episodes, frames], self.read_output_files(reference_dir))
+		# a header before the frames of each client
+		header = frames.splitlines()[0]
+		self.assertEqual(frames.splitlines().count(header), 4)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,119 @@
+import contextlib
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from machine_learning import run_model
+from machine_learning.aux import constants
+from machine_learning.aux.constants import get_processed_data_file_header_segregation
+from machine_learning.aux.persist import save_model
+from machine_learning.cascade_model import CascadeModel
+from machine_learning.preprocessing.classifier_stage_1.prepare_dataset import \
+	get_training_labels as get_stage_1_training_labels
+from machine_learning.preprocessing.classifier_stage_2.prepare_dataset import \
+	get_training_labels as get_stage_2_training_labels
+
+
+class BatchRunTest(unittest.TestCase):
+
+	def setUp(self):
+		self.scratch_dir = tempfile.mkdtemp(prefix = 'run_model_test_')
+		self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors = True)
+
+		# processed episodes (with the episode key columns and rule based system tags)
+		feature_set, extra_properties = get_processed_data_file_header_segregation(for_training = False)
+		rng = np.random.RandomState(0)
+		n_rows = 2500
+		dataframe = pd.DataFrame({column: rng.randint(0, 100, n_rows) for column in feature_set})
+		dataframe[extra_properties[0]] = 'aa:bb:cc:00:00:01'
+		dataframe['frames_file__uuid'] = 'uuid-1'
+		dataframe['episode__id'] = np.arange(n_rows)
+		dataframe['rbs__cause_tags'] = rng.choice(['d', 'h', 'ab', None, ], n_rows)
+		dataframe['true_cause'] = rng.choice(['bl', 'lrssi', 'pscan_assoc', ], n_rows)
+		self.in_file = os.path.join(self.scratch_dir, 'episodes.csv')
+		dataframe.to_csv(self.in_file, index = False)
+		self.empty_in_file = os.path.join(self.scratch_dir, 'no_episodes.csv')
+		dataframe.iloc[:0].to_csv(self.empty_in_file, index = False)
+
+		# stage 1 labels (0, 1: periodic scans) and stage 2 labels learned from the first features
+		x = dataframe[feature_set].values.astype(float)
+		stage_1_model = RandomForestClassifier(5, random_state = 0).fit(x, x[:, 0] // 34)
+		stage_2_model = RandomForestClassifier(5, random_state = 0).fit(x, x[:, 1] // 17)
+		cascade_model = CascadeModel(stage_1_model, stage_2_model, get_stage_1_training_labels(),
+		                             get_stage_2_training_labels())
+		cascade_model.set_gating(stage_1_threshold = 0.8,
+		                         rbs_rules = {'d': constants.ASCause.lrssi, 'h': constants.ASCause.bl, })
+		self.model_files = dict()
+		with contextlib.redirect_stdout(io.StringIO()):
+			for name, model in [('stage_1', stage_1_model), ('stage_2', stage_2_model), ('cascade', cascade_model), ]:
+				self.model_files[name] = os.path.join(self.scratch_dir, name + '.pkl')
+				save_model(model, self.model_files[name])
+
+	def run_model(self, name, in_file = None, stage = None, **kwargs):
+		"""
+		Output file content, indexed predictions and printed report of a run
+		"""
+
+		out_file = os.path.join(self.scratch_dir, 'output.csv')
+		index_file = os.path.join(self.scratch_dir, 'index.sqlite')
+		for filepath in [out_file, index_file, ]:
+			if os.path.exists(filepath):
+				os.remove(filepath)
+		with contextlib.redirect_stdout(io.StringIO()) as output:
+			run_model.run(self.model_files[name], in_file or self.in_file, out_file, stage = stage,
+			              episode_index_file = index_file, **kwargs)
+		with open(out_file) as file:
+			content = file.read()
+		predictions = None
+		if os.path.exists(index_file):
+			connection = sqlite3.connect(index_file)
+			predictions = connection.execute('SELECT * FROM predictions ORDER BY episode__id, stage').fetchall()
+			connection.close()
+		return content, predictions, output.getvalue()
+
+	def test_batches_give_the_output_of_a_single_run(self):
+		for name, stage in [('stage_1', 1), ('stage_2', 2), ('stage_2', None), ('cascade', None), ]:
+			content, predictions, report = self.run_model(name, stage = stage, true_cause_column = 'true_cause')
+			self.assertEqual(len(predictions), 2500)
+			for chunksize, workers in [(700, 1), (600, 2), (100000, 2), ]:
+				batch_content, batch_predictions, batch_report = self.run_model(
+					name, stage = stage, chunksize = chunksize, workers = workers, true_cause_column = 'true_cause')
+				self.assertEqual(batch_content, content, (name, chunksize, workers))
+				self.assertEqual(batch_predictions, predictions)
+				self.assertEqual(batch_report, report)
+
+	def test_cascade_output(self):
+		content, predictions, report = self.run_model('cascade', chunksize = 1000, workers = 2,
+		                                              true_cause_column = 'true_cause')
+
+		output_df = pd.read_csv(io.StringIO(content))
+		self.assertEqual(list(output_df.columns[-3:]), ['prediction__stage', 'prediction__label', 'prediction__name'])
+		rbs_tags = pd.read_csv(self.in_file)['rbs__cause_tags'].values
+		np.testing.assert_array_equal(output_df['prediction__stage'].values == 0, np.isin(rbs_tags, ['d', 'h', ]))
+		self.assertEqual(sorted(set(stage for _, _, _, stage, _, _, _ in predictions)), [0, 1, 2])
+		# the gating report, with the accuracy delta of the gates
+		self.assertIn('Gating: ', report)
+		self.assertIn("'accuracy_delta'", report)
+
+	def test_input_without_episodes(self):
+		content, _, _ = self.run_model('cascade', chunksize = 1000, workers = 2)
+
+		for name, stage in [('cascade', None), ('stage_2', 2), ('stage_1', None), ]:
+			empty_content, predictions, _ = self.run_model(name, in_file = self.empty_in_file, stage = stage,
+			                                               chunksize = 1000, workers = 2)
+			self.assertEqual(len(empty_content.splitlines()), 1)
+			self.assertIsNone(predictions)
+		# the header of the output
+		self.assertEqual(self.run_model('cascade', in_file = self.empty_in_file, chunksize = 1000)[0],
+		                 content.splitlines(keepends = True)[0])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,96 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from machine_learning.aux import helpers
+from machine_learning.aux.constants import get_processed_data_file_header_segregation
+from machine_learning.preprocessing.classifier_stage_1 import prepare_dataset
+
+
+class StreamingTrainingSampleTest(unittest.TestCase):
+
+	def setUp(self):
+		self.scratch_dir = tempfile.mkdtemp(prefix = 'training_sample_test_')
+		self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors = True)
+
+		# merged dataset: the first feature numbers the rows, labels 0 (10%), 1 (20%) and 2 (70%)
+		self.feature_set, self.target_set, _ = get_processed_data_file_header_segregation(for_training = True)
+		rng = np.random.RandomState(0)
+		n_rows = 5000
+		dataframe = pd.DataFrame({column: rng.randint(0, 100, n_rows) for column in self.feature_set})
+		dataframe[self.feature_set[0]] = np.arange(n_rows)
+		dataframe[self.target_set[0]] = rng.choice([0, 1, 2], n_rows, p = [0.1, 0.2, 0.7])
+		dataframe['associated_client__mac'] = 'aa:bb:cc:00:00:01'
+		self.merged_file = os.path.join(self.scratch_dir, 'merged.csv')
+		dataframe.to_csv(self.merged_file, index = False)
+		self.labels = dataframe[self.target_set[0]].values
+
+	def sample(self, proportions, seed = 0, chunksize = 1000, merged_file = None):
+		outfile = os.path.join(self.scratch_dir, 'training.npy')
+		with contextlib.redirect_stdout(io.StringIO()):
+			prepare_dataset.create_training_dataset_streaming(merged_file or self.merged_file, outfile, proportions,
+			                                                  seed = seed, chunksize = chunksize)
+		# not memory mapped: the next sample overwrites the file
+		return helpers.read_training_dataset(outfile, mmap = False)
+
+	def test_sample_sizes_follow_the_proportions(self):
+		n_label_0 = np.count_nonzero(self.labels == 0)
+		proportions = {2: 600, 1: 100, 0: n_label_0 + 50}
+
+		x, y = self.sample(proportions, seed = 7)
+
+		# at most the rows of the label, labels in the order of the proportions
+		np.testing.assert_array_equal(np.bincount(y.astype(int)), [n_label_0, 100, 600])
+		self.assertEqual(y[:600].tolist(), [2, ] * 600)
+		self.assertEqual(y[600:700].tolist(), [1, ] * 100)
+
+		# rows of the dataset, in file order within a label, without repetitions
+		row_numbers = x[:, 0].astype(int)
+		np.testing.assert_array_equal(self.labels[row_numbers], y)
+		for label in proportions.keys():
+			label_rows = row_numbers[y == label]
+			self.assertTrue((np.diff(label_rows) > 0).all())
+		# the whole label when the sample size is larger than the label
+		np.testing.assert_array_equal(row_numbers[y == 0], np.flatnonzero(self.labels == 0))
+
+	def test_seeded_sample_does_not_depend_on_the_chunks(self):
+		proportions = prepare_dataset.get_training_label_proportions()
+
+		x, y = self.sample(proportions, seed = 3, chunksize = 1000)
+		x_chunks, y_chunks = self.sample(proportions, seed = 3, chunksize = 777)
+		x_other, _ = self.sample(proportions, seed = 4, chunksize = 1000)
+
+		np.testing.assert_array_equal(x, x_chunks)
+		np.testing.assert_array_equal(y, y_chunks)
+		self.assertFalse(np.array_equal(x, x_other))
+
+	def test_rows_are_sampled_uniformly(self):
+		# 10 of 50 rows of a label, over 200 seeds: every row is in about 20% of the samples
+		small_file = os.path.join(self.scratch_dir, 'small.csv')
+		small_df = pd.read_csv(self.merged_file, nrows = 50)
+		small_df[self.target_set[0]] = 0
+		small_df.to_csv(small_file, index = False)
+
+		inclusions = np.zeros(50)
+		for seed in range(200):
+			x, _ = self.sample({0: 10}, seed = seed, chunksize = 7, merged_file = small_file)
+			inclusions[x[:, 0].astype(int)] += 1
+
+		self.assertEqual(inclusions.sum(), 2000)
+		self.assertGreater(inclusions.min() / 200, 0.08)
+		self.assertLess(inclusions.max() / 200, 0.32)
+
+	def test_without_proportions_all_the_rows_are_kept(self):
+		x, y = self.sample(None)
+
+		np.testing.assert_array_equal(np.bincount(y.astype(int)), np.bincount(self.labels))
+
+
+if __name__ == '__main__':
+	unittest.main()